@@ -0,0 +1,87 @@
+"""
+Small scenario builders shared by the tests.
+"""
+
+from uxsim import *
+
+def equal_tolerance(val, check, rel_tol=0.1, abs_tol=0.0):
+    if check == 0 and abs_tol == 0:
+        abs_tol = 0.1
+    return abs(val - check) <= abs(check*rel_tol) + abs_tol
+
+def make_world(**kwargs):
+    """
+    Create a World that prints and saves nothing. The keyword arguments override the defaults (deltan=5, tmax=2000, random_seed=0).
+    """
+    params = dict(name="", deltan=5, tmax=2000, print_mode=0, save_mode=0, show_mode=0, random_seed=0)
+    params.update(kwargs)
+    return World(**params)
+
+def add_line(W, node_names=("orig", "mid", "dest"), length=1000, free_flow_speed=20, link_kwargs=None):
+    """
+    Add a straight road. The nodes are placed at x = 0, 1, 2, ... and the links are named "link1", "link2", ...
+
+    Parameters
+    ----------
+    W : World
+        The World.
+    node_names : list of str, optional
+        The names of the nodes from upstream.
+    length : float, optional
+        The length of each link.
+    free_flow_speed : float, optional
+        The free flow speed of each link.
+    link_kwargs : list of dict, optional
+        Additional keyword arguments of `addLink` for each link.
+
+    Returns
+    -------
+    list of Link
+        The links from upstream.
+    """
+    for i, name in enumerate(node_names):
+        W.addNode(name, i, 0)
+    links = []
+    for i in range(len(node_names)-1):
+        kwargs = link_kwargs[i] if link_kwargs != None else {}
+        links.append(W.addLink(f"link{i+1}", node_names[i], node_names[i+1], length=length, free_flow_speed=free_flow_speed, **kwargs))
+    return links
+
+def add_two_routes(W, capacity_out=0.4):
+    """
+    Add two parallel routes orig-mid1-dest and orig-mid2-dest. The first links of the routes ("link11" and "link21") are bottlenecks.
+    """
+    W.addNode("orig", 0, 0)
+    W.addNode("mid1", 1, 1)
+    W.addNode("mid2", 1, -1)
+    W.addNode("dest", 2, 0)
+    W.addLink("link11", "orig", "mid1", length=1000, free_flow_speed=20, capacity_out=capacity_out)
+    W.addLink("link12", "mid1", "dest", length=1000, free_flow_speed=20)
+    W.addLink("link21", "orig", "mid2", length=1000, free_flow_speed=20, capacity_out=capacity_out)
+    W.addLink("link22", "mid2", "dest", length=1000, free_flow_speed=20)
+
+def add_grid(W, n, spacing=1, length=500, free_flow_speed=20):
+    """
+    Add a n x n grid network with two-way links. The node at (i, j) is named "n{i}_{j}", and the link from "n{i}_{j}" to "n{k}_{l}" is named "l{i}_{j}_{k}_{l}".
+
+    Parameters
+    ----------
+    W : World
+        The World.
+    n : int
+        The number of nodes on each side.
+    spacing : float, optional
+        The distance between the coordinates of adjacent nodes.
+    length : float, optional
+        The length of each link.
+    free_flow_speed : float, optional
+        The free flow speed of each link.
+    """
+    for i in range(n):
+        for j in range(n):
+            W.addNode(f"n{i}_{j}", i*spacing, j*spacing)
+    for i in range(n):
+        for j in range(n):
+            for di, dj in [(1, 0), (-1, 0), (0, 1), (0, -1)]:
+                if 0 <= i+di < n and 0 <= j+dj < n:
+                    W.addLink(f"l{i}_{j}_{i+di}_{j+dj}", f"n{i}_{j}", f"n{i+di}_{j+dj}", length=length, free_flow_speed=free_flow_speed)
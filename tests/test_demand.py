@@ -0,0 +1,112 @@
+"""
+Tests of demand generation.
+"""
+
+import pytest
+from uxsim import *
+from scenario_builders import *
+
+def test_adddemand_bulk():
+    def world():
+        W = make_world(tmax=7200)
+        for i in range(4):
+            W.addNode(f"n{i}", i, i%2)
+        for i in range(4):
+            for j in range(4):
+                if i != j:
+                    W.addLink(f"l{i}_{j}", f"n{i}", f"n{j}", length=1000)
+        return W
+    def vehicles(W):
+        return [(veh.name, veh.orig.name, veh.dest.name, veh.departure_time) for veh in W.VEHICLES.values()]
+
+    rng = np.random.default_rng(0)
+    rows = []
+    for k in range(100):
+        o, d = rng.choice(4, 2, replace=False)
+        t_start = float(rng.integers(0, 20)*150)
+        t_end = t_start+float(rng.integers(1, 30)*77)
+        flow = float(rng.choice([rng.random(), 0.5, 0.1, 1/3, 1.2]))
+        volume = float(rng.choice([-1, rng.integers(1, 300)]))
+        rows.append((f"n{o}", f"n{d}", t_start, t_end, flow, volume))
+
+    W1 = world()
+    for r in rows:
+        W1.adddemand(*r)
+    W2 = world()
+    W2.adddemand_from_dataframe(pd.DataFrame(rows, columns=["orig", "dest", "t_start", "t_end", "flow", "volume"]))
+    assert len(W1.VEHICLES) > 1000
+    assert vehicles(W1) == vehicles(W2)
+
+    od = rng.integers(0, 50, (3, 4, 4)).astype(float)
+    t_slices = [0, 1000, 2500, 3600]
+    W1 = world()
+    for i in range(3):
+        for o in range(4):
+            for d in range(4):
+                W1.adddemand(W1.NODES[o], W1.NODES[d], t_slices[i], t_slices[i+1], volume=od[i,o,d])
+    W2 = world()
+    W2.adddemand_od_tensor(od, t_slices, unit="volume")
+    assert vehicles(W1) == vehicles(W2)
+    with pytest.raises(ValueError):
+        W2.adddemand_od_tensor(od[:, :3], t_slices)
+
+def test_lazy_vehicle_creation():
+    def world(lazy):
+        W = make_world(tmax=4000, random_seed=42, duo_update_time=300, lazy_vehicle_creation=lazy)
+        add_grid(W, 4)
+        W.addVehicle("n0_0", "n3_3", 100, name="manual")
+        for i in range(4):
+            W.adddemand(f"n0_{i}", f"n3_{3-i}", 0, 2000, 0.3)
+            W.adddemand(f"n{i}_0", f"n{3-i}_3", 500, 3000, 0.25)
+        W.adddemand("n2_2", "n0_0", 3900, 5000, 0.5) #出発しない車両
+        return W
+    def results(W):
+        return [(veh.name, veh.id, veh.state, veh.departure_time, veh.travel_time, veh.color, veh.log_t_link[-1][0], list(veh.log_t), list(veh.log_x)) for veh in W.VEHICLES.values()]
+
+    W1 = world(0)
+    W1.exec_simulation()
+    W2 = world(1)
+    assert len(W2.VEHICLES) == len(W1.VEHICLES) and W2.DEPARTURE_SCHEDULER.pending_size == len(W1.VEHICLES)-1
+    assert "10" in W2.VEHICLES and "manual" in W2.VEHICLES and "nonexistent" not in W2.VEHICLES
+    W2.exec_simulation(until_t=1000)
+    veh = W2.VEHICLES[str(len(W2.VEHICLES)-10)] #出発前にアクセス
+    assert veh.state == "home"
+    W2.exec_simulation()
+    assert W2.DEPARTURE_SCHEDULER.pending_size == 0
+    assert results(W1) == results(W2)
+    assert W1.analyzer.basic_to_pandas().equals(W2.analyzer.basic_to_pandas())
+
+    W3 = world(1)
+    with pytest.raises(ValueError):
+        W3.addVehicle("n0_0", "n3_3", 0, name="10")
+
+def test_lazy_small_demands():
+    def world(lazy):
+        W = make_world(tmax=3000, lazy_vehicle_creation=lazy)
+        add_line(W, node_names=[f"n{i}" for i in range(6)])
+        rng = np.random.default_rng(0)
+        for k in range(1500):
+            o = int(rng.integers(0, 4))
+            t = float(rng.uniform(0, 1500))
+            W.adddemand(f"n{o}", f"n{int(rng.integers(o+1, 6))}", t, t+5, volume=5)
+        return W
+    def results(W):
+        return [(veh.name, veh.departure_time, veh.travel_time, veh.color, list(veh.log_x)) for veh in W.VEHICLES.values()]
+
+    W1 = world(0)
+    W1.exec_simulation(until_t=1000)
+    W1.adddemand("n0", "n5", 500, 1500, 0.2) #一部は出発時刻が過ぎている
+    W1.adddemand("n1", "n5", 1200, 1300, 0.2)
+    W1.exec_simulation()
+
+    W2 = world(1)
+    scheduler = W2.DEPARTURE_SCHEDULER
+    assert scheduler.pending_size == len(W2.VEHICLES) > 1400 and len(scheduler.pending) == 2 #連続する小さい需要はまとめられる
+    assert W2.VEHICLES["1300"].name == "1300" and scheduler.pending_size == len(W2.VEHICLES)-1
+    W2.exec_simulation(until_t=1000)
+    W2.adddemand("n0", "n5", 500, 1500, 0.2)
+    W2.adddemand("n1", "n5", 1200, 1300, 0.2)
+    assert len(scheduler.pending) == 4 #出発時刻が過ぎた需要を含むとまとめない
+    W2.exec_simulation()
+    assert scheduler.pending_size == 0
+    assert results(W1) == results(W2)
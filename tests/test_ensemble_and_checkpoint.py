@@ -0,0 +1,152 @@
+"""
+Tests of ensembles, checkpoints, and forking of simulations.
+"""
+
+import pytest
+from uxsim import *
+from scenario_builders import *
+
+def test_ensemble():
+    from uxsim.Ensemble import run_ensemble
+
+    def factory(seed):
+        W = make_world(random_seed=seed, duo_update_time=100)
+        add_two_routes(W)
+        W.adddemand("orig", "dest", 0, 1000, 0.7)
+        return W
+
+    seeds = [0, 1, 2, 3]
+    res_sequential = run_ensemble(factory, seeds=seeds, workers=1)
+    res_parallel = run_ensemble(factory, seeds=seeds, workers=2)
+    for r1, r2 in zip(res_sequential, res_parallel):
+        for key in ["basic", "od", "link"]:
+            assert r1[key].equals(r2[key])
+    vols = [r["link"]["traffic_volume"].values[0] for r in res_parallel]
+    assert len(set(vols)) > 1 #seeds matter
+    assert res_parallel[0]["basic"]["total_trips"].values[0] == 700
+
+    #base World and modifiers
+    W = factory(0)
+    def modifier(rate):
+        def f(W):
+            W.get_link("link11").free_flow_speed = rate*20
+        return f
+    res = run_ensemble(W, modifiers=[modifier(1), modifier(0.1)], seeds=[0, 0], workers=2, summarize=lambda W: W.analyzer.link_to_pandas())
+    assert res[0]["traffic_volume"].values[0] > res[1]["traffic_volume"].values[0]
+    assert W.finalized == 0 #the base World is not modified
+
+    with pytest.raises(ValueError):
+        run_ensemble(factory)
+
+def test_checkpoint(tmp_path):
+    def scenario():
+        W = make_world(tmax=3000, random_seed=42)
+        W.addNode("orig1", 0, 0)
+        W.addNode("orig2", 0, 2)
+        W.addNode("merge", 1, 1, signal=[30, 60])
+        W.addNode("mid", 2, 1)
+        W.addNode("dest", 3, 1)
+        W.addLink("link1", "orig1", "merge", length=1000, free_flow_speed=20, signal_group=0)
+        W.addLink("link2", "orig2", "merge", length=1000, free_flow_speed=20, signal_group=1)
+        W.addLink("link3", "merge", "mid", length=1000, free_flow_speed=20)
+        W.addLink("link3b", "merge", "mid", length=1500, free_flow_speed=20, capacity_out=0.4)
+        W.addLink("link4", "mid", "dest", length=1000, free_flow_speed=20, number_of_lanes=2)
+        W.adddemand("orig1", "dest", 0, 1500, 0.45)
+        W.adddemand("orig2", "dest", 300, 1800, 0.6)
+        return W
+
+    W = scenario()
+    W.addVehicle("orig1", "dest", 500, name="added")
+    W.exec_simulation(until_t=1000)
+    W.save_checkpoint(tmp_path/"checkpoint.npz")
+    W.exec_simulation()
+
+    #the restored simulation continues identically, including the random numbers
+    W2 = scenario()
+    W2.addVehicle("orig2", "dest", 100, name="not_in_checkpoint")
+    W2.load_checkpoint(tmp_path/"checkpoint.npz")
+    assert W2.TIME == 1000 - W.DELTAT
+    assert "added" in W2.VEHICLES and "not_in_checkpoint" not in W2.VEHICLES
+    W2.exec_simulation()
+
+    assert W.analyzer.vehicles_to_pandas().equals(W2.analyzer.vehicles_to_pandas())
+    assert W.analyzer.basic_to_pandas().equals(W2.analyzer.basic_to_pandas())
+    for l, l2 in zip(W.LINKS, W2.LINKS):
+        assert (l.cum_arrival == l2.cum_arrival).all()
+        assert (l.traveltime_actual == l2.traveltime_actual).all()
+    for n, n2 in zip(W.NODES, W2.NODES):
+        assert n.signal_log == n2.signal_log
+
+    W3 = make_world(tmax=3000)
+    W3.addNode("orig1", 0, 0)
+    with pytest.raises(ValueError):
+        W3.load_checkpoint(tmp_path/"checkpoint.npz")
+
+def test_checkpoint_lazy_vehicles(tmp_path):
+    def scenario():
+        W = make_world(tmax=3000, lazy_vehicle_creation=1)
+        add_line(W, ["orig", "mid", "dest"], 1000, 20)
+        W.adddemand("orig", "dest", 0, 2000, 0.4, attribute="a")
+        W.adddemand("mid", "dest", 500, 2500, 0.3)
+        return W
+
+    W = scenario()
+    W.exec_simulation(until_t=1000)
+    pending_size = W.DEPARTURE_SCHEDULER.pending_size
+    assert pending_size > 0
+    W.save_checkpoint(tmp_path/"checkpoint.npz")
+    assert W.DEPARTURE_SCHEDULER.pending_size == pending_size #保存で未生成の車両は作られない
+    W.exec_simulation()
+
+    W2 = scenario()
+    W2.load_checkpoint(tmp_path/"checkpoint.npz")
+    assert W2.DEPARTURE_SCHEDULER.pending_size == pending_size
+    W2.exec_simulation()
+
+    assert W.analyzer.vehicles_to_pandas().equals(W2.analyzer.vehicles_to_pandas())
+    assert [veh.attribute for veh in W.VEHICLES.values()] == [veh.attribute for veh in W2.VEHICLES.values()]
+
+    W3 = make_world(tmax=3000)
+    add_line(W3, ["orig", "mid", "dest"], 1000, 20)
+    with pytest.raises(ValueError):
+        W3.load_checkpoint(tmp_path/"checkpoint.npz")
+
+def test_fork():
+    from uxsim.Ensemble import run_branches
+
+    def scenario():
+        W = make_world(tmax=3000)
+        add_two_routes(W)
+        W.adddemand("orig", "dest", 0, 1500, 0.7)
+        W.exec_simulation(until_t=1000)
+        return W
+
+    W = scenario()
+    random_states = (random.getstate(), np.random.get_state())
+    branches = W.fork(2)
+    branches[1].get_link("link11").free_flow_speed = 2
+    assert W.get_link("link11").u == 20
+    assert branches[0].ADJ_MAT is W.ADJ_MAT #static network data are shared
+    assert branches[0].LINKS[0] is not W.LINKS[0] and branches[0].LINKS[0].W is branches[0]
+
+    W.exec_simulation()
+    df = W.analyzer.vehicles_to_pandas()
+    for b in branches:
+        random.setstate(random_states[0])
+        np.random.set_state(random_states[1])
+        b.exec_simulation()
+    assert branches[0].analyzer.vehicles_to_pandas().equals(df)
+    assert not branches[1].analyzer.vehicles_to_pandas().equals(df)
+
+    #branches in a process pool
+    def slow(W):
+        W.get_link("link11").free_flow_speed = 2
+    W = scenario()
+    res_sequential = run_branches(W, [None, slow], workers=1)
+    res_parallel = run_branches(W, [None, slow], workers=2)
+    for r1, r2 in zip(res_sequential, res_parallel):
+        for key in ["basic", "od", "link"]:
+            assert r1[key].equals(r2[key])
+    assert res_parallel[0]["basic"]["average_travel_time"].values[0] < res_parallel[1]["basic"]["average_travel_time"].values[0]
+    W.exec_simulation() #the base World is not modified
+    assert W.analyzer.basic_to_pandas().equals(res_parallel[0]["basic"])
@@ -0,0 +1,92 @@
+"""
+Tests of the lookup of nodes, links, and vehicles.
+"""
+
+import pytest
+from uxsim import *
+from scenario_builders import *
+
+def test_name_registry():
+    W = make_world(tmax=1200)
+    link1, link2 = add_line(W)
+    orig, mid, dest = W.NODES
+    W.addVehicle("orig", "dest", 0, name="veh")
+
+    assert W.get_node("mid") is mid is W.NODES_NAME_DICT["mid"]
+    assert W.get_link("link1") is link1 and W.get_link(link1) is link1
+    assert W.get_link(W.LINKS[link1.id]) is link1
+    with pytest.raises(Exception):
+        W.get_node("nonexistent")
+    with pytest.raises(ValueError):
+        W.addNode("orig", 5, 5)
+    with pytest.raises(ValueError):
+        W.addLink("link1", "orig", "dest", length=1000)
+    with pytest.raises(ValueError):
+        W.addVehicle("orig", "dest", 0, name="veh")
+    renamed = W.addNode("orig", 5, 5, auto_rename=True)
+    assert renamed.name != "orig" and W.get_node(renamed.name) is renamed
+    assert len(W.NODES) == len(W.NODES_NAME_DICT) == 4
+
+    #同名の他Worldのオブジェクトは名前で解決
+    W2 = make_world(tmax=1200)
+    W2.addNode("orig", 0, 0)
+    W2.addNode("dest", 1, 0)
+    link_other = W2.addLink("link1", "orig", "dest", length=1000)
+    assert W.get_link(link_other) is link1
+    assert W.get_node(W2.get_node("dest")) is dest
+
+    Route(W, ["link1", "link2"])
+    W.exec_simulation()
+    assert W.VEHICLES["veh"].state == "end"
+
+def test_spatial_index():
+    W = make_world(tmax=3000)
+    add_grid(W, 5, spacing=100, length=100)
+
+    rng = np.random.default_rng(0)
+    x = np.concatenate([rng.uniform(-50, 450, 300), np.arange(0, 450, 50)])
+    y = np.concatenate([rng.uniform(-50, 450, 300), np.full(9, 150)])
+    nearest = W.get_nearest_nodes(x, y)
+    for xx, yy, node in zip(x, y, nearest):
+        dist = [(n.x-xx)**2 + (n.y-yy)**2 for n in W.NODES]
+        assert node is W.NODES[np.argmin(dist)] #等距離なら最小id
+        assert W.get_nearest_node(xx, yy) is node
+    assert np.array_equal(W.get_nearest_nodes(x, y, return_ids=True), [n.id for n in nearest])
+
+    areas = W.get_nodes_in_areas(x, y, 100)
+    for xx, yy, nodes in zip(x, y, areas):
+        assert nodes == [n for n in W.NODES if (n.x-xx)**2 + (n.y-yy)**2 < 100**2]
+    assert [n.name for n in W.get_nodes_in_area(100, 100, 100)] == ["n1_1"] #境界上は含まない
+    assert [n.name for n in W.get_nodes_in_area(100, 100, 101)] == ["n0_1", "n1_0", "n1_1", "n1_2", "n2_1"]
+
+    #ノードを追加すると作り直される
+    assert W.get_nearest_node(1000, 1000).name == "n4_4"
+    W.addNode("far", 1000, 1000)
+    assert W.get_nearest_node(1000, 1000).name == "far"
+
+    W.adddemand_point2point([10, 390], [10, 390], [390, 10], [390, 10], 0, 1000, volume=[100, 200])
+    vehs = list(W.VEHICLES.values())
+    assert len(vehs) == 60
+    assert vehs[0].orig.name == "n0_0" and vehs[0].dest.name == "n4_4" and vehs[-1].orig.name == "n4_4" and vehs[-1].dest.name == "n0_0"
+
+def test_nearest_node_far_and_ties():
+    W = make_world(tmax=1200)
+    add_grid(W, 3, spacing=100, length=100)
+
+    #全ノードから遠い点でも最寄りノードを返す
+    assert W.get_nearest_node(1e6, 1e6).name == "n2_2"
+    assert W.get_nearest_node(-1e7, 0).name == "n0_0"
+    assert [n.name for n in W.get_nearest_nodes([1e6, -1e6], [-1e6, 1e6])] == ["n2_0", "n0_2"]
+
+    #4ノード以上が等距離の点は最小id
+    x = np.array([50, 150, 50, 100, 100])
+    y = np.array([50, 150, 150, 100, 50])
+    ids = W.get_nearest_nodes(x, y, return_ids=True)
+    for xx, yy, i in zip(x, y, ids):
+        dist = [(n.x-xx)**2 + (n.y-yy)**2 for n in W.NODES]
+        assert i == np.argmin(dist)
+
+    W1 = make_world(tmax=1200)
+    W1.addNode("only", 0, 0)
+    assert W1.get_nearest_node(1e8, 1e8).name == "only"
+    assert make_world(tmax=1200).get_nearest_node(0, 0) == None
@@ -0,0 +1,123 @@
+"""
+Tests of the internal data structures of route choice.
+"""
+
+import pytest
+from uxsim import *
+from scenario_builders import *
+
+def test_route_preference_table():
+    W = make_world()
+
+    W.addNode("orig", 0, 0)
+    W.addNode("mid1", 1, 1)
+    W.addNode("mid2", 1, -1)
+    W.addNode("dest", 2, 0)
+    link1 = W.addLink("link1", "orig", "mid1", length=1000, free_flow_speed=20)
+    link2 = W.addLink("link2", "orig", "mid2", length=1000, free_flow_speed=10)
+    link3 = W.addLink("link3", "mid1", "dest", length=1000, free_flow_speed=20)
+    link4 = W.addLink("link4", "mid2", "dest", length=1000, free_flow_speed=20)
+    W.adddemand("orig", "dest", 0, 1000, 0.5)
+
+    for veh in W.VEHICLES.values():
+        assert veh.route_pref == None
+        assert veh.route_pref_of_links([link1, link2]) == [0, 0]
+
+    W.exec_simulation()
+
+    dest = W.get_node("dest")
+    assert W.ROUTECHOICE.route_pref_mat.shape == (len(W.NODES), len(W.LINKS))
+    pref = W.ROUTECHOICE.route_pref[dest.id]
+    assert pref[link1] == W.ROUTECHOICE.route_pref_mat[dest.id, link1.id] == 1
+    assert pref[link2] == 0
+    assert list(pref.keys()) == W.LINKS and len(pref) == len(W.LINKS) and link3 in pref
+    assert dict(pref.items()) == {link1: 1, link2: 0, link3: 1, link4: 1} #link4 is on the shortest path from mid2
+    pref[link4] = 0.5
+    assert W.ROUTECHOICE.route_pref_mat[dest.id, link4.id] == 0.5
+
+    for veh in W.VEHICLES.values():
+        assert veh.route_pref is pref
+        assert link3 in veh.log_link and link2 not in veh.log_link
+
+def test_homogeneous_DUO_update_vectorized():
+    W = make_world()
+    add_grid(W, 4, free_flow_speed=15)
+    W.adddemand("n0_0", "n3_3", 0, 500, 0.5)
+    W.finalize_scenario()
+    for l in W.LINKS:
+        l.update()
+
+    RC = W.ROUTECHOICE
+    RC.route_search_all(noise=0.5)
+    rng = np.random.default_rng(0)
+    RC.route_pref_mat[:] = rng.random(RC.route_pref_mat.shape)
+    RC.route_pref_mat[::3] = 0
+
+    #reference: the original per-destination and per-link loop
+    ref = {k.id: {l: RC.route_pref[k.id][l] for l in W.LINKS} for k in W.NODES}
+    for dest in W.NODES:
+        k = dest.id
+        weight = W.DUO_UPDATE_WEIGHT
+        if sum(list(ref[k].values())) == 0:
+            weight = 1
+        for l in W.LINKS:
+            if l.end_node.id == RC.next[l.start_node.id, k]:
+                ref[k][l] = (1-weight)*ref[k][l] + weight
+            else:
+                ref[k][l] = (1-weight)*ref[k][l]
+
+    view = RC.route_pref[W.NODES[5].id]
+    RC.homogeneous_DUO_update()
+
+    for k in W.NODES:
+        assert dict(RC.route_pref[k.id].items()) == ref[k.id]
+    assert dict(view.items()) == ref[W.NODES[5].id]
+
+def check_new_destination_route(W, orig, dest):
+    #追加直後に，目的地への経路表と車両の経路選好が有効であること
+    RC = W.ROUTECHOICE
+    veh = W.addVehicle(orig, dest, W.TIME+W.DELTAT)
+    k = W.get_node(dest).id
+    assert RC.searched[k]
+    i = W.get_node(orig).id
+    for _ in range(len(W.NODES)):
+        i = RC.next[i, RC.dest_index[k]]
+        if i == k:
+            break
+    assert i == k
+    assert veh.route_pref is RC.route_pref[k]
+    out_prefs = veh.route_pref_of_links(list(W.get_node(orig).outlinks.values()))
+    assert max(out_prefs) == 1
+    return veh
+
+def test_route_search_dijkstra_new_destination():
+    W = make_world(tmax=3000, route_search_method="dijkstra")
+    add_grid(W, 4, free_flow_speed=15)
+    W.adddemand("n0_0", "n3_3", 0, 500, 0.5)
+    W.exec_simulation(until_t=1000)
+
+    RC = W.ROUTECHOICE
+    assert RC.next.shape == (len(W.NODES), 1) #目的地の列のみ
+    veh = check_new_destination_route(W, "n0_0", "n3_0")
+    assert RC.next.shape == (len(W.NODES), 2)
+    W.exec_simulation()
+    assert veh.state == "end"
+
+def test_route_search_tolerance_new_destination():
+    from scipy.sparse.csgraph import dijkstra
+
+    W = make_world(tmax=3000, route_search_method="dijkstra", route_search_tolerance=0.1, duo_update_time=100)
+    add_grid(W, 4, free_flow_speed=15)
+    W.adddemand("n0_0", "n3_3", 0, 1500, 0.5)
+    W.finalize_scenario()
+    W.exec_simulation(until_t=800)
+
+    RC = W.ROUTECHOICE
+    veh = check_new_destination_route(W, "n3_3", "n0_3")
+    #その場で探索した木も，差分探索の基準の旅行時間に対する最短経路木
+    dests = np.nonzero(RC.searched)[0]
+    dist = dijkstra(RC.reverse_graph(RC.tts_ref), indices=dests)
+    assert np.allclose(dist.T, RC.dist[:, RC.dest_index[dests]])
+
+    W.exec_simulation()
+    assert veh.state == "end"
@@ -0,0 +1,84 @@
+"""
+Tests of saving and loading scenarios.
+"""
+
+import pytest
+from uxsim import *
+from scenario_builders import *
+
+def test_scenario_file(tmp_path):
+    def world(lazy=0):
+        return make_world(tmax=3000, lazy_vehicle_creation=lazy)
+    def results(W):
+        random.seed(0)
+        np.random.seed(0)
+        W.exec_simulation()
+        return [(veh.name, veh.state, veh.departure_time, veh.travel_time, veh.color, [(t, str(x)) for t, x in veh.log_t_link]) for veh in W.VEHICLES.values()]
+
+    W = world()
+    W.load_scenario_from_csv("dat/uroboros_nodes.csv", "dat/uroboros_links.csv", "dat/uroboros_demand.csv")
+    W.addNode("signal", 0, 0, signal=[30, 20], signal_offset=5, flow_capacity=1.3)
+    W.addLink("signal_link", "signal", "W_in", 1000, number_of_lanes=2, signal_group=[0, 1], capacity_in=0.5, eular_dx=50)
+    W.addVehicle("signal", "N_in", 100, name="special", trip_abort=0)
+    W.save_scenario(tmp_path/"scenario.npz")
+    assert len(W.VEHICLES) == 841
+
+    W2 = world()
+    W2.load_scenario(tmp_path/"scenario.npz")
+    assert [n.name for n in W2.NODES] == [n.name for n in W.NODES] and [l.name for l in W2.LINKS] == [l.name for l in W.LINKS]
+    assert W2.get_node("signal").signal == [30, 20] and W2.get_node("signal").lanes == W.get_node("signal").lanes
+    l = W2.get_link("signal_link")
+    assert (l.lanes, l.signal_group, l.capacity_in, l.eular_dx, l.start_node.name) == (2, [0, 1], 0.5, 50, "signal")
+    assert W2.VEHICLES["special"].trip_abort == 0
+    ref = results(W)
+    assert results(W2) == ref
+
+    W3 = world(lazy=1)
+    W3.load_scenario(tmp_path/"scenario.npz")
+    assert W3.DEPARTURE_SCHEDULER.pending_size == 840
+    W3.save_scenario(tmp_path/"scenario_lazy.npz") #未生成の車両もそのまま保存される
+    W4 = world()
+    W4.load_scenario(tmp_path/"scenario_lazy.npz")
+    assert results(W3) == ref
+    assert results(W4) == ref
+
+    W5 = make_world(deltan=10)
+    with pytest.raises(ValueError):
+        W5.load_scenario(tmp_path/"scenario.npz")
+
+def test_demand_csv_with_ragged_rows(tmp_path):
+    #ヘッダは5列で，一部の行だけvolume列を持つ
+    with open(tmp_path/"demand.csv", "w") as f:
+        f.write("orig,dest,start_t,end_t,flow\n")
+        f.write("W_in,E_in,0,1000,0.3\n")
+        f.write("N_in,S_in,0,500,0.2,50\n")
+        f.write("W_in,S_in,500,1500,0.1\n")
+        f.write("N_in,E_in,100,600,0.4,\n")
+
+    W = make_world()
+    W.load_scenario_from_csv("dat/uroboros_nodes.csv", "dat/uroboros_links.csv", tmp_path/"demand.csv")
+
+    W2 = make_world()
+    W2.generate_Nodes_from_csv("dat/uroboros_nodes.csv")
+    W2.generate_Links_from_csv("dat/uroboros_links.csv")
+    W2.adddemand("W_in", "E_in", 0, 1000, 0.3)
+    W2.adddemand("N_in", "S_in", 0, 500, 0.2, volume=50)
+    W2.adddemand("W_in", "S_in", 500, 1500, 0.1)
+    W2.adddemand("N_in", "E_in", 100, 600, 0.4)
+
+    assert [(veh.orig.name, veh.dest.name, veh.departure_time) for veh in W.VEHICLES.values()] == [(veh.orig.name, veh.dest.name, veh.departure_time) for veh in W2.VEHICLES.values()]
+
+def test_save_scenario_warns_dropped_attribute(tmp_path):
+    for lazy in [0, 1]:
+        W = make_world(lazy_vehicle_creation=lazy)
+        add_line(W, ["orig", "dest"], 1000, 20)
+        W.adddemand("orig", "dest", 0, 500, 0.5, attribute={"group": 1})
+        with pytest.warns(UserWarning, match="attribute"):
+            W.save_scenario(tmp_path/"scenario.npz")
+
+    W = make_world()
+    add_line(W, ["orig", "dest"], 1000, 20)
+    W.adddemand("orig", "dest", 0, 500, 0.5)
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        W.save_scenario(tmp_path/"scenario.npz")
@@ -0,0 +1,143 @@
+"""
+Tests of the core simulation procedures: departures and link states.
+"""
+
+import pytest
+from uxsim import *
+from scenario_builders import *
+
+def test_departure_scheduler():
+    W = make_world(tmax=3000)
+    add_line(W, ["orig", "dest"])
+    W.adddemand("orig", "dest", 0, 500, 0.5)
+    W.adddemand("orig", "dest", 2000, 2500, 0.5)
+
+    W.exec_simulation(until_t=1000)
+    
+    assert len(W.DEPARTURE_SCHEDULER) == 50
+    assert len(W.VEHICLES_ACTIVE) == 0
+    late_veh = W.DEPARTURE_SCHEDULER.vehicles()[0]
+    assert late_veh.state == "home"
+    assert len(late_veh.log_t) == W.T
+    
+    veh = W.addVehicle("orig", "dest", 500) #departure time in the past
+    
+    W.exec_simulation()
+
+    assert len(W.DEPARTURE_SCHEDULER) == 0
+    for v in W.VEHICLES.values():
+        assert v.state == "end"
+        assert v.log_t[:-1] == [v.log_t[0]+t*W.DELTAT for t in range(len(v.log_t)-1)] #the last log is recorded at the trip end
+    assert veh.log_t[0] == 1000 and veh.log_state[1] != "home"
+    assert late_veh.log_state.index("run") == late_veh.departure_time+1
+
+def test_departure_update_order(monkeypatch):
+    #複数のODの出発が交互になっても，車両は毎ステップid順に更新される
+    update = Vehicle.update
+    for lazy in [0, 1]:
+        log = []
+        def update_logged(veh):
+            log.append((veh.W.T, veh.id))
+            update(veh)
+        monkeypatch.setattr(Vehicle, "update", update_logged)
+
+        W = make_world(tmax=3000, lazy_vehicle_creation=lazy)
+        add_line(W, ["orig", "mid", "dest"], 1000, 20)
+        W.adddemand("orig", "dest", 0, 1000, 0.3)
+        W.adddemand("mid", "dest", 0, 1000, 0.2)
+        W.adddemand("orig", "mid", 200, 800, 0.25)
+        W.addVehicle("mid", "dest", 100)
+        W.adddemand("orig", "dest", 50, 600, 0.1)
+        W.exec_simulation(until_t=500)
+        W.addVehicle("orig", "dest", 520)
+        W.exec_simulation()
+        monkeypatch.undo()
+
+        assert log == sorted(log)
+        for veh in W.VEHICLES.values():
+            ts = [t for t, i in log if i == veh.id]
+            assert ts == list(range(ts[0], ts[-1]+1))
+            assert veh.state == "end"
+
+def test_traveltime_actual_deferred_write():
+    W = make_world(tmax=3000)
+    link1, link2 = add_line(W, link_kwargs=[{"capacity_out": 0.4}, {}])
+    W.adddemand("orig", "dest", 0, 1500, 0.6)
+
+    tt_mid = None
+    while W.check_simulation_ongoing():
+        W.exec_simulation(duration_t=500)
+        if tt_mid is None:
+            tt_mid = link1.traveltime_actual.copy()
+    
+    for link in [link1, link2]:
+        ref = np.array([link.length/link.u for t in range(W.TSIZE)])
+        for t, tt in link._traveltime_actual_records:
+            ref[t:] = tt
+        assert np.array_equal(link.traveltime_actual, ref)
+        assert link.actual_travel_time(1000) == ref[int(1000/W.DELTAT)]
+    assert not np.array_equal(tt_mid, link1.traveltime_actual)
+
+def test_link_cumulative_buffers():
+    W = make_world()
+    link1, link2 = add_line(W)
+    W.adddemand("orig", "dest", 0, 1000, 0.5)
+
+    W.exec_simulation(until_t=500)
+
+    assert len(link1.cum_arrival) == len(link1.cum_departure) == len(link1.traveltime_instant) == W.T
+    assert link1.cum_arrival[-1] == sum(1 for veh in W.VEHICLES.values() if veh.state in ["run", "end"])*W.DELTAN
+    assert link1.arrival_count(10000) == link1.cum_arrival[-1]
+
+    W.exec_simulation()
+
+    for link in [link1, link2]:
+        assert len(link.cum_arrival) == W.TSIZE
+        assert np.all(np.diff(link.cum_arrival) >= 0) and np.all(link.cum_arrival >= link.cum_departure)
+        assert link.departure_count(W.TMAX) == link.cum_departure[-1] == 500
+    assert link2.cum_arrival[-1] == link1.cum_departure[-1]
+    df = W.analyzer.link_cumulative_to_pandas()
+    assert len(df) == W.TSIZE*2
+    assert df[df["link"]=="link2"]["departure_count"].iloc[-1] == 500
+
+def test_link_state_running_aggregates():
+    W = make_world(tmax=3000, verify_link_state=1)
+
+    W.addNode("orig1", 0, 0)
+    W.addNode("orig2", 0, 2)
+    W.addNode("merge", 1, 1)
+    W.addNode("dest", 2, 1)
+    W.addLink("link1", "orig1", "merge", length=1000, free_flow_speed=20, jam_density=0.2, merge_priority=0.5)
+    W.addLink("link2", "orig2", "merge", length=1000, free_flow_speed=20, jam_density=0.2, merge_priority=2)
+    link3 = W.addLink("link3", "merge", "dest", length=1000, free_flow_speed=20, jam_density=0.2)
+    W.adddemand("orig1", "dest", 0, 1500, 0.5)
+    W.adddemand("orig2", "dest", 300, 1500, 0.6)
+
+    queues = []
+    while W.check_simulation_ongoing():
+        W.exec_simulation(duration_t=300)
+        if W.TIME == 900:
+            link3.free_flow_speed = 10
+        for link in W.LINKS:
+            if len(link.vehicles):
+                assert link.speed == pytest.approx(np.average([veh.v for veh in link.vehicles]))
+            else:
+                assert link.speed == link.u
+            assert link.num_vehicles_queue == sum([veh.v < link.u for veh in link.vehicles])*W.DELTAN
+            queues.append(link.num_vehicles_queue)
+
+    assert max(queues) > 0
+
+def test_link_speed_sum_resync():
+    #空にならないリンクでも，速度和の丸め誤差が蓄積しない
+    W = make_world(tmax=20000)
+    add_line(W, node_names=["orig", "mid1", "mid2", "dest"], length=3000, free_flow_speed=13.7, link_kwargs=[{}, {"capacity_out": 0.35, "jam_density": 0.17}, {}])
+    for t in range(0, 19000, 2000):
+        W.adddemand("orig", "dest", t, t+1000, 0.7)
+        W.adddemand("orig", "dest", t+1000, t+2000, 0.2)
+
+    for t in range(2000, 20000, 500):
+        W.exec_simulation(until_t=t)
+        for link in W.LINKS:
+            assert len(link.vehicles) > 0
+            assert abs(link.speed - np.average([veh.v for veh in link.vehicles])) < 5e-13
@@ -0,0 +1,117 @@
+"""
+Tests of the computation of traffic states and trajectories from vehicle logs.
+"""
+
+import pytest
+from uxsim import *
+from scenario_builders import *
+
+def test_edie_state_online():
+    def make(**kwargs):
+        W = make_world(**kwargs)
+        add_line(W, link_kwargs=[{}, {"capacity_out": 0.3}])
+        W.adddemand("orig", "dest", 0, 1000, 0.5)
+        return W
+
+    W1 = make()
+    W1.exec_simulation()
+    W1.analyzer.compute_edie_state()
+
+    W2 = make(edie_state_online=1, vehicle_logging_timestep_interval=-1)
+    W2.exec_simulation(until_t=500)
+    W2.analyzer.compute_edie_state()
+    assert W2.get_link("link1").k_mat.sum() > 0
+    assert W2.get_link("link1").k_mat[5:].sum() == 0
+    W2.exec_simulation()
+    W2.analyzer.compute_edie_state()
+
+    for l1, l2 in zip(W1.LINKS, W2.LINKS):
+        assert l2.k_mat.shape == l1.k_mat.shape
+        assert equal_tolerance(l2.k_mat.sum(), l1.k_mat.sum(), rel_tol=0.05)
+        assert equal_tolerance(l2.q_mat.sum(), l1.q_mat.sum(), rel_tol=0.05)
+        assert np.abs(l2.q_mat-l1.q_mat).sum() < 0.05*l1.q_mat.sum()
+
+def test_accurate_traj():
+    W = make_world()
+    link1, link2 = add_line(W, link_kwargs=[{}, {"capacity_out": 0.3}])
+    W.adddemand("orig", "dest", 0, 1000, 0.5)
+    W.exec_simulation()
+    W.analyzer.compute_accurate_traj()
+
+    for l in [link1, link2]:
+        assert len(l.tss) == len(l.xss) == len(l.cs) == len(l.ls) == len(l.names) == len(W.VEHICLES)
+        assert l.names == list(W.VEHICLES.keys())
+        for ts, xs in zip(l.tss, l.xss):
+            assert xs[0] == 0 and xs[-1] == l.length
+            assert np.all(np.diff(ts) > 0) and np.all(np.diff(xs) >= 0)
+
+    veh = W.VEHICLES["10"]
+    i = l.names.index("10")
+    ts = [t for t, link in zip(veh.log_t, veh.log_link) if link == link2]
+    xs = [x for x, link in zip(veh.log_x, veh.log_link) if link == link2]
+    j = list(link2.tss[i]).index(ts[0])
+    assert list(link2.tss[i][j:j+len(ts)]) == ts #extrapolated at the ends
+    assert list(link2.xss[i][j:j+len(xs)]) == xs
+    assert len(link2.tss[i])-len(ts) <= 2
+    assert link2.tss[-1] is not None and len(link2.tss[:2]) == 2
+
+def edie_state_loop(W, l, nt, nx):
+    """
+    The former per-segment computation of `compute_edie_state_link`, except that the segments starting before time 0 are skipped.
+    """
+    dt = l.edie_dt
+    dx = l.edie_dx
+    tn = np.zeros([nt, nx])
+    dn = np.zeros([nt, nx])
+    for xs, ts in zip(l.xss, l.tss):
+        for i in range(len(xs)-1):
+            x0, x1, t0, t1 = xs[i], xs[i+1], ts[i], ts[i+1]
+            v0 = (x1-x0)/(t1-t0) if t1-t0 != 0 else 0
+            tt = int(t0//dt)
+            xx = int(x0//dx)
+            if not (0 <= tt < nt and xx < nx):
+                continue
+            if v0 > 0:
+                if xx == x1//dx:
+                    dn[tt,xx] += x1-x0
+                    tn[tt,xx] += t1-t0
+                else:
+                    jj = int(x1//dx-xx+1)
+                    for j in range(jj):
+                        if xx+j < nx:
+                            if j == 0:
+                                d = dx-x0%dx
+                            elif j == jj-1:
+                                d = x1%dx
+                            else:
+                                d = dx
+                            dn[tt,xx+j] += d
+                            tn[tt,xx+j] += d/v0
+            else:
+                tn[tt,xx] += t1-t0
+    return tn*W.DELTAN, dn*W.DELTAN
+
+def test_edie_state_vectorized():
+    W = make_world(tmax=3000, vehicle_logging_timestep_interval=3)
+    add_line(W, node_names=["orig", "mid1", "mid2", "dest"], link_kwargs=[{}, {"capacity_out": 0.4}, {}])
+    W.adddemand("orig", "dest", 0, 1500, 0.6)
+    W.exec_simulation()
+    W.analyzer.compute_edie_state()
+
+    for l in W.LINKS:
+        nt, nx = int(W.TMAX/l.edie_dt), int(l.length/l.edie_dx)
+        tn, dn = edie_state_loop(W, l, nt, nx)
+        assert tn.sum() > 0
+        assert np.allclose(l.tn_mat[:nt,:nx], tn) and np.allclose(l.dn_mat[:nt,:nx], dn)
+        assert np.allclose(l.k_mat, tn/l.edie_dt/l.edie_dx) and np.allclose(l.q_mat, dn/l.edie_dt/l.edie_dx)
+    assert W.get_link("link1").k_mat.max() > 0.1 and W.get_link("link2").k_mat.max() > 0.1 #渋滞している
+
+    #負の時刻から始まる区間は最後の時間セルに回り込まず，捨てられる
+    l = W.get_link("link1")
+    tn_ref, dn_ref = l.tn_mat.copy(), l.dn_mat.copy()
+    n = len(l.traj_t)
+    l.traj_t = np.concatenate([l.traj_t, [-30, -10, 20]])
+    l.traj_x = np.concatenate([l.traj_x, [0, 200, 400]])
+    l.traj_offsets = np.append(l.traj_offsets, n+3)
+    W.analyzer.compute_edie_state_link(l, nt, nx)
+    assert np.array_equal(l.tn_mat, tn_ref) and np.array_equal(l.dn_mat, dn_ref)
@@ -0,0 +1,157 @@
+"""
+Tests of the storage of vehicle logs.
+"""
+
+import pytest
+import glob, os
+from uxsim import *
+from scenario_builders import *
+
+def test_vehicle_log_store():
+    W = make_world()
+    W.VEHICLE_LOGS = VehicleLogStore(W, chunk_size=100) #small chunks to test growth
+    link1, link2 = add_line(W, link_kwargs=[{}, {"capacity_out": 0.3}])
+    W.adddemand("orig", "dest", 0, 1000, 0.5)
+    W.exec_simulation()
+
+    logs = W.VEHICLE_LOGS
+    assert len(logs) == sum(len(veh.log_t) for veh in W.VEHICLES.values())
+    assert len(logs.columns["x"]) % 100 == 0
+    for key, dtype in VehicleLogStore.COLUMNS.items():
+        assert logs.column(key).dtype == dtype
+
+    veh = W.VEHICLES["10"]
+    assert veh.log_t[:-1] == [t*W.DELTAT for t in range(len(veh.log_t)-1)] #the last log is recorded at the trip end
+    assert veh.log_state[0] == "home" and veh.log_state[-1] == "end"
+    assert set(veh.log_link) == {-1, link1, link2}
+    for i in range(len(veh.log_t)):
+        if veh.log_state[i] == "run":
+            assert 0 <= veh.log_x[i] <= veh.log_link[i].length and veh.log_lane[i] == 0
+        else:
+            assert veh.log_x[i] == veh.log_v[i] == veh.log_lane[i] == -1
+
+    df = W.analyzer.vehicles_to_pandas()
+    assert len(df) == sum(1 for veh in W.VEHICLES.values() for state in veh.log_state if state != "home")
+    df10 = df[df["name"] == "10"]
+    assert df10["link"].tolist() == [l.name if l != -1 else {"wait": "waiting_at_origin_node", "end": "trip_end"}[state] for l, state in zip(veh.log_link, veh.log_state) if state != "home"]
+    assert df10["x"].tolist() == [x for x, state in zip(veh.log_x, veh.log_state) if state != "home"]
+
+def test_vehicle_log_index_incremental():
+    W = make_world()
+    add_line(W, link_kwargs=[{}, {"capacity_out": 0.3}])
+    W.adddemand("orig", "dest", 0, 1000, 0.5)
+    logs = W.VEHICLE_LOGS
+    for t in range(100, 2100, 100):
+        W.exec_simulation(until_t=t)
+        vehs = logs.column("veh")
+        for veh_id in [0, 10, len(W.VEHICLES)-1, len(W.VEHICLES)+5]:
+            assert np.array_equal(logs.vehicle_rows(veh_id), np.nonzero(vehs == veh_id)[0])
+        log_x = W.VEHICLES["10"].log_x #出発前の車両の"home"のログは参照時に記録される
+        assert log_x[-1] == logs.column("x")[logs.column("veh") == 10][-1]
+    assert logs.index_size < len(logs) #途中の読み出しでは全体を並べ替えない
+
+def test_vehicle_log_sink(tmp_path):
+    def make(**kwargs):
+        W = make_world(**kwargs)
+        add_line(W, link_kwargs=[{}, {"capacity_out": 0.3}])
+        W.adddemand("orig", "dest", 0, 1000, 0.5)
+        return W
+
+    W1 = make()
+    W1.exec_simulation()
+    W2 = make(vehicle_log_sink=str(tmp_path), vehicle_log_sink_timestep_interval=50)
+    W2.exec_simulation()
+
+    logs = W2.VEHICLE_LOGS
+    assert len(logs.shards) >= 2
+    assert len(glob.glob(os.path.join(logs.sink_dir, "vehicle_log_*.npy"))) == len(logs.shards)*len(VehicleLogStore.COLUMNS)
+    assert logs.size < len(logs)
+    assert sum(len(chunk["veh"]) for chunk in logs.iter_chunks()) == len(logs) == len(W1.VEHICLE_LOGS)
+    for key in VehicleLogStore.COLUMNS:
+        assert np.array_equal(logs.column(key), W1.VEHICLE_LOGS.column(key))
+    for name in ["0", "10", "99"]:
+        assert W2.VEHICLES[name].log_x == W1.VEHICLES[name].log_x
+        assert W2.VEHICLES[name].log_state == W1.VEHICLES[name].log_state
+    assert W2.analyzer.vehicles_to_pandas().equals(W1.analyzer.vehicles_to_pandas())
+
+    #同じsinkを使う他のWorldやチェックポイントからの復元で消えない
+    W3 = make(vehicle_log_sink=str(tmp_path), vehicle_log_sink_timestep_interval=50)
+    W3.exec_simulation()
+    W2.save_checkpoint(tmp_path/"checkpoint.npz")
+    W4 = make(vehicle_log_sink=str(tmp_path))
+    W4.load_checkpoint(tmp_path/"checkpoint.npz")
+    assert W3.VEHICLE_LOGS.sink_dir != logs.sink_dir and os.path.dirname(logs.sink_dir) == str(tmp_path)
+    assert all(os.path.exists(fname) for n, fnames in logs.shards for fname in fnames.values())
+    assert np.array_equal(W3.VEHICLE_LOGS.column("x"), W1.VEHICLE_LOGS.column("x"))
+
+    logs.load_to_memory()
+    assert logs.sink == None and len(logs.shards) == 0
+    assert np.array_equal(logs.column("x"), W1.VEHICLE_LOGS.column("x"))
+
+def test_vehicle_log_compression():
+    def make(**kwargs):
+        W = make_world(**kwargs)
+        W.addNode("orig1", 0, 0)
+        W.addNode("orig2", 0, 2)
+        W.addNode("merge", 1, 1)
+        W.addNode("dest", 2, 1, signal=[30, 30])
+        W.addLink("link1", "orig1", "merge", length=1000, free_flow_speed=20, number_of_lanes=2)
+        W.addLink("link2", "orig2", "merge", length=1000, free_flow_speed=20)
+        W.addLink("link3", "merge", "dest", length=1000, free_flow_speed=20, signal_group=0)
+        W.adddemand("orig1", "dest", 0, 1000, 0.8)
+        W.adddemand("orig2", "dest", 300, 1000, 0.6)
+        return W
+
+    W1 = make()
+    W1.exec_simulation()
+    df1 = W1.analyzer.vehicles_to_pandas()
+
+    for tolerance in [0.01, 5]:
+        W2 = make(vehicle_log_tolerance=tolerance)
+        W2.exec_simulation()
+        assert len(W2.VEHICLE_LOGS) < len(W1.VEHICLE_LOGS)/3
+
+        df2 = W2.analyzer.vehicles_to_pandas()
+        assert df2[["name", "t", "link"]].equals(df1[["name", "t", "link"]])
+        for key in ["x", "s", "v"]:
+            assert np.abs(df2[key]-df1[key]).max() <= tolerance+1e-3
+
+        veh1 = W1.VEHICLES["100"]
+        veh2 = W2.VEHICLES["100"]
+        assert veh2.log_t == veh1.log_t
+        assert veh2.log_state == veh1.log_state
+        assert [l.name if l != -1 else -1 for l in veh2.log_link] == [l.name if l != -1 else -1 for l in veh1.log_link]
+        assert np.allclose(veh2.log_x, veh1.log_x, atol=tolerance+1e-3)
+
+    #free-flow trajectories are restored exactly
+    W1.analyzer.compute_accurate_traj()
+    W2.analyzer.compute_accurate_traj()
+    assert np.array_equal(W2.get_link("link2").traj_offsets, W1.get_link("link2").traj_offsets)
+    assert np.array_equal(W2.get_link("link2").traj_t, W1.get_link("link2").traj_t)
+    assert np.allclose(W2.get_link("link2").traj_x, W1.get_link("link2").traj_x, atol=1e-3)
+
+def test_vehicle_log_compression_read_during_simulation():
+    #シミュレーション中にログを読んでも，保留中の行はブレークポイントにならない
+    def make():
+        W = make_world(vehicle_log_tolerance=0.5)
+        add_line(W, link_kwargs=[{}, {"capacity_out": 0.3}])
+        W.adddemand("orig", "dest", 0, 1000, 0.5)
+        return W
+
+    W1 = make()
+    W1.exec_simulation()
+
+    W2 = make()
+    while W2.check_simulation_ongoing():
+        W2.exec_simulation(duration_t=50)
+        for veh in W2.VEHICLES_RUNNING.values():
+            log_t = veh.log_t
+            assert log_t[-1] == W2.TIME #最新の行も読める
+            log_x1 = W1.VEHICLES[veh.name].log_x[:len(log_t)]
+            assert np.allclose(veh.log_x, log_x1, atol=0.5+1e-3) and veh.log_x[-1] == log_x1[-1]
+        W2.analyzer.flag_pandas_convert = 0
+        assert len(W2.analyzer.vehicles_to_pandas()) > 0
+
+    assert len(W2.VEHICLE_LOGS) == len(W1.VEHICLE_LOGS)
+    for key in VehicleLogStore.COLUMNS:
+        assert np.array_equal(W2.VEHICLE_LOGS.column(key), W1.VEHICLE_LOGS.column(key))
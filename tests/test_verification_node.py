@@ -1052,3 +1052,70 @@ def test_4phase_signal_jpstyle():
     referemce_avt = [41.40449658, 65.77142857, 41.56507937, 41.41644018, 41.30793651, 65.97619048, 49.7849498, 49.15555556, 69.54444444, 49.11051701, 70.71428571, 48.62857143]
     for i in range(len(avt)):
         assert equal_tolerance(avt[i], referemce_avt[i])
+
+def test_2to2_identical_results_with_fixed_seed():
+    results = []
+    vols = []
+    for i in range(2):
+        W = World(
+            name="",
+            deltan=5,
+            tmax=2000,
+            print_mode=0, save_mode=0, show_mode=0,
+            random_seed=42
+        )
+
+        W.addNode("orig1", 0, 0) 
+        W.addNode("orig2", 0, 2)
+        W.addNode("inter", 1, 1, signal=[60,60])
+        W.addNode("dest1", 2, 0)
+        W.addNode("dest2", 2, 2)
+        link1 = W.addLink("link1", "orig1", "inter", length=1000, free_flow_speed=20, jam_density_per_lane=0.2, number_of_lanes=2, merge_priority=1, signal_group=0)
+        link2 = W.addLink("link2", "orig2", "inter", length=1000, free_flow_speed=20, jam_density=0.2, merge_priority=2, signal_group=[0,1])
+        link3 = W.addLink("link3", "inter", "dest1", length=1000, free_flow_speed=20, jam_density=0.2)
+        link4 = W.addLink("link4", "inter", "dest2", length=1000, free_flow_speed=20, jam_density_per_lane=0.2, number_of_lanes=2)
+        W.adddemand("orig1", "dest1", 0, 1000, 0.4)
+        W.adddemand("orig2", "dest1", 0, 1000, 0.4)
+        W.adddemand("orig1", "dest2", 0, 1000, 0.4)
+        W.adddemand("orig2", "dest2", 0, 1000, 0.3)
+
+        W.exec_simulation()
+
+        results.append([(veh.log_t, veh.log_link, veh.log_x, veh.log_lane) for veh in W.VEHICLES.values()])
+        vols.append([link1.cum_departure[-1], link2.cum_departure[-1], link3.cum_arrival[-1], link4.cum_arrival[-1]])
+
+    assert [[l.name if l != -1 else -1 for l in r[1]] for r in results[0]] == [[l.name if l != -1 else -1 for l in r[1]] for r in results[1]]
+    assert [(r[0], r[2], r[3]) for r in results[0]] == [(r[0], r[2], r[3]) for r in results[1]]
+    assert vols[0] == vols[1]
+    assert equal_tolerance(vols[0][0], 800)
+    assert equal_tolerance(vols[0][1], 700)
+
+def test_merge_results_same_as_set_based_transfer():
+    #出口リンクが一つのノードでは送り出し順の乱数の使い方が変わらないので，Node.transferの変更前と同じ結果になる．値は変更前の版で計算したもの
+    W = World(
+        name="",
+        deltan=5,
+        tmax=2500,
+        print_mode=0, save_mode=0, show_mode=0,
+        random_seed=0
+    )
+
+    W.addNode("orig1", 0, 0)
+    W.addNode("orig2", 0, 2)
+    W.addNode("merge", 1, 1)
+    W.addNode("mid", 2, 1)
+    W.addNode("dest", 3, 1)
+    link1 = W.addLink("link1", "orig1", "merge", length=1000, free_flow_speed=20, jam_density_per_lane=0.2, number_of_lanes=2, merge_priority=1)
+    link2 = W.addLink("link2", "orig2", "merge", length=1000, free_flow_speed=20, jam_density=0.2, merge_priority=2)
+    W.addLink("link3", "merge", "mid", length=1000, free_flow_speed=20, jam_density_per_lane=0.2, number_of_lanes=2, capacity_out=0.8)
+    W.addLink("link4", "mid", "dest", length=1000, free_flow_speed=20, jam_density=0.2)
+    W.adddemand("orig1", "dest", 0, 1000, 0.8)
+    W.adddemand("orig2", "dest", 0, 1000, 0.5)
+
+    W.exec_simulation()
+
+    travel_times = [veh.travel_time for veh in W.VEHICLES.values()]
+    assert len(travel_times) == 260
+    assert sum(travel_times) == 121225
+    assert travel_times[::20] == [150, 235, 315, 390, 545, 770, 775, 775, 160, 275, 410, 415, 410]
+    assert [link.cum_departure[t] for link in [link1, link2] for t in [100, 200, 300]] == [340, 490, 800, 220, 470, 500]
@@ -666,3 +666,95 @@ def test_route_multiple_links_between_same_nodes():
     assert equal_tolerance(np.average(vol11s), np.average(vol12s), rel_tol=0.2)
     assert equal_tolerance(np.average(vol21s), np.average(vol22s), rel_tol=0.2)
     assert equal_tolerance(np.average(vol11s)+np.average(vol12s), np.average(vol21s)+np.average(vol22s), rel_tol=0.2)
+
+def test_route_search_dijkstra_identical():
+    results = []
+    nexts = []
+    for route_search_method in ["floyd_warshall", "dijkstra"]:
+        W = World(
+            name="",
+            deltan=5,
+            tmax=3000,
+            print_mode=0, save_mode=0, show_mode=0,
+            random_seed=0,
+            duo_update_time=100,
+            route_search_method=route_search_method
+        )
+
+        W.addNode("orig", 0, 0)
+        W.addNode("mid1", 1, 1)
+        W.addNode("mid2", 1, -1)
+        W.addNode("mid3", 1, 0)
+        W.addNode("dest1", 2, 0)
+        W.addNode("dest2", 3, 0)
+        W.addLink("link11", "orig", "mid1", length=1000, free_flow_speed=20, capacity_out=0.4)
+        W.addLink("link12", "orig", "mid1", length=1000, free_flow_speed=10)
+        W.addLink("link2", "orig", "mid2", length=1200, free_flow_speed=20)
+        W.addLink("link3", "orig", "mid3", length=500, free_flow_speed=20, capacity_in=0)
+        W.addLink("link4", "mid1", "dest1", length=1000, free_flow_speed=20)
+        W.addLink("link5", "mid2", "dest1", length=1000, free_flow_speed=20)
+        W.addLink("link6", "mid3", "dest1", length=500, free_flow_speed=20)
+        W.addLink("link7", "dest1", "dest2", length=1000, free_flow_speed=20)
+        W.adddemand("orig", "dest1", 0, 1500, 0.6)
+        W.adddemand("orig", "dest2", 500, 1500, 0.4)
+
+        W.exec_simulation()
+
+        results.append([(veh.log_t, [l.name if l != -1 else -1 for l in veh.log_link], veh.travel_time) for veh in W.VEHICLES.values()])
+        dests = [W.get_node("dest1").id, W.get_node("dest2").id]
+        nexts.append(W.ROUTECHOICE.next[:, W.ROUTECHOICE.dest_index[dests]])
+
+    assert results[0] == results[1]
+    assert np.array_equal(nexts[0], nexts[1])
+
+    with pytest.raises(ValueError):
+        World(route_search_method="bellman_ford")
+
+def test_route_search_dijkstra_incremental():
+    from scipy.sparse import csr_matrix
+    from scipy.sparse.csgraph import dijkstra
+
+    W = World(
+        name="",
+        deltan=5,
+        tmax=4000,
+        print_mode=0, save_mode=0, show_mode=0,
+        random_seed=0,
+        duo_update_time=100,
+        route_search_method="dijkstra",
+        route_search_tolerance=0.1
+    )
+
+    n = 4
+    for i in range(n):
+        for j in range(n):
+            W.addNode(f"n{i}_{j}", i, j)
+    for i in range(n):
+        for j in range(n):
+            for di,dj in [(1,0),(-1,0),(0,1),(0,-1)]:
+                if 0<=i+di<n and 0<=j+dj<n:
+                    W.addLink(f"l{i}_{j}_{i+di}_{j+dj}", f"n{i}_{j}", f"n{i+di}_{j+dj}", length=1000, free_flow_speed=20, number_of_lanes=1+(i+j)%2)
+    W.adddemand("n0_0", "n3_3", 0, 1500, 0.8)
+    W.adddemand("n3_0", "n0_3", 0, 1500, 0.6)
+    W.adddemand("n0_3", "n1_0", 1000, 2500, 0.2)
+
+    RC = None
+    while W.check_simulation_ongoing():
+        W.exec_simulation(duration_t=500)
+        RC = W.ROUTECHOICE
+
+        #the reused trees must be the exact shortest path trees for the link costs taken into account
+        ijs = np.array([(l.start_node.id, l.end_node.id) for l in W.LINKS])
+        graph_reverse = csr_matrix((RC.tts_ref, (ijs[:,1], ijs[:,0])), shape=(len(W.NODES), len(W.NODES)))
+        dests = np.where(RC.searched)[0]
+        dist = dijkstra(graph_reverse, indices=dests)
+        assert np.allclose(dist.T, RC.dist[:, RC.dest_index[dests]])
+
+    log = np.array(RC.route_search_log)
+    assert np.all(np.diff(log[:,0]) == W.DUO_UPDATE_TIME)
+    assert log[0,1] == 3 and log[0,2] == 0
+    assert log[:,2].sum() > 0 and log[:,1].sum() > 3
+    assert W.analyzer.basic_to_pandas()["completed_trips"].values[0] == W.analyzer.basic_to_pandas()["total_trips"].values[0]
+
+    with pytest.raises(ValueError):
+        World(route_search_tolerance=0.1)
@@ -0,0 +1,252 @@
+"""
+Submodule for running many independent simulations (ensemble) in parallel.
+This is useful for Monte-Carlo simulation, sensitivity analysis, optimization, etc.
+Branches of a running simulation under alternative control actions (what-if analysis) can also be run in parallel.
+"""
+
+import random, os, warnings
+import multiprocessing
+import numpy as np
+import dill as pickle
+
+def summarize_world(W):
+    """
+    Default summary of a simulated World used by `run_ensemble`.
+
+    Parameters
+    ----------
+    W : World
+        The simulated World.
+
+    Returns
+    -------
+    dict
+        "basic", "od", and "link" are the results of `W.analyzer.basic_to_pandas()`, `od_to_pandas()`, and `link_to_pandas()`, respectively.
+    """
+    return {
+        "basic": W.analyzer.basic_to_pandas(),
+        "od": W.analyzer.od_to_pandas(),
+        "link": W.analyzer.link_to_pandas(),
+    }
+
+def run_ensemble_member(scenario, modifier, seed, summarize):
+    """
+    Build, simulate, and summarize one ensemble member. It is executed in a worker process.
+
+    Parameters
+    ----------
+    scenario : World | function
+        The base World, or a function that takes a seed and returns a World.
+    modifier : function | None
+        A function that takes a World and modifies it before the simulation.
+    seed : int | None
+        The random seed of this member.
+    summarize : function
+        A function that takes the simulated World and returns a summary.
+
+    Returns
+    -------
+    any
+        The summary.
+    """
+    if callable(scenario):
+        W = scenario(seed)
+    else:
+        W = scenario
+        W.random_seed = seed
+    #乱数はメンバーごとに初期化するので，どのワーカーで実行されても結果は同じ
+    random.seed(seed)
+    np.random.seed(seed)
+
+    if modifier != None:
+        modifier(W)
+    W.exec_simulation()
+    return summarize(W)
+
+def _worker_init(memory_limit):
+    #ワーカーのメモリ上限
+    if memory_limit != None:
+        try:
+            import resource
+            resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
+        except (ImportError, ValueError, OSError) as e:
+            warnings.warn(f"memory limit per worker is not available on this platform: {e}", UserWarning)
+
+def _worker_run(task):
+    scenario, modifier, seed, summarize = task
+    return pickle.dumps(run_ensemble_member(pickle.loads(scenario), pickle.loads(modifier), seed, pickle.loads(summarize)))
+
+def run_ensemble(scenario, modifiers=None, seeds=None, summarize=summarize_world, workers=None, max_tasks_per_worker=1, memory_limit_per_worker=None):
+    """
+    Run independent simulations of many scenarios in a process pool and return their summaries.
+
+    Parameters
+    ----------
+    scenario : World | function
+        The base World that is copied for each member, or a function (factory) that takes a random seed and returns a new World. The World should not be simulated yet.
+    modifiers : list of function, optional
+        Functions that take the World of each member and modify it before the simulation (e.g., change demand or link parameters). The number of members is the length of this list. If None, no modification.
+    seeds : list of int, optional
+        Random seeds of the members. `random` and `numpy.random` are initialized with the seed before the modifier and the simulation of each member. For a factory, the seed is also passed to it. If None, `range(n_members)` is used. If both `modifiers` and `seeds` are given, they must have the same length.
+    summarize : function, optional
+        A function that takes a simulated World and returns its summary. It is executed in the worker, and only its return value is sent back. Default is `summarize_world`, which returns the basic, OD, and link statistics as pandas.DataFrame.
+    workers : int, optional
+        The number of worker processes. Default is the number of CPUs. If 1, the members are executed sequentially in this process.
+    max_tasks_per_worker : int, optional
+        The number of members a worker process executes before it is replaced by a fresh one, default is 1. It keeps memory usage of long ensembles bounded.
+    memory_limit_per_worker : int, optional
+        The maximum memory size (address space) of each worker process in bytes. A member exceeding it fails with MemoryError. Only available on Unix. Default is None (no limit).
+
+    Returns
+    -------
+    list
+        The summaries of the members in the order of `modifiers` and `seeds`.
+
+    Notes
+    -----
+    The results are reproducible by seed: each member gives the same result regardless of the number of workers or the order of execution.
+    Functions (factory, modifiers, summarize) are serialized with dill, so lambdas and local functions can be used.
+
+    Examples
+    --------
+    >>> def factory(seed):
+    ...     W = World(name="", deltan=5, tmax=2000, print_mode=0, save_mode=0, random_seed=seed)
+    ...     ...
+    ...     return W
+    >>> results = run_ensemble(factory, seeds=range(100), workers=8)
+    >>> df = pd.concat([r["basic"] for r in results])
+    """
+    if modifiers is None and seeds is None:
+        raise ValueError("either modifiers or seeds must be given")
+    if modifiers is not None and seeds is not None and len(modifiers) != len(seeds):
+        raise ValueError(f"lengths of modifiers ({len(modifiers)}) and seeds ({len(seeds)}) are different")
+    if seeds is None:
+        seeds = list(range(len(modifiers)))
+    if modifiers is None:
+        modifiers = [None for seed in seeds]
+    if workers == None:
+        workers = os.cpu_count()
+
+    #ベースのWorldは一度だけ直列化し，全メンバーで共有
+    scenario_dumped = pickle.dumps(scenario)
+    summarize_dumped = pickle.dumps(summarize)
+    tasks = [(scenario_dumped, pickle.dumps(modifier), int(seed), summarize_dumped) for modifier, seed in zip(modifiers, seeds)]
+
+    if workers == 1:
+        return [pickle.loads(_worker_run(task)) for task in tasks]
+
+    with multiprocessing.Pool(processes=min(workers, len(tasks)), initializer=_worker_init, initargs=(memory_limit_per_worker,), maxtasksperchild=max_tasks_per_worker) as pool:
+        results = pool.map(_worker_run, tasks, chunksize=1)
+    return [pickle.loads(r) for r in results]
+
+#run_branchesの分岐元．forkで起動したワーカーはこれをコピーオンライトで共有する
+_BRANCH_BASE = None
+
+def _branch_init(base_dumped, memory_limit):
+    global _BRANCH_BASE
+    _worker_init(memory_limit)
+    if base_dumped != None:
+        _BRANCH_BASE = pickle.loads(base_dumped)
+
+def run_branch(W, modifier, summarize, random_states, until_t):
+    """
+    Modify, continue, and summarize one branch. It is executed in a worker process.
+
+    Parameters
+    ----------
+    W : World
+        The branch. It is modified.
+    modifier : function | None
+        A function that takes a World and modifies it before continuing the simulation.
+    summarize : function
+        A function that takes the simulated World and returns a summary.
+    random_states : tuple
+        The states of `random` and `numpy.random` to be restored before the modifier.
+    until_t : float | None
+        The time until which the simulation is continued. If None, until the end.
+
+    Returns
+    -------
+    any
+        The summary.
+    """
+    #ディスク上のログは分岐元と共有なので，分岐先ではメモリに読み込んで書き出さない
+    W.VEHICLE_LOGS.load_to_memory()
+    W.vehicle_log_sink = None
+    random.setstate(random_states[0])
+    np.random.set_state(random_states[1])
+    if modifier != None:
+        modifier(W)
+    W.exec_simulation(until_t=until_t)
+    return summarize(W)
+
+def _branch_worker_run(i):
+    W, modifiers, summarize, random_states, until_t = _BRANCH_BASE
+    return pickle.dumps(run_branch(W, modifiers[i], summarize, random_states, until_t))
+
+def run_branches(W, modifiers, summarize=summarize_world, until_t=None, workers=None, memory_limit_per_worker=None):
+    """
+    Continue a running World under alternative modifications (e.g., control actions) in a process pool and return their summaries.
+
+    Parameters
+    ----------
+    W : World
+        The World simulated until the branching time by `exec_simulation(until_t=...)`. It is not modified.
+    modifiers : list of function
+        Functions that take the World of each branch and modify it before continuing the simulation. None means no modification.
+    summarize : function, optional
+        A function that takes a simulated branch and returns its summary. It is executed in the worker, and only its return value is sent back. Default is `summarize_world`.
+    until_t : float, optional
+        The time until which the branches are simulated. Default is None (until the end).
+    workers : int, optional
+        The number of worker processes. Default is the number of CPUs. If 1, the branches are executed sequentially in this process using `World.fork()`.
+    memory_limit_per_worker : int, optional
+        The maximum memory size (address space) of each worker process in bytes. Only available on Unix. Default is None (no limit).
+
+    Returns
+    -------
+    list
+        The summaries of the branches in the order of `modifiers`.
+
+    Notes
+    -----
+    Where the "fork" start method is available (Linux, etc.), each worker process is forked from this process and shares the World copy-on-write, so that nothing is serialized and only the memory pages modified by the branch are duplicated. Otherwise, the World is serialized with dill once and sent to the workers.
+    Each worker executes one branch. All branches continue with the same random numbers (the current states of `random` and `numpy.random`), so that the differences of the results are only due to the modifications.
+
+    Examples
+    --------
+    >>> W.exec_simulation(until_t=1800)
+    >>> def close(link):
+    ...     def f(W):
+    ...         W.get_link(link).free_flow_speed = 0.1
+    ...     return f
+    >>> results = run_branches(W, [None, close("link1"), close("link2")], until_t=3600)
+    """
+    global _BRANCH_BASE
+    if W.finalized == 0:
+        W.finalize_scenario()
+    random_states = (random.getstate(), np.random.get_state())
+    if workers == None:
+        workers = os.cpu_count()
+
+    if workers == 1:
+        results = [run_branch(W.fork_one(), modifier, summarize, random_states, until_t) for modifier in modifiers]
+        #呼び出し元のシミュレーションが同じ乱数で続けられるように戻す
+        random.setstate(random_states[0])
+        np.random.set_state(random_states[1])
+        return results
+
+    base = (W, list(modifiers), summarize, random_states, until_t)
+    if "fork" in multiprocessing.get_all_start_methods():
+        ctx = multiprocessing.get_context("fork")
+        base_dumped = None
+        _BRANCH_BASE = base
+    else:
+        ctx = multiprocessing.get_context()
+        base_dumped = pickle.dumps(base)
+    try:
+        with ctx.Pool(processes=min(workers, len(modifiers)), initializer=_branch_init, initargs=(base_dumped, memory_limit_per_worker), maxtasksperchild=1) as pool:
+            results = pool.map(_branch_worker_run, range(len(modifiers)), chunksize=1)
+    finally:
+        _BRANCH_BASE = None
+    return [pickle.loads(r) for r in results]
@@ -0,0 +1 @@
+from .Ensemble import *
\ No newline at end of file
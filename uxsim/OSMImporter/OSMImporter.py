@@ -345,11 +345,11 @@ class OSMImporter:
         """
         for i, node in enumerate(nodes):
             nname = str(node[0])
-            if nname in [n.name for n in W.NODES]:
+            if nname in W.NODES_NAME_DICT:
                 nname + f"_osm{i}"
             W.addNode(str(node[0]), x=node[1], y=node[2], auto_rename=True)
         for i, link in enumerate(links):
             lname = str(link[0])
-            if lname in [l.name for l in W.LINKS]:
+            if lname in W.LINKS_NAME_DICT:
                 lname + f"_osm{i}"
             W.addLink(lname, str(link[1]), str(link[2]), length=link[5]*coef_degree_to_meter, free_flow_speed=link[4], jam_density_per_lane=default_jam_density, number_of_lanes=link[3], auto_rename=True)
\ No newline at end of file
@@ -221,7 +221,7 @@ class TaxiHandler_random(TaxiHandler):
         """
         Assigns trip request to random available taxi.
         """
-        vacant_taxis = [veh for veh in s.W.VEHICLES.values() if veh.mode == "taxi" and veh.state == "run" and veh.dest == None]
+        vacant_taxis = sorted([veh for veh in s.W.VEHICLES_RUNNING.values() if veh.mode == "taxi" and veh.dest == None], key=lambda veh: veh.id)
         random.shuffle(vacant_taxis)
         for trip_request in s.trip_requests[:]:
             if len(vacant_taxis) == 0:
@@ -242,7 +242,7 @@ class TaxiHandler_nearest(TaxiHandler):
         """
         Assigns trip request to nearest available taxi.
         """
-        vacant_taxis = [veh for veh in s.W.VEHICLES.values() if veh.mode == "taxi" and veh.state == "run" and veh.dest == None]
+        vacant_taxis = sorted([veh for veh in s.W.VEHICLES_RUNNING.values() if veh.mode == "taxi" and veh.dest == None], key=lambda veh: veh.id)
         for trip_request in s.trip_requests[:]:
             if len(vacant_taxis) == 0:
                 break
@@ -273,7 +273,7 @@ class TaxiHandler_nearest_matching_radious(TaxiHandler):
         """
         Assigns trip request to nearest available taxi that is within the radious of the origin node.
         """
-        vacant_taxis = [veh for veh in s.W.VEHICLES.values() if veh.mode == "taxi" and veh.state == "run" and veh.dest == None]
+        vacant_taxis = sorted([veh for veh in s.W.VEHICLES_RUNNING.values() if veh.mode == "taxi" and veh.dest == None], key=lambda veh: veh.id)
         for trip_request in s.trip_requests[:]:
             if len(vacant_taxis) == 0:
                 break
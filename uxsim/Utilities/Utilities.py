@@ -71,9 +71,9 @@ def enumerate_k_shortest_routes(W, source, target, k, cost_function=lambda l: l.
     routes = []
     for path in k_shortest_paths:
         route = []
-        for n in path[:-1]:
-            for l in W.LINKS:
-                if l.start_node.name == n and l.end_node.name == path[path.index(n)+1]:
+        for n, n_next in zip(path[:-1], path[1:]):
+            for l in W.get_node(n).outlinks.values():
+                if l.end_node.name == n_next:
                     route.append(l.name)
         routes.append(route)
 
@@ -141,8 +141,9 @@ class Analyzer:
             s.linkc_remain[l] = l.cum_arrival[-1]-l.cum_departure[-1]
             s.linkc_tt_free[l] = l.length/l.u
             if s.linkc_volume[l]:
-                s.linkc_tt_ave[l] = np.average([t for t in l.traveltime_actual if t>0])
-                s.linkc_tt_std[l] = np.std([t for t in l.traveltime_actual if t>0])
+                traveltime_actual = l.traveltime_actual
+                s.linkc_tt_ave[l] = np.average(traveltime_actual[traveltime_actual>0])
+                s.linkc_tt_std[l] = np.std(traveltime_actual[traveltime_actual>0])
 
     def compute_accurate_traj(s):
         """
@@ -156,121 +157,155 @@ class Analyzer:
         else:
             s.flag_trajectory_computed = 1
 
-        for veh in s.W.VEHICLES.values():
-            l_old = None
-            for i in lange(veh.log_t):
-                if veh.log_link[i] != -1:
-                    l = s.W.get_link(veh.log_link[i])
-                    if l_old != l:
-                        l.tss.append([])
-                        l.xss.append([])
-                        l.ls.append(veh.log_lane[i])
-                        l.cs.append(veh.color)
-                        l.names.append(veh.name)
-
-                    l_old = l
-                    l.tss[-1].append(veh.log_t[i])
-                    l.xss[-1].append(veh.log_x[i])
-
+        #全車両のログを車両・時刻順に並べ，リンク上の行のみ取り出す
+        logs = s.W.VEHICLE_LOGS
+        columns = logs.expand_all()
+        on_link = columns["link"] >= 0
+        vehs = columns["veh"][on_link].astype(int)
+        links = columns["link"][on_link].astype(int)
+        ts = columns["t"][on_link].astype(np.int64)*s.W.DELTAT
+        xs = columns["x"][on_link].astype(float)
+        lanes = columns["lane"][on_link].astype(int)
+
+        #車両かリンクが変わったら新しい軌跡
+        is_start = np.ones(len(links), dtype=bool)
+        is_start[1:] = (vehs[1:] != vehs[:-1]) | (links[1:] != links[:-1])
+        starts = np.flatnonzero(is_start)
+        ends = np.append(starts[1:], len(links))-1
+        traj = np.cumsum(is_start)-1
+        traj_link = links[starts]
+
+        #端部を外挿
+        u = np.array([l.u for l in s.W.LINKS], dtype=float)[traj_link]
+        length = np.array([l.length for l in s.W.LINKS], dtype=float)[traj_link]
+        x_first = xs[starts]
+        x_last = xs[ends]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            add_first = (x_first != 0) & (x_first/u > s.W.DELTAT*0.01)
+            add_last = (length-u*s.W.DELTAT <= x_last) & (x_last < length) & ((length-x_last)/u > s.W.DELTAT*0.01)
+        sizes = ends-starts+1 + add_first + add_last
+        offsets = np.zeros(len(sizes)+1, dtype=int)
+        offsets[1:] = np.cumsum(sizes)
+        traj_ts = np.zeros(offsets[-1])
+        traj_xs = np.zeros(offsets[-1])
+        positions = offsets[traj]+add_first[traj]+np.arange(len(links))-starts[traj]
+        traj_ts[positions] = ts
+        traj_xs[positions] = xs
+        traj_ts[offsets[:-1][add_first]] = (ts[starts]-x_first/u)[add_first]
+        traj_xs[offsets[:-1][add_first]] = 0
+        traj_ts[offsets[1:][add_last]-1] = (ts[ends]+(length-x_last)/u)[add_last]
+        traj_xs[offsets[1:][add_last]-1] = length[add_last]
+
+        #リンク別に並べ替える．各リンク内では車両順
+        order = np.argsort(traj_link, kind="stable")
+        point_order = np.repeat(offsets[:-1][order], sizes[order]) + np.arange(offsets[-1]) - np.repeat(np.cumsum(sizes[order])-sizes[order], sizes[order])
+        traj_ts = traj_ts[point_order]
+        traj_xs = traj_xs[point_order]
+        sizes = sizes[order]
+        traj_veh = vehs[starts][order].tolist()
+        traj_lane = lanes[starts][order].tolist()
+        link_trajs = np.zeros(len(s.W.LINKS)+1, dtype=int)
+        link_trajs[1:] = np.cumsum(np.bincount(traj_link, minlength=len(s.W.LINKS)))
+        point_offsets = np.zeros(len(sizes)+1, dtype=int)
+        point_offsets[1:] = np.cumsum(sizes)
+
+        vehicles = list(s.W.VEHICLES.values())
         for l in s.W.LINKS:
-            #端部を外挿
-            for i in lange(l.xss):
-                if len(l.xss[i]):
-                    if l.xss[i][0] != 0:
-                        x_remain = l.xss[i][0]
-                        if x_remain/l.u > s.W.DELTAT*0.01:
-                            l.xss[i].insert(0, 0)
-                            l.tss[i].insert(0, l.tss[i][0]-x_remain/l.u)
-                    if l.length-l.u*s.W.DELTAT <= l.xss[i][-1] < l.length:
-                        x_remain = l.length-l.xss[i][-1]
-                        if x_remain/l.u > s.W.DELTAT*0.01:
-                            l.xss[i].append(l.length)
-                            l.tss[i].append(l.tss[i][-1]+x_remain/l.u)
+            i0, i1 = link_trajs[l.id], link_trajs[l.id+1]
+            l.traj_t = traj_ts[point_offsets[i0]:point_offsets[i1]]
+            l.traj_x = traj_xs[point_offsets[i0]:point_offsets[i1]]
+            l.traj_offsets = point_offsets[i0:i1+1]-point_offsets[i0]
+            l.ls = traj_lane[i0:i1]
+            l.cs = [vehicles[i].color for i in traj_veh[i0:i1]]
+            l.names = [vehicles[i].name for i in traj_veh[i0:i1]]
 
     def compute_edie_state(s):
         """
         Compute Edie's traffic state for each link.
+
+        Notes
+        -----
+        If `World.edie_state_online` is enabled, the distance and time in each cell have been accumulated during the simulation, so this only computes the states from them. It can be called repeatedly during the simulation to obtain the current states.
         """
         if s.flag_edie_state_computed:
             return 0
-        else:
+        elif s.W.edie_state_online == 0:
             s.flag_edie_state_computed = 1
+            s.compute_accurate_traj()
 
-        s.compute_accurate_traj()
         for l in s.W.LINKS:
             DELTAX = l.edie_dx
             DELTATE = l.edie_dt
             MAXX = l.length
             MAXT = s.W.TMAX
+            nt = int(MAXT/DELTATE)
+            nx = int(MAXX/DELTAX)
 
-            dt = DELTATE
-            dx = DELTAX
-            tn = [[ddict(lambda: 0) for i in range(int(MAXX/DELTAX))] for j in range(int(MAXT/DELTATE))]
-            dn = [[ddict(lambda: 0) for i in range(int(MAXX/DELTAX))] for j in range(int(MAXT/DELTATE))]
-
-            l.k_mat = np.zeros([int(MAXT/DELTATE), int(MAXX/DELTAX)])
-            l.q_mat = np.zeros([int(MAXT/DELTATE), int(MAXX/DELTAX)])
-            l.v_mat = np.zeros([int(MAXT/DELTATE), int(MAXX/DELTAX)])
-
-            for v in lange(l.xss):
-                for i in lange(l.xss[v][:-1]):
-                    i0 = l.names[v]
-                    x0 = l.xss[v][i]
-                    x1 = l.xss[v][i+1]
-                    t0 = l.tss[v][i]
-                    t1 = l.tss[v][i+1]
-                    if t1-t0 != 0:
-                        v0 = (x1-x0)/(t1-t0)
-                    else:
-                        #compute_accurate_traj()の外挿で極稀にt1=t0になったのでエラー回避（もう起きないはずだが念のため）
-                        v0 = 0
-
-                    tt = int(t0//dt)
-                    xx = int(x0//dx)
-
-                    if v0 > 0:
-                        #残り
-                        xl0 = dx-x0%dx
-                        xl1 = x1%dx
-                        tl0 = xl0/v0
-                        tl1 = xl1/v0
-
-                        if tt < int(MAXT/DELTATE) and xx < int(MAXX/DELTAX):
-                            if xx == x1//dx:
-                                #(x,t)
-                                dn[tt][xx][i0] += x1-x0
-                                tn[tt][xx][i0] += t1-t0
-                            else:
-                                #(x+n, t)
-                                jj = int(x1//dx-xx+1)
-                                for j in range(jj):
-                                    if xx+j < int(MAXX/DELTAX):
-                                        if j == 0:
-                                            dn[tt][xx+j][i0] += xl0
-                                            tn[tt][xx+j][i0] += tl0
-                                        elif j == jj-1:
-                                            dn[tt][xx+j][i0] += xl1
-                                            tn[tt][xx+j][i0] += tl1
-                                        else:
-                                            dn[tt][xx+j][i0] += dx
-                                            tn[tt][xx+j][i0] += dx/v0
-                    else:
-                        if tt < int(MAXT/DELTATE) and xx < int(MAXX/DELTAX):
-                            dn[tt][xx][i0] += 0
-                            tn[tt][xx][i0] += t1-t0
-
-            for i in lange(tn):
-                for j in lange(tn[i]):
-                    t = list(tn[i][j].values())*s.W.DELTAN
-                    d = list(dn[i][j].values())*s.W.DELTAN
-                    l.tn_mat[i,j] = sum(t)
-                    l.dn_mat[i,j] = sum(d)
-                    l.k_mat[i,j] = l.tn_mat[i,j]/DELTATE/DELTAX
-                    l.q_mat[i,j] = l.dn_mat[i,j]/DELTATE/DELTAX
+            if s.W.edie_state_online == 0:
+                s.compute_edie_state_link(l, nt, nx)
+            l.k_mat = l.tn_mat[:nt,:nx]/DELTATE/DELTAX
+            l.q_mat = l.dn_mat[:nt,:nx]/DELTATE/DELTAX
             with np.errstate(invalid="ignore"):
                 l.v_mat = l.q_mat/l.k_mat
             l.v_mat = np.nan_to_num(l.v_mat, nan=l.u)
 
+    def compute_edie_state_link(s, l, nt, nx):
+        """
+        Compute the total time spent (`tn_mat`) and total distance traveled (`dn_mat`) in each cell of a link from the vehicle trajectories.
+
+        Parameters
+        ----------
+        l : Link
+            The link.
+        nt : int
+            The number of time cells.
+        nx : int
+            The number of space cells.
+        """
+        DELTAX = l.edie_dx
+        DELTATE = l.edie_dt
+
+        #全軌跡の隣接点の組を区間とし，各区間の距離と時間をセルに一括で加算する
+        xs = l.traj_x
+        ts = l.traj_t
+        is_segment = np.ones(max(len(xs)-1, 0), dtype=bool)
+        ends = l.traj_offsets[1:]-1
+        is_segment[ends[(0 <= ends) & (ends < len(is_segment))]] = False
+        x0 = xs[:-1][is_segment]
+        x1 = xs[1:][is_segment]
+        t0 = ts[:-1][is_segment]
+        t1 = ts[1:][is_segment]
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            #compute_accurate_traj()の外挿で極稀にt1=t0になったのでエラー回避（もう起きないはずだが念のため）
+            v0 = np.where(t1 != t0, (x1-x0)/(t1-t0), 0)
+        tt = (t0//DELTATE).astype(int)
+        xx = (x0//DELTAX).astype(int)
+        xx1 = (x1//DELTAX).astype(int)
+        inside = (tt >= 0) & (tt < nt) & (xx < nx)
+
+        #停止中または同じセル内の移動
+        same = inside & ((v0 <= 0) | (xx == xx1))
+        cells = [tt[same]*nx+xx[same]]
+        dn = [np.where(v0[same] > 0, x1[same]-x0[same], 0)]
+        tn = [t1[same]-t0[same]]
+
+        #複数のセルにまたがる移動．始端と終端のセルは残りの距離，途中のセルはセル長
+        cross = inside & (v0 > 0) & (xx != xx1)
+        jj = xx1[cross]-xx[cross]+1
+        i = np.repeat(np.arange(len(jj)), jj)
+        j = np.arange(len(i)) - np.repeat(np.cumsum(jj)-jj, jj)
+        d = np.where(j == 0, (DELTAX-x0[cross]%DELTAX)[i], np.where(j == jj[i]-1, (x1[cross]%DELTAX)[i], DELTAX))
+        xj = xx[cross][i]+j
+        valid = xj < nx
+        cells.append(tt[cross][i][valid]*nx+xj[valid])
+        dn.append(d[valid])
+        tn.append((d/v0[cross][i])[valid])
+
+        cells = np.concatenate(cells)
+        l.tn_mat[:nt,:nx] = np.bincount(cells, weights=np.concatenate(tn), minlength=nt*nx).reshape(nt, nx)*s.W.DELTAN
+        l.dn_mat[:nt,:nx] = np.bincount(cells, weights=np.concatenate(dn), minlength=nt*nx).reshape(nt, nx)*s.W.DELTAN
+
     @catch_exceptions_and_warn()
     def print_simple_stats(s, force_print=False):
         """
@@ -1163,24 +1198,34 @@ class Analyzer:
             warnings.warn("vehicle_logging_timestep_interval is not 1. The output data is not exactly accurate.", LoggingWarning)
 
         if s.flag_pandas_convert == 0:
-            out = [["name", "dn", "orig", "dest", "t", "link", "x", "s", "v"]]
-            for veh in s.W.VEHICLES.values():
-                for i in range(len(veh.log_t)):
-                    if veh.log_state[i] in ("wait", "run", "end", "abort"):
-                        if veh.log_link[i] != -1:
-                            linkname = veh.log_link[i].name
-                        else:
-                            if veh.log_state[i] == "wait":
-                                linkname = "waiting_at_origin_node"
-                            elif veh.log_state[i] == "abort":
-                                linkname = "trip_aborted"
-                            else:
-                                linkname = "trip_end"
-                        veh_dest_name = None
-                        if veh.dest != None:
-                            veh_dest_name = veh.dest.name
-                        out.append([veh.name, s.W.DELTAN, veh.orig.name, veh_dest_name, veh.log_t[i], linkname, veh.log_x[i], veh.log_s[i], veh.log_v[i]])
-            s.df_vehicles = pd.DataFrame(out[1:], columns=out[0])
+            #ログの列から車両順に並べて一括変換
+            logs = s.W.VEHICLE_LOGS
+            columns = logs.expand_all()
+            rows = columns["state"] != logs.STATE_CODES["home"]
+            vehs = columns["veh"][rows]
+            states = columns["state"][rows].astype(np.int64)
+            links = columns["link"][rows]
+
+            vehicles = list(s.W.VEHICLES.values())
+            names = np.array([veh.name for veh in vehicles], dtype=object)
+            orig_names = np.array([veh.orig.name for veh in vehicles], dtype=object)
+            dest_names = np.array([veh.dest.name if veh.dest != None else None for veh in vehicles], dtype=object)
+            #リンク外の状態の表記は，リンク名の後ろに状態の番号順に並べて参照する
+            link_names = np.array([l.name for l in s.W.LINKS]+["trip_end" for state in logs.STATES], dtype=object)
+            link_names[len(s.W.LINKS)+logs.STATE_CODES["wait"]] = "waiting_at_origin_node"
+            link_names[len(s.W.LINKS)+logs.STATE_CODES["abort"]] = "trip_aborted"
+
+            s.df_vehicles = pd.DataFrame({
+                "name": names[vehs],
+                "dn": s.W.DELTAN,
+                "orig": orig_names[vehs],
+                "dest": dest_names[vehs],
+                "t": columns["t"][rows].astype(np.int64)*s.W.DELTAT,
+                "link": link_names[np.where(links >= 0, links, len(s.W.LINKS)+states)],
+                "x": columns["x"][rows].astype(float),
+                "s": columns["s"][rows].astype(float),
+                "v": columns["v"][rows].astype(float),
+            })
 
             s.flag_pandas_convert = 1
         return s.df_vehicles
@@ -1311,11 +1356,18 @@ class Analyzer:
         -------
         pd.DataFrame
         """
-        out = [["link", "t", "arrival_count", "departure_count", "actual_travel_time", "instantanious_travel_time"]]
+        dfs = []
         for link in s.W.LINKS:
-            for i in range(s.W.TSIZE):
-                out.append([link.name, i*s.W.DELTAT, link.cum_arrival[i], link.cum_departure[i], link.traveltime_actual[i], link.traveltime_instant[i]])
-        s.df_link_cumulative = pd.DataFrame(out[1:], columns=out[0])
+            tsize = len(link.cum_arrival)
+            dfs.append(pd.DataFrame({
+                "link": link.name,
+                "t": np.arange(tsize)*s.W.DELTAT,
+                "arrival_count": link.cum_arrival,
+                "departure_count": link.cum_departure,
+                "actual_travel_time": link.traveltime_actual[:tsize],
+                "instantanious_travel_time": link.traveltime_instant
+            }))
+        s.df_link_cumulative = pd.concat(dfs, ignore_index=True)
         return s.df_link_cumulative
 
     @catch_exceptions_and_warn()
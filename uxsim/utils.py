@@ -6,6 +6,9 @@ import warnings
 import functools
 import traceback
 import sys
+import csv
+import numpy as np
+import pandas as pd
 
 # 汎用関数
 
@@ -145,6 +148,209 @@ def display_image_in_notebook(image_path):
     with open(image_path, "rb") as f:
         display(Image(data=f.read(), format='png'))
 
+def ragged_to_flat(lists, dtype=None):
+    """
+    Pack a list of lists into a flat array and offsets, for saving with NumPy.
+
+    Parameters
+    ----------
+    lists : list of list
+        The lists.
+    dtype : data-type, optional
+        The dtype of the flat array. Default is inferred from the elements (float if empty).
+
+    Returns
+    -------
+    flat : numpy.ndarray
+        The concatenated elements.
+    offsets : numpy.ndarray
+        The start index of each list in `flat`, followed by the total length. The i-th list is `flat[offsets[i]:offsets[i+1]]`.
+    """
+    offsets = np.zeros(len(lists)+1, dtype=int)
+    offsets[1:] = np.cumsum([len(l) for l in lists])
+    flat = [v for l in lists for v in l]
+    if dtype == None and len(flat) == 0:
+        dtype = float
+    return np.array(flat, dtype=dtype), offsets
+
+def flat_to_ragged(flat, offsets):
+    """
+    Unpack a flat array and offsets made by `ragged_to_flat` into a list of lists.
+
+    Parameters
+    ----------
+    flat : numpy.ndarray
+        The concatenated elements.
+    offsets : numpy.ndarray
+        The offsets.
+
+    Returns
+    -------
+    list of list
+        The lists of Python scalars.
+    """
+    flat = flat.tolist()
+    offsets = offsets.tolist()
+    return [flat[offsets[i]:offsets[i+1]] for i in range(len(offsets)-1)]
+
+class RaggedView:
+    """
+    Read-only list-like view of a flat array split by offsets (as made by `ragged_to_flat`). The i-th element is the array view `flat[offsets[i]:offsets[i+1]]`.
+    """
+    def __init__(s, flat, offsets):
+        s.flat = flat
+        s.offsets = offsets
+
+    def __len__(s):
+        return len(s.offsets)-1
+
+    def __getitem__(s, i):
+        if type(i) is slice:
+            return [s[j] for j in range(*i.indices(len(s)))]
+        if i < 0:
+            i += len(s)
+        if not 0 <= i < len(s):
+            raise IndexError("RaggedView index out of range")
+        return s.flat[s.offsets[i]:s.offsets[i+1]]
+
+    def __iter__(s):
+        for i in range(len(s)):
+            yield s.flat[s.offsets[i]:s.offsets[i+1]]
+
+def read_scenario_csv(fname, header_column, header_value):
+    """
+    Read a scenario CSV file as strings at once.
+
+    Parameters
+    ----------
+    fname : str
+        The file name.
+    header_column : int
+        The column used to detect header rows.
+    header_value : str
+        The value of `header_column` in header rows. The rows with this value are removed.
+
+    Returns
+    -------
+    pandas.DataFrame
+        The rows of the file. The columns are numbered from 0 and all values are str. Rows may have different numbers of fields (e.g., a demand file whose header has no volume column); missing fields are empty strings.
+    """
+    try:
+        df = pd.read_csv(fname, header=None, dtype=str, keep_default_na=False)
+    except pd.errors.ParserError:
+        #行ごとに列数が違う場合はcsvで読み直す
+        with open(fname, newline="") as f:
+            rows = [r for r in csv.reader(f) if len(r)]
+        df = pd.DataFrame(rows, dtype=str)
+    df = df.fillna("")
+    return df[df[header_column] != header_value].reset_index(drop=True)
+
+def platoon_departures(increment, n_steps, deltan, tol=1e-8):
+    """
+    Compute the departure timesteps of platoons of many demands at once.
+
+    For each demand i, `increment[i]` vehicles are accumulated at each of its `n_steps[i]` timesteps, and a platoon departs whenever the accumulated number reaches `deltan` (then `deltan` is subtracted). This is the procedure of `World.adddemand`.
+
+    Parameters
+    ----------
+    increment : array-like of float
+        The number of vehicles added at each timestep of each demand, i.e., flow*DELTAT.
+    n_steps : array-like of int
+        The number of timesteps of each demand.
+    deltan : int
+        The platoon size.
+    tol : float, optional
+        The tolerance (in platoons) to detect a demand whose accumulated number hits a multiple of `deltan` within floating point error, default is 1e-8.
+
+    Returns
+    -------
+    rows : numpy.ndarray
+        The index of the demand of each platoon.
+    steps : numpy.ndarray
+        The departure timestep of each platoon, counted from the first timestep of the demand. The platoons are sorted by `rows`, then by `steps`.
+
+    Notes
+    -----
+    The departures are given in closed form: the j-th platoon departs at the first timestep k such that (k+1)*increment >= j*deltan. Where this is ambiguous due to floating point error, the accumulation is repeated step by step for the distinct values of `increment`, so that the results are identical to those of `World.adddemand`.
+    """
+    increment = np.asarray(increment, dtype=float).ravel()
+    n_steps = np.asarray(n_steps, dtype=np.int64).ravel()
+    ids = np.nonzero((increment > 0) & (n_steps > 0))[0]
+    a = increment[ids]
+    n = n_steps[ids]
+    r = a/deltan
+
+    #閉じた形での計算
+    total = n*r
+    num = np.floor(total).astype(np.int64)
+    ambiguous = np.abs(total-np.round(total)) < tol
+    rows = np.repeat(np.arange(len(ids)), num)
+    j = np.arange(len(rows)) - np.repeat(np.cumsum(num)-num, num) + 1
+    x = j/r[rows]
+    ambiguous[rows[np.abs(x-np.round(x))*r[rows] < tol]] = True
+    steps = np.ceil(x).astype(np.int64) - 1
+    keep = ~ambiguous[rows]
+    rows_list = [rows[keep]]
+    steps_list = [steps[keep]]
+
+    #浮動小数点誤差で判定が変わりうる需要は，incrementの値ごとに逐次計算
+    if ambiguous.any():
+        ia = np.nonzero(ambiguous)[0]
+        values, inv = np.unique(a[ia], return_inverse=True)
+        n_max = np.zeros(len(values), dtype=np.int64)
+        np.maximum.at(n_max, inv, n[ia])
+        order = np.argsort(-n_max, kind="stable") #計算中の値が先頭に並ぶようにする
+        rank = np.empty(len(order), dtype=np.int64)
+        rank[order] = np.arange(len(order))
+        values = values[order]
+        n_max = n_max[order]
+        if len(values) < 32:
+            #値が少なければPythonのfloatで逐次計算する方が速い（結果は同じ）
+            ev_u = []
+            ev_k = []
+            for u, (value, nu) in enumerate(zip(values.tolist(), n_max.tolist())):
+                f = 0
+                for k in range(nu):
+                    f += value
+                    while f >= deltan:
+                        ev_u.append(u)
+                        ev_k.append(k)
+                        f -= deltan
+            ev_u = np.array(ev_u, dtype=np.int64)
+            ev_k = np.array(ev_k, dtype=np.int64)
+        else:
+            f = np.zeros(len(values))
+            ev_u = []
+            ev_k = []
+            for k in range(n_max[0]):
+                m = np.searchsorted(-n_max, -k, side="left")
+                f[:m] += values[:m]
+                while True:
+                    departed = np.nonzero(f[:m] >= deltan)[0]
+                    if len(departed) == 0:
+                        break
+                    ev_u.append(departed)
+                    ev_k.append(np.full(len(departed), k, dtype=np.int64))
+                    f[departed] -= deltan
+            ev_u = np.concatenate(ev_u) if len(ev_u) else np.zeros(0, dtype=np.int64)
+            ev_k = np.concatenate(ev_k) if len(ev_k) else np.zeros(0, dtype=np.int64)
+        o = np.lexsort((ev_k, ev_u))
+        ev_u = ev_u[o]
+        ev_k = ev_k[o]
+        ev_start = np.searchsorted(ev_u, np.arange(len(values)))
+
+        u = rank[inv]
+        key_base = n_max[0]+1
+        cnt = np.searchsorted(ev_u*key_base+ev_k, u*key_base+n[ia]) - ev_start[u]
+        within = np.arange(cnt.sum()) - np.repeat(np.cumsum(cnt)-cnt, cnt)
+        rows_list.append(np.repeat(ia, cnt))
+        steps_list.append(ev_k[np.repeat(ev_start[u], cnt)+within])
+
+    rows = np.concatenate(rows_list)
+    steps = np.concatenate(steps_list)
+    o = np.lexsort((steps, rows))
+    return ids[rows[o]], steps[o]
+
 class LoggingWarning(UserWarning):
     """
     This warns that when vehicle_logging_timestep_interval is not 1 but called vehicle logging-related functions.
@@ -3,13 +3,17 @@ UXsim: Macroscopic/mesoscopic traffic flow simulator in a network.
 This `uxsim.py` is the core of UXsim. It summarizes the classes and methods that are essential for the simulation.
 """
 
-import random, csv, time, math, string, warnings
+import random, csv, time, math, string, warnings, heapq, copy, os, json, bisect, tempfile
 from collections import deque, OrderedDict
+from collections.abc import Mapping
 from collections import defaultdict as ddict
 
 import numpy as np
+import pandas as pd
 import matplotlib.pyplot as plt
-from scipy.sparse.csgraph import floyd_warshall
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import floyd_warshall, dijkstra
+from scipy.spatial import cKDTree
 import dill as pickle
 
 from .analyzer import *
@@ -109,12 +113,14 @@ class Node:
 
         s.id = len(s.W.NODES)
         s.name = name
-        if s.name in [n.name for n in s.W.NODES]:
+        if s.name in s.W.NODES_NAME_DICT:
             if auto_rename:
                 s.name = s.name+"_renamed"+"".join(random.choices(string.ascii_letters + string.digits, k=8))
             else:
                 raise ValueError(f"Node name {s.name} already used by another node. Please specify a unique name.")
         s.W.NODES.append(s)
+        s.W.NODES_NAME_DICT[s.name] = s
+        s.W.NODE_KDTREE = None #座標の空間インデックスは次の検索時に作り直す
 
     def __repr__(s):
         return f"<Node {s.name}>"
@@ -159,12 +165,12 @@ class Node:
 
                     #consider the link preferences
                     outlinks = list(s.outlinks.values())
-                    if set(outlinks) & set(veh.links_prefer): 
+                    if veh.links_prefer and set(outlinks) & set(veh.links_prefer): 
                         outlinks = list(set(outlinks) & set(veh.links_prefer))
-                    if set(outlinks) & set(veh.links_avoid):
+                    if veh.links_avoid and set(outlinks) & set(veh.links_avoid):
                         outlinks = list(set(outlinks) - set(veh.links_avoid))
                     
-                    preference = [veh.route_pref[l] for l in outlinks]
+                    preference = veh.route_pref_of_links(outlinks)
                     if sum(preference) > 0:
                         outlink = random.choices(outlinks, preference)[0]
                     else:
@@ -192,8 +198,9 @@ class Node:
                             assert veh.leader.lane == veh.lane
 
                         outlink.vehicles.append(veh)
+                        outlink.add_vehicle_aggregates(veh)
 
-                        outlink.cum_arrival[-1] += s.W.DELTAN
+                        outlink._cum_arrival[s.W.T] += s.W.DELTAN
                         veh.link_arrival_time = s.W.T*s.W.DELTAT
 
                         outlink.capacity_in_remain -= s.W.DELTAN
@@ -215,9 +222,20 @@ class Node:
         - The vehicle has the right signal phase to proceed.
         - The current link has enough capacity to allow the vehicle to exit.
         - The node capacity is not exceeded.
+
+        The requests are bucketed by their next link in request order, and each acceptance attempt of a link only examines its own bucket.
         """
+        #行先リンク別の送り出し候補．信号はこの処理中に変化しないので，赤信号のリンクの車両は予め除外
+        candidates = {}
+        for veh in s.incoming_vehicles:
+            if veh.route_next_link != None:
+                if veh.route_next_link not in candidates:
+                    candidates[veh.route_next_link] = []
+                if s.signal_phase in veh.link.signal_group or len(s.signal)<=1:
+                    candidates[veh.route_next_link].append(veh)
+
         outlinks = []
-        for outlink in {veh.route_next_link for veh in s.incoming_vehicles if veh.route_next_link != None}:
+        for outlink in candidates:
             for i in range(outlink.lanes):#車線の数だけ受け入れ試行回数あり
                 outlinks.append(outlink)
         random.shuffle(outlinks)
@@ -225,23 +243,25 @@ class Node:
         for outlink in outlinks: 
             if (len(outlink.vehicles) < outlink.lanes or outlink.vehicles[-outlink.lanes].x > outlink.delta_per_lane*s.W.DELTAN) and outlink.capacity_in_remain >= s.W.DELTAN and s.flow_capacity_remain >= s.W.DELTAN:
                 #受け入れ可能かつ流出可能の場合，リンク優先度に応じて選択
-                vehs = [
-                    veh for veh in s.incoming_vehicles 
-                    if veh == veh.link.vehicles[0] and #送り出しリンクで先頭車線の車両
-                    veh.route_next_link == outlink and #行先リンクが受け入れリンク
-                    (s.signal_phase in veh.link.signal_group or len(s.signal)<=1) and #信号が合致
+                bucket = candidates[outlink]
+                idxs = [
+                    i for i, veh in enumerate(bucket)
+                    if veh != None and #送り出し済みの車両はNone
+                    veh == veh.link.vehicles[0] and #送り出しリンクで先頭車線の車両
                     veh.link.capacity_out_remain >= s.W.DELTAN
                 ] 
-                if len(vehs) == 0:
+                if len(idxs) == 0:
                     continue
-                veh = random.choices(vehs, [veh.link.merge_priority for veh in vehs])[0] #車線の少ないリンクは，車線の多いリンクの試行回数の恩恵を受けて少し有利になる．大きな差はでないので許容する
+                idx = random.choices(idxs, [bucket[i].link.merge_priority for i in idxs])[0] #車線の少ないリンクは，車線の多いリンクの試行回数の恩恵を受けて少し有利になる．大きな差はでないので許容する
                 
+                veh = bucket[idx]
+                bucket[idx] = None
                 inlink = veh.link
 
                 #累積台数関連更新
-                inlink.cum_departure[-1] += s.W.DELTAN
-                outlink.cum_arrival[-1] += s.W.DELTAN
-                inlink.traveltime_actual[int(veh.link_arrival_time/s.W.DELTAT):] = s.W.T*s.W.DELTAT - veh.link_arrival_time #自分の流入時刻より後の実旅行時間も今の実旅行時間で仮決め．後に流出した車両が上書きする前提
+                inlink._cum_departure[s.W.T] += s.W.DELTAN
+                outlink._cum_arrival[s.W.T] += s.W.DELTAN
+                inlink.record_traveltime_actual(veh.link_arrival_time, s.W.T*s.W.DELTAT - veh.link_arrival_time) #自分の流入時刻より後の実旅行時間も今の実旅行時間で仮決め．後に流出した車両が上書きする前提
 
                 veh.link_arrival_time = s.W.T*s.W.DELTAT
 
@@ -252,6 +272,7 @@ class Node:
 
                 #リンク間遷移実行
                 inlink.vehicles.popleft()
+                inlink.remove_vehicle_aggregates(veh)
                 veh.link = outlink
                 veh.x = 0
 
@@ -281,13 +302,16 @@ class Node:
                     if x_next >= outlink.length:
                         x_next = outlink.length
                 veh.x = x_next
+                if veh.W.edie_state_online and x_next > 0:
+                    #リンク流入時の走り残しは自由流とみなす
+                    outlink.add_edie_state(0, x_next, x_next/outlink.u)
 
                 #今移動した車両の後続車両がトリップ終了待ちの場合，トリップ終了させる
                 if len(inlink.vehicles) and inlink.vehicles[0].flag_waiting_for_trip_end:
                     inlink.vehicles[0].end_trip()
 
                 outlink.vehicles.append(veh)
-                s.incoming_vehicles.remove(veh)
+                outlink.add_vehicle_aggregates(veh)
 
         #各リンクの先頭のトリップ終了待ち車両をトリップ終了させる
         for link in s.inlinks.values():
@@ -470,16 +494,23 @@ class Link:
         #リンク内車両一覧
         s.vehicles = deque()
 
+        #リンク内車両の速度和と自由流速度未満の台数．車両の流入出・移動時に逐次更新し，速度和は経路更新の間隔ごとに厳密に再計算
+        s._vehicles_speed_sum = 0
+        s._vehicles_slow_count = 0
+
         #旅行時間
-        s.traveltime_instant = []
+        s._traveltime_instant = np.zeros(0)
 
         #経路選択補正
         s.route_choice_penalty = 0
 
-        #累積図関係
-        s.cum_arrival = []
-        s.cum_departure = []
-        s.traveltime_actual = []
+        #累積図関係．init_after_tmax_fixで確保し，記録済みの長さ分だけ公開する
+        s._cum_arrival = np.zeros(0)
+        s._cum_departure = np.zeros(0)
+        s._tsize_recorded = 0
+        s._traveltime_actual = []
+        s._traveltime_actual_records = [] #(流入タイムステップ, 実旅行時間)．参照時にまとめて反映
+        s._traveltime_actual_records_applied = 0
 
         #信号関係
         s.signal_group = signal_group
@@ -503,12 +534,13 @@ class Link:
 
         s.id = len(s.W.LINKS)
         s.name = name
-        if s.name in [l.name for l in s.W.LINKS]:
+        if s.name in s.W.LINKS_NAME_DICT:
             if auto_rename:
                 s.name = s.name+"_renamed"+"".join(random.choices(string.ascii_letters + string.digits, k=8))
             else:
                 raise ValueError(f"Link name {s.name} already used by another link. Please specify a unique name.")
         s.W.LINKS.append(s)
+        s.W.LINKS_NAME_DICT[s.name] = s
         s.start_node.outlinks[s.name] = s
         s.end_node.inlinks[s.name] = s
 
@@ -521,9 +553,10 @@ class Link:
         s._num_vehicles = -1 #車両数
         s._num_vehicles_queue = -1 #自由流速度未満の車両数
 
-        #より正確な車両軌跡
-        s.tss = []
-        s.xss = []
+        #より正確な車両軌跡．Analyzer.compute_accurate_traj()で作る．各軌跡の時刻と位置はtraj_offsetsで区切った一次元配列
+        s.traj_t = np.zeros(0)
+        s.traj_x = np.zeros(0)
+        s.traj_offsets = np.zeros(1, dtype=int)
         s.cs = []
         s.ls = []
         s.names = []
@@ -532,6 +565,8 @@ class Link:
             s.eular_dx = s.length/10
             if s.eular_dx < s.u*s.W.DELTAT:
                 s.eular_dx = s.u*s.W.DELTAT
+        else:
+            s.eular_dx = eular_dx
 
     def __repr__(s):
         return f"<Link {s.name}>"
@@ -551,8 +586,14 @@ class Link:
         s.dn_mat = np.zeros(s.k_mat.shape)
         s.an = s.edie_dt*s.edie_dx
 
-        #累積
-        s.traveltime_actual = np.array([s.length/s.u for t in range(s.W.TSIZE)])
+        #累積．台数の型はDELTANに合わせる
+        s._cum_arrival = np.zeros(s.W.TSIZE, dtype=np.array(s.W.DELTAN).dtype)
+        s._cum_departure = np.zeros(s.W.TSIZE, dtype=np.array(s.W.DELTAN).dtype)
+        s._traveltime_instant = np.zeros(s.W.TSIZE)
+        s._tsize_recorded = 0
+        s._traveltime_actual = np.array([s.length/s.u for t in range(s.W.TSIZE)])
+        s._traveltime_actual_records = []
+        s._traveltime_actual_records_applied = 0
 
     def update(s):
         """
@@ -560,12 +601,17 @@ class Link:
         """
         s.in_out_flow_constraint()
 
+        s._tsize_recorded = s.W.T+1
         s.set_traveltime_instant()
-        s.cum_arrival.append(0)
-        s.cum_departure.append(0)
-        if len(s.cum_arrival) > 1:
-            s.cum_arrival[-1] = s.cum_arrival[-2]
-            s.cum_departure[-1] = s.cum_departure[-2]
+        if s.W.T > 0:
+            s._cum_arrival[s.W.T] = s._cum_arrival[s.W.T-1]
+            s._cum_departure[s.W.T] = s._cum_departure[s.W.T-1]
+
+        if s.W.T % s.W.DELTAT_ROUTE == 0:
+            #経路探索の前に速度の合計を厳密に計算し直し，空にならないリンクでの丸め誤差の蓄積を防ぐ
+            s._vehicles_speed_sum = sum(veh.v for veh in s.vehicles)
+        if s.W.verify_link_state:
+            s.verify_vehicle_aggregates()
 
         #リアルタイム状態リセット
         s._speed = -1
@@ -588,14 +634,169 @@ class Link:
             s.capacity_out_remain = 10e10
             s.capacity_in_remain = 10e10
 
+    def add_edie_state(s, x0, x1, duration):
+        """
+        Add a movement of a platoon to the Edie's traffic state cells (`tn_mat` and `dn_mat`) of the current time. Used if `World.edie_state_online` is enabled.
+
+        Parameters
+        ----------
+        x0 : float
+            The position at the start of the movement.
+        x1 : float
+            The position at the end of the movement.
+        duration : float
+            The duration of the movement in seconds.
+
+        Notes
+        -----
+        As in `Analyzer.compute_edie_state()`, the distance and time are divided among the space cells the movement passes through, and the whole movement is assigned to the time cell in which it starts.
+        """
+        tt = int(s.W.T*s.W.DELTAT//s.edie_dt)
+        nx = s.tn_mat.shape[1]
+        dx = s.edie_dx
+        xx = int(x0//dx)
+        if xx >= nx:
+            return
+        if x1 <= x0 or xx == int(x1//dx):
+            s.tn_mat[tt, xx] += duration*s.W.DELTAN
+            if x1 > x0:
+                s.dn_mat[tt, xx] += (x1-x0)*s.W.DELTAN
+        else:
+            #セル境界ごとに分割
+            v = (x1-x0)/duration
+            x = x0
+            while x < x1 and xx < nx:
+                x_next = min((xx+1)*dx, x1)
+                s.tn_mat[tt, xx] += (x_next-x)/v*s.W.DELTAN
+                s.dn_mat[tt, xx] += (x_next-x)*s.W.DELTAN
+                x = x_next
+                xx += 1
+
+    def add_vehicle_aggregates(s, veh):
+        """
+        Add a vehicle that has just entered this link to the running speed aggregates.
+
+        Parameters
+        ----------
+        veh : Vehicle
+            The vehicle.
+        """
+        s._vehicles_speed_sum += veh.v
+        s._vehicles_slow_count += int(veh.v < s.u)
+
+    def remove_vehicle_aggregates(s, veh):
+        """
+        Remove a vehicle that has just left this link from the running speed aggregates.
+
+        Parameters
+        ----------
+        veh : Vehicle
+            The vehicle.
+        """
+        if len(s.vehicles) == 0:
+            #丸め誤差の蓄積を防ぐため，空になったらリセット
+            s._vehicles_speed_sum = 0
+            s._vehicles_slow_count = 0
+        else:
+            s._vehicles_speed_sum -= veh.v
+            s._vehicles_slow_count -= int(veh.v < s.u)
+
+    def verify_vehicle_aggregates(s):
+        """
+        Cross-check the running speed aggregates against brute-force recomputation over the vehicles in this link. Used when `World.verify_link_state` is set.
+        """
+        speeds = [veh.v for veh in s.vehicles]
+        slow_count = sum([v < s.u for v in speeds])
+        if s._vehicles_slow_count != slow_count:
+            raise Exception(f"inconsistent number of slow vehicles at {s} on t={s.W.TIME}: {s._vehicles_slow_count} (running) != {slow_count} (brute-force)")
+        if not math.isclose(s._vehicles_speed_sum, sum(speeds), rel_tol=1e-9, abs_tol=1e-6):
+            raise Exception(f"inconsistent speed sum at {s} on t={s.W.TIME}: {s._vehicles_speed_sum} (running) != {sum(speeds)} (brute-force)")
+
     def set_traveltime_instant(s):
         """
         Compute instantanious travel time.
         """
         if s.speed > 0:
-            s.traveltime_instant.append(s.length/s.speed)
+            s._traveltime_instant[s.W.T] = s.length/s.speed
         else:
-            s.traveltime_instant.append(s.length/(s.u/100))
+            s._traveltime_instant[s.W.T] = s.length/(s.u/100)
+
+    def record_traveltime_actual(s, arrival_time, traveltime):
+        """
+        Record the actual travel time of a vehicle that entered this link on `arrival_time`.
+
+        Parameters
+        ----------
+        arrival_time : float
+            The time when the vehicle entered this link in seconds.
+        traveltime : float
+            The actual travel time of the vehicle in seconds.
+
+        Notes
+        -----
+        The travel time is also tentatively used as the actual travel time of vehicles that entered this link later, until they leave the link and overwrite it.
+        Only the breakpoint is recorded here. The time series `traveltime_actual` is materialized when it is referred.
+        """
+        s._traveltime_actual_records.append((int(arrival_time/s.W.DELTAT), traveltime))
+
+    @property
+    def traveltime_actual(s):
+        """
+        Actual travel time of vehicles who enter this link on each timestep.
+        """
+        if s._traveltime_actual_records_applied < len(s._traveltime_actual_records):
+            #各タイムステップについて，それ以前に流入した車両の記録のうち最後に記録されたものを採用
+            records = s._traveltime_actual_records[s._traveltime_actual_records_applied:]
+            ts = np.array([r[0] for r in records])
+            tts = np.array([r[1] for r in records], dtype=float)
+            order = np.arange(len(records))
+            valid = ts < len(s._traveltime_actual)
+            latest = np.full(len(s._traveltime_actual), -1)
+            np.maximum.at(latest, ts[valid], order[valid])
+            latest = np.maximum.accumulate(latest)
+            s._traveltime_actual = np.where(latest >= 0, tts[latest], s._traveltime_actual)
+            s._traveltime_actual_records_applied = len(s._traveltime_actual_records)
+        return s._traveltime_actual
+
+    @traveltime_actual.setter
+    def traveltime_actual(s, new_value):
+        s._traveltime_actual = new_value
+        s._traveltime_actual_records_applied = len(s._traveltime_actual_records)
+
+    @property
+    def tss(s):
+        """
+        Times of the trajectories of vehicles in this link computed by `Analyzer.compute_accurate_traj()`. A list-like view whose i-th element is an array view of `traj_t`.
+        """
+        return RaggedView(s.traj_t, s.traj_offsets)
+
+    @property
+    def xss(s):
+        """
+        Positions of the trajectories of vehicles in this link computed by `Analyzer.compute_accurate_traj()`. A list-like view whose i-th element is an array view of `traj_x`.
+        """
+        return RaggedView(s.traj_x, s.traj_offsets)
+
+    @property
+    def cum_arrival(s):
+        """
+        Cumulative vehicle count of arrival to this link on each timestep recorded so far. A view of the preallocated array.
+        """
+        return s._cum_arrival[:s._tsize_recorded]
+
+    @property
+    def cum_departure(s):
+        """
+        Cumulative vehicle count of departure from this link on each timestep recorded so far. A view of the preallocated array.
+        """
+        return s._cum_departure[:s._tsize_recorded]
+
+    @property
+    def traveltime_instant(s):
+        """
+        Instantanious travel time of this link on each timestep recorded so far. A view of the preallocated array.
+        """
+        return s._traveltime_instant[:s._tsize_recorded]
 
     def arrival_count(s, t):
         """
@@ -686,7 +887,7 @@ class Link:
     def speed(s):
         if s._speed == -1:
             if len(s.vehicles):
-                s._speed = np.average([veh.v for veh in s.vehicles])
+                s._speed = s._vehicles_speed_sum/len(s.vehicles)
             else:
                 s._speed = s.u
         return s._speed
@@ -712,7 +913,7 @@ class Link:
     @property
     def num_vehicles_queue(s):
         if s._num_vehicles_queue == -1:
-            s._num_vehicles_queue = sum([veh.v < s.u for veh in s.vehicles])*s.W.DELTAN
+            s._num_vehicles_queue = s._vehicles_slow_count*s.W.DELTAN
         return s._num_vehicles_queue
 
     @property
@@ -726,6 +927,7 @@ class Link:
             s.w = 1/s.tau/s.kappa
             s.capacity = s.u*s.w*s.kappa/(s.u+s.w)
             s.delta = 1/s.kappa
+            s._vehicles_slow_count = sum([int(veh.v < s.u) for veh in s.vehicles])
         else:
             warnings.warn(f"ignored negative free_flow_speed at {s}", UserWarning)
 
@@ -748,7 +950,7 @@ class Vehicle:
     """
     Vehicle or platoon in a network.
     """
-    def __init__(s, W, orig, dest, departure_time, name=None, route_pref=None, route_choice_principle=None, mode="single_trip", links_prefer=[], links_avoid=[], trip_abort=1, departure_time_is_time_step=0, attribute=None, auto_rename=False):
+    def __init__(s, W, orig, dest, departure_time, name=None, route_pref=None, route_choice_principle=None, mode="single_trip", links_prefer=[], links_avoid=[], trip_abort=1, departure_time_is_time_step=0, attribute=None, auto_rename=False, color=None, vehicle_id=None):
         """
         Create a vehicle (more precisely, platoon)
 
@@ -782,6 +984,10 @@ class Vehicle:
             Additional (meta) attributes defined by users.
         auto_rename : bool, optional
             Whether to automatically rename the vehicle if the name is already used. Default is False.
+        color : tuple, optional
+            The RGB color of the vehicle for visualization, default is random.
+        vehicle_id : int, optional
+            The id of the vehicle, default is the next id. Only for the vehicles whose ids have been reserved by the lazy vehicle creation (see `World.adddemand_bulk()`).
         """
 
         s.W = W
@@ -835,9 +1041,7 @@ class Vehicle:
         s.node_event = {}
 
         #希望リンク重み：{link:重み}
-        s.route_pref = route_pref
-        if s.route_pref == None:
-            s.route_pref = {l:0 for l in s.W.LINKS}
+        s.route_pref = route_pref #Noneの場合は全リンク0扱い．homogeneous_DUOではRouteChoice.route_prefの目的地別の行を参照する
 
         #好むリンクと避けるリンク（近視眼的）
         s.links_prefer = [s.W.get_link(l) for l in links_prefer]
@@ -847,26 +1051,25 @@ class Vehicle:
         s.trip_abort = trip_abort
         s.flag_trip_aborted = 0
 
-        #ログなど
-        s.log_t = [] #時刻
-        s.log_state = [] #状態
-        s.log_link = [] #リンク
-        s.log_x = [] #位置
-        s.log_s = [] #車頭距離
-        s.log_v = [] #現在速度
-        s.log_lane = [] #車線
-        s.color = (random.random(), random.random(), random.random())
+        #ログなど．時刻，状態，リンク，位置，車頭距離，現在速度，車線はW.VEHICLE_LOGSに記録し，log_t等はそのビュー
+        if color is None:
+            s.color = (random.random(), random.random(), random.random())
+        else:
+            s.color = color
 
         s.log_t_link = [[int(s.departure_time*s.W.DELTAT), "home"]] #新たなリンクに入った時にその時刻とリンクのみを保存．経路分析用
 
         s.attribute = attribute
 
-        s.id = len(s.W.VEHICLES)
+        if vehicle_id == None:
+            s.id = len(s.W.VEHICLES)
+        else:
+            s.id = vehicle_id
         if name != None:
             s.name = name
         else:
             s.name = str(s.id)
-        if s.name in [veh.name for veh in s.W.VEHICLES.values()]:
+        if vehicle_id == None and s.name in s.W.VEHICLES:
             if auto_rename:
                 s.name = s.name+"_renamed"+"".join(random.choices(string.ascii_letters + string.digits, k=8))
             else:
@@ -874,6 +1077,14 @@ class Vehicle:
         s.W.VEHICLES[s.name] = s
         s.W.VEHICLES_LIVING[s.name] = s
 
+        #"home"状態のログは出発時にまとめて記録する
+        s.log_home_start = s.W.T if s.W.finalized else 0
+        s.W.DEPARTURE_SCHEDULER.add(s)
+
+        #シミュレーション中に追加された車両には現在の経路選択をすぐに反映する
+        if s.W.finalized and s.route_choice_principle == "homogeneous_DUO" and s.route_pref is None and s.dest != None:
+            s.route_pref_update(weight=1)
+
 
     def __repr__(s):
         return f"<Vehicle {s.name}: {s.state}, x={s.x}, link={s.link}>"
@@ -903,9 +1114,14 @@ class Vehicle:
             pass
         if s.state == "run":
             #drive within the link
-            s.v = (s.x_next-s.x)/s.W.DELTAT
+            v = (s.x_next-s.x)/s.W.DELTAT
+            s.link._vehicles_speed_sum += v - s.v
+            s.link._vehicles_slow_count += int(v < s.link.u) - int(s.v < s.link.u)
+            s.v = v
             s.x_old = s.x
             s.x = s.x_next
+            if s.W.edie_state_online:
+                s.link.add_edie_state(s.x_old, s.x, s.W.DELTAT)
 
             #at the end of the link
             if s.x == s.link.length:
@@ -952,19 +1168,21 @@ class Vehicle:
         """
         s.state = "end"
 
-        s.link.cum_departure[-1] += s.W.DELTAN
-        s.link.traveltime_actual[int(s.link_arrival_time/s.W.DELTAT):] = (s.W.T+1)*s.W.DELTAT - s.link_arrival_time  #端部の挙動改善 todo: 精査
+        s.link._cum_departure[s.W.T] += s.W.DELTAN
+        s.link.record_traveltime_actual(s.link_arrival_time, (s.W.T+1)*s.W.DELTAT - s.link_arrival_time)  #端部の挙動改善 todo: 精査
 
         if s.follower != None:
             s.follower.leader = None
 
         s.link.vehicles.popleft()
+        s.link.remove_vehicle_aggregates(s)
         s.link = None
         s.x = 0
         s.arrival_time = s.W.T  #TODO: arrival_timeもタイムステップ表記．要修正
         s.travel_time = (s.arrival_time - s.departure_time)*s.W.DELTAT
         s.W.VEHICLES_RUNNING.pop(s.name)
         s.W.VEHICLES_LIVING.pop(s.name)
+        s.W.VEHICLES_ACTIVE.pop(s.name)
 
         if s.flag_trip_aborted:
             s.state = "abort"
@@ -1010,16 +1228,21 @@ class Vehicle:
         """
         if s.route_choice_principle == "homogeneous_DUO":
             if s.dest != None:
+                s.W.ROUTECHOICE.search_destination(s.dest.id)
                 s.route_pref = s.W.ROUTECHOICE.route_pref[s.dest.id]
             else:
-                s.route_pref = {l:0 for l in s.W.LINKS}
+                s.route_pref = None
         elif s.route_choice_principle == "heterogeneous_DUO":
+            if s.route_pref == None:
+                s.route_pref = {l:0 for l in s.W.LINKS}
             route_pref_new = {l:0 for l in s.W.LINKS}
             k = s.dest.id
+            s.W.ROUTECHOICE.search_destination(k)
+            col = s.W.ROUTECHOICE.dest_index[k]
             for l in s.W.LINKS:
                 i = l.start_node.id
                 j = l.end_node.id
-                if j == s.W.ROUTECHOICE.next[i,k]:
+                if col >= 0 and j == s.W.ROUTECHOICE.next[i,col]:
                     route_pref_new[l] = 1
 
             if sum(list(s.route_pref.values())) == 0:
@@ -1028,6 +1251,24 @@ class Vehicle:
             for l in s.route_pref.keys():
                 s.route_pref[l] = (1-weight)*s.route_pref[l] + weight*route_pref_new[l]
 
+    def route_pref_of_links(s, links):
+        """
+        Get the vehicle's preferences for the given links.
+
+        Parameters
+        ----------
+        links : list of Link
+            The links.
+
+        Returns
+        -------
+        list of float
+            The preference for each link. All zeros if the vehicle has no preference yet.
+        """
+        if s.route_pref is None:
+            return [0 for l in links]
+        return [s.route_pref[l] for l in links]
+
     def route_next_link_choice(s):
         """
         Select a next link from the current link.
@@ -1038,12 +1279,12 @@ class Vehicle:
             if len(outlinks):
 
                 #if links_prefer is given and available at the node, select only from the links in the list. if links_avoid is given, select links not in the list.
-                if set(outlinks) & set(s.links_prefer):
+                if s.links_prefer and set(outlinks) & set(s.links_prefer):
                     outlinks = list(set(outlinks) & set(s.links_prefer))
-                if set(outlinks) & set(s.links_avoid):
+                if s.links_avoid and set(outlinks) & set(s.links_avoid):
                     outlinks = list(set(outlinks) - set(s.links_avoid))
 
-                preference = [s.route_pref[l] for l in outlinks]
+                preference = s.route_pref_of_links(outlinks)
 
                 if sum(preference) > 0:
                     s.route_next_link = random.choices(outlinks, preference)[0]
@@ -1135,8 +1376,8 @@ class Vehicle:
             Time in seconds. If it is -1, the latest position is returned.
         """
         if t != -1:
-            link = s.log_link[int(t/s.W.DELTAT/s.W.logging_timestep_interval)]
-            xx = s.log_x[int(t/s.W.DELTAT/s.W.logging_timestep_interval)]
+            link = s.log_link[int(t/s.W.DELTAT/s.W.vehicle_logging_timestep_interval)]
+            xx = s.log_x[int(t/s.W.DELTAT/s.W.vehicle_logging_timestep_interval)]
         else:
             link = s.link
             xx = s.x
@@ -1163,234 +1404,1449 @@ class Vehicle:
                     if s.state == "end" and s.log_t_link[-1][1] != "end":
                         s.log_t_link.append([s.W.T*s.W.DELTAT, "end"])
 
-                    s.log_t.append(s.W.T*s.W.DELTAT)
-                    s.log_state.append(s.state)
-                    s.log_link.append(-1)
-                    s.log_x.append(-1)
-                    s.log_s.append(-1)
-                    s.log_v.append(-1)
-                    s.log_lane.append(-1)
+                    s.W.VEHICLE_LOGS.append((s.id, s.W.T, VEHICLE_STATE_CODES[s.state], -1, -1, -1, -1, -1))
 
                     if s.state == "wait":
                         s.W.analyzer.average_speed_count += 1
                         s.W.analyzer.average_speed += 0
                 else:
-                    if len(s.log_link) == 0 or s.log_link[-1] != s.link:
+                    #前回のログから別のリンクに入っていれば記録
+                    if s.log_t_link[-1][1] != s.link:
                         s.log_t_link.append([s.W.T*s.W.DELTAT, s.link])
 
-                    s.log_t.append(s.W.T*s.W.DELTAT)
-                    s.log_state.append(s.state)
-                    s.log_link.append(s.link)
-                    s.log_x.append(s.x)
-                    s.log_v.append(s.v)
-                    s.log_lane.append(s.lane)
                     if s.leader != None and s.link == s.leader.link:
-                        s.log_s.append(s.leader.x-s.x)
+                        spacing = s.leader.x-s.x
                     else:
-                        s.log_s.append(-1)
+                        spacing = -1
+                    s.W.VEHICLE_LOGS.append((s.id, s.W.T, VEHICLE_STATE_CODES["run"], s.link.id, s.x, spacing, s.v, s.lane))
 
                     s.W.analyzer.average_speed_count += 1
                     s.W.analyzer.average_speed += (s.v - s.W.analyzer.average_speed)/s.W.analyzer.average_speed_count
 
-
-class RouteChoice:
-    """
-    Class for computing shortest path for all vehicles.
-    """
-
-    def __init__(s, W):
+    def record_log_home(s, t_end):
         """
-        Create route choice computation object.
+        Record travel logs of the "home" state from `log_home_start` until just before timestep `t_end` at once.
 
         Parameters
         ----------
-        W : object
-            The world to which this belongs.
+        t_end : int
+            The timestep until which (exclusive) the logs are recorded.
+
+        Notes
+        -----
+        Vehicles that have not departed yet are not updated every timestep by the departure scheduler. Their logs, which are trivial, are recorded by this method when they depart or when the simulation is paused.
         """
-        s.W = W
-        #リンク旅行時間行列
-        s.adj_mat_time = np.zeros([len(s.W.NODES), len(s.W.NODES)])
-        #ij間最短距離
-        s.dist = np.zeros([len(s.W.NODES), len(s.W.NODES)])
-        #iからjに行くために次に進むべきノード
-        s.next = np.zeros([len(s.W.NODES), len(s.W.NODES)])
-        #iからjに行くために来たノード
-        s.pred = np.zeros([len(s.W.NODES), len(s.W.NODES)])
+        if s.W.vehicle_logging_timestep_interval != -1:
+            interval = s.W.vehicle_logging_timestep_interval
+            ts = range(-(-s.log_home_start//interval)*interval, t_end, interval)
+            n = len(ts)
+            if n > 0 and s.W.VEHICLE_LOGS.tolerance != None:
+                #圧縮時は最初と最後の行のみで十分
+                for t in sorted({ts[0], ts[-1]}):
+                    s.W.VEHICLE_LOGS.append((s.id, t, VEHICLE_STATE_CODES["home"], -1, -1, -1, -1, -1))
+            elif n > 0:
+                s.W.VEHICLE_LOGS.extend(n, {"veh": s.id, "t": np.arange(ts.start, ts.stop, ts.step), "state": VEHICLE_STATE_CODES["home"], "link": -1, "x": -1, "s": -1, "v": -1, "lane": -1})
+        if t_end > s.log_home_start:
+            s.log_home_start = t_end
 
-        #homogeneous DUO用．kに行くための最短経路的上にあれば1
-        s.route_pref = {k.id: {l:0 for l in s.W.LINKS} for k in s.W.NODES}
+    @property
+    def log_t(s):
+        """
+        Logged times in seconds. A view of `World.VEHICLE_LOGS`, and so are the other logs.
+        """
+        return s.W.VEHICLE_LOGS.vehicle_column(s, "t")
 
-    def route_search_all(s, infty=np.inf, noise=0):
+    @property
+    def log_state(s):
         """
-        Compute the current shortest path based on instantanious travel time.
+        Logged states ("home", "wait", "run", "end", or "abort").
+        """
+        return s.W.VEHICLE_LOGS.vehicle_column(s, "state")
 
-        Parameters
-        ----------
-        infty : float
-            value representing infinity.
-        noise : float
-            very small noise to slightly randomize route choice. useful to eliminate strange results at an initial stage of simulation where many routes has identical travel time.
+    @property
+    def log_link(s):
         """
-        s.adj_mat_time = np.zeros([len(s.W.NODES), len(s.W.NODES)])
-        adj_mat_link_count = np.zeros([len(s.W.NODES), len(s.W.NODES)])
+        Logged links. -1 if not in a link.
+        """
+        return s.W.VEHICLE_LOGS.vehicle_column(s, "link")
 
-        for link in s.W.LINKS:
-            i = link.start_node.id
-            j = link.end_node.id
-            if s.W.ADJ_MAT[i,j]:
-                new_link_tt = link.traveltime_instant[-1]*random.uniform(1, 1+noise) + link.route_choice_penalty
-                n = adj_mat_link_count[i,j]
-                s.adj_mat_time[i,j] = s.adj_mat_time[i,j]*n/(n+1) + new_link_tt/(n+1) # if there are multiple links between the same nodes, average the travel time
-                # s.adj_mat_time[i,j] = new_link_tt #if there is only one link between the nodes, this line is fine, but for generality we use the above line
-                adj_mat_link_count[i,j] += 1
-                if link.capacity_in == 0: #if the inflow is profibited, travel time is assumed to be infinite
-                    s.adj_mat_time[i,j] = np.inf
-            else:
-                s.adj_mat_time[i,j] = np.inf
+    @property
+    def log_x(s):
+        """
+        Logged positions in the links. -1 if not in a link.
+        """
+        return s.W.VEHICLE_LOGS.vehicle_column(s, "x")
 
-        s.dist, s.pred = floyd_warshall(s.adj_mat_time, return_predecessors=True)
+    @property
+    def log_s(s):
+        """
+        Logged spacings to the leaders. -1 if there is no leader in the same link.
+        """
+        return s.W.VEHICLE_LOGS.vehicle_column(s, "s")
 
-        n_vertices = s.pred.shape[0]
-        s.next = -np.ones((n_vertices, n_vertices), dtype=int)
-        for i in range(n_vertices):
-            for j in range(n_vertices):
-                # iからjへの最短経路を逆にたどる．．． -> todo: 起終点を逆にした最短経路探索にすればよい
-                if i != j:
-                    prev = j
-                    while s.pred[i, prev] != i and s.pred[i, prev] != -9999:
-                        prev = s.pred[i, prev]
-                    s.next[i, j] = prev
+    @property
+    def log_v(s):
+        """
+        Logged speeds. -1 if not in a link.
+        """
+        return s.W.VEHICLE_LOGS.vehicle_column(s, "v")
 
-    def homogeneous_DUO_update(s):
+    @property
+    def log_lane(s):
         """
-        Update link preference of all homogeneous travelers based on DUO principle.
+        Logged lanes. -1 if not in a link.
         """
-        for dest in s.W.NODES:
-            k = dest.id
-            weight = s.W.DUO_UPDATE_WEIGHT
-            if sum(list(s.route_pref[k].values())) == 0:
-                #最初にpreferenceが空なら確定的に初期化
-                weight = 1
-            for l in s.W.LINKS:
-                i = l.start_node.id
-                j = l.end_node.id
-                if j == s.W.ROUTECHOICE.next[i,k]:
-                    s.route_pref[k][l] = (1-weight)*s.route_pref[k][l] + weight
-                else:
-                    s.route_pref[k][l] = (1-weight)*s.route_pref[k][l]
+        return s.W.VEHICLE_LOGS.vehicle_column(s, "lane")
 
 
-class World:
+class DepartureScheduler:
     """
-    World (i.e., simulation environment). A World object is consistently referred to as `W` in this code.
+    Class for scheduling the departure of vehicles.
     """
 
-    def __init__(W, name="", deltan=5, reaction_time=1, duo_update_time=600, duo_update_weight=0.5, duo_noise=0.01, eular_dt=120, eular_dx=100, random_seed=None, print_mode=1, save_mode=1, show_mode=0, route_choice_principle="homogeneous_DUO", show_progress=1, show_progress_deltat=600, tmax=None, vehicle_logging_timestep_interval=1):
+    #連結する未生成の車両の配列の最大長
+    PENDING_MERGE_SIZE = 1024
+
+    def __init__(s, W):
         """
-        Create a World.
+        Create departure scheduler.
 
         Parameters
         ----------
-        name : str, optional
-            The name of the world, default is an empty string.
-        deltan : int, optional
-            The platoon size, default is 5 vehicles.
-        reaction_time : float, optional
-            The reaction time, default is 1 second. This is also related to simulation time step width.
-        duo_update_time : float, optional
-            The time interval for route choice update, default is 600 seconds.
-        duo_update_weight : float, optional
-            The update weight for route choice, default is 0.5.
-        duo_noise : float, optional
-            The noise in route choice, default is 0.01.
-        eular_dt : float, optional
-            The time aggregation size for eularian traffic state computation, default is 120.
-        random_seed : int or None, optional
-            The random seed, default is None.
-        print_mode : int, optional
-            The print mode, whether print the simulation progress or not. Default is 1 (enabled).
-        save_mode : int, optional
-            The save mode,. whether save the simulation results or not.  Default is 1 (enabled).
-        show_mode : int, optional
-            The show mode, whether show the matplotlib visualization results or not. Default is 0 (disabled).
-        route_choice_principle : str, optional
-            The route choice principle, default is "homogeneous_DUO".
-        show_progress : int, optional
-            Whether show network progress, default is 1 (enabled).
-        show_progress_deltat : float, optional
-            The time interval for showing network progress, default is 600 seconds.
-        tmax : float or None, optional
-            The simulation duration, default is None (automatically determined).
-        vehicle_logging_timestep_interval : int, optional
-            The interval for logging vehicle data, default is 1. Logging is off if set to -1.
-            Setting large intervel (2 or more) or turn off the logging makes the simulation significantly faster in large-scale scenarios without loosing simulation internal accuracy, but outputed vehicle trajecotry and other related data will become inaccurate.
+        W : object
+            The world to which this belongs.
 
         Notes
         -----
-        A World object must be defined firstly to initiate simulation.
+        Vehicles that have not departed yet (i.e., in "home" state) are bucketed by their departure timestep, so that the main loop only touches the vehicles due at the current timestep instead of scanning all vehicles.
+        With the lazy vehicle creation, the vehicles are not created yet but stored as arrays (pending vehicles). They are created when they are due or accessed.
+        The batches of pending vehicles are kept in a heap keyed by their next departure timestep, so that each timestep only touches the batches due at it. Consecutive small batches (e.g., by many `adddemand` calls) are merged into one.
         """
+        s.W = W
+        #出発タイムステップ別の車両リスト
+        s.buckets = {}
+        #バケットのあるタイムステップのヒープ
+        s.timesteps = []
+        #未生成の車両．adddemand_bulk一回分（小さいものは連続する複数回分）ごとの配列．idの順
+        s.pending = []
+        #各pendingの最初の車両id．二分探索用
+        s.pending_start = []
+        #出発し終わったpendingの数．多くなったら取り除く
+        s.pending_exhausted = 0
+        #pendingのヒープ．(次の出発タイムステップ, 登録番号, pending)．登録番号がpending["entry"]と異なるものは無効
+        s.pending_heap = []
+        s.pending_entry_count = 0
+        s.pending_size = 0
+        #未生成の車両の目的地ノードid別の台数
+        s.pending_dest_count = {}
 
-        ## パラメータ設定
-        random.seed(random_seed)
-        np.random.seed(random_seed)
-        W.random_seed = random_seed
-
-        W.TMAX = tmax   #シミュレーション時間（s）
-
-        W.DELTAN = deltan         #車群サイズ（veh）
-        W.REACTION_TIME = reaction_time         #反応時間（s）
-
-        W.DUO_UPDATE_TIME = duo_update_time     #経路選択時間間隔（s）
-        W.DUO_UPDATE_WEIGHT = duo_update_weight    #経路選択の更新重み
-        W.DUO_NOISE = duo_noise    #経路選択時のノイズ（完全に対称なネットワークで極端な経路選択になるのを防ぐ）
-        W.EULAR_DT = eular_dt     #Eular型データのデフォルト時間離散化幅
-
-        W.DELTAT = W.REACTION_TIME*W.DELTAN
-        W.DELTAT_ROUTE = int(W.DUO_UPDATE_TIME/W.DELTAT)
-
-        ## データ格納先定義
-        W.VEHICLES = OrderedDict()            #home, wait, run, end
-        W.VEHICLES_LIVING = OrderedDict()     #home, wait, run
-        W.VEHICLES_RUNNING = OrderedDict()    #run
-        W.NODES = []
-        W.LINKS = []
-
-        W.vehicle_logging_timestep_interval = vehicle_logging_timestep_interval
-
-        W.route_choice_principle = route_choice_principle
+    def __len__(s):
+        return sum(len(b) for b in s.buckets.values()) + s.pending_size
 
-        ## リアルタイム経過表示
-        W.show_progress = show_progress
-        W.show_progress_deltat_timestep = int(show_progress_deltat/W.DELTAT)
+    def add(s, veh):
+        """
+        Add a vehicle to the schedule.
 
-        ## システム設定
-        W.name = name
+        Parameters
+        ----------
+        veh : Vehicle
+            The vehicle to be scheduled. It departs at the first timestep that is not earlier than `veh.departure_time`.
+        """
+        t = math.ceil(veh.departure_time)
+        if t not in s.buckets:
+            s.buckets[t] = []
+            heapq.heappush(s.timesteps, t)
+        s.buckets[t].append(veh)
 
-        W.finalized = 0
-        W.world_start_time = time.time()
+    def add_pending(s, vehicle_id, orig, dest, departure_time, color, attribute=None):
+        """
+        Add vehicles to the schedule without creating them.
 
-        W.print_mode = print_mode
-        if print_mode:
-            W.print = print
+        Parameters
+        ----------
+        vehicle_id : int
+            The id of the first vehicle. The ids of the vehicles are consecutive from it and must have been reserved by `LazyVehicleDict.reserve()`.
+        orig : numpy.ndarray
+            The ids of the origin nodes.
+        dest : numpy.ndarray
+            The ids of the destination nodes.
+        departure_time : numpy.ndarray
+            The departure timesteps.
+        color : numpy.ndarray
+            The colors of the vehicles with shape (number of vehicles, 3).
+        attribute : any, optional
+            The attribute shared by the vehicles.
+        """
+        orig = np.asarray(orig, dtype=np.int32)
+        dest = np.asarray(dest, dtype=np.int32)
+        departure_time = np.asarray(departure_time, dtype=np.int64)
+        color = np.asarray(color, dtype=float)
+        log_home_start = s.W.T if s.W.finalized else 0
+        #まだ一台も出発していない場合のみ．出発済みの時刻の車両があると，一度に出発する車両の生成順が変わりうる
+        mergeable = not s.W.finalized or departure_time.min() > s.W.T
+
+        p = s.pending[-1] if len(s.pending) else None
+        if p != None and p["mergeable"] and mergeable and p["id"]+len(p["created"]) == vehicle_id and p["attribute"] is attribute and p["log_home_start"] == log_home_start and p["cursor"] == 0 and len(p["created"])+len(dest) <= s.PENDING_MERGE_SIZE and not p["created"].any():
+            #直前の小さいpendingに連結する
+            p["orig"] = np.concatenate([p["orig"], orig])
+            p["dest"] = np.concatenate([p["dest"], dest])
+            p["departure_time"] = np.concatenate([p["departure_time"], departure_time])
+            p["color"] = np.concatenate([p["color"], color])
+            p["created"] = np.zeros(len(p["dest"]), dtype=bool)
         else:
-            def noprint(*args, **kwargs):
-                pass
-            W.print = noprint
-        W.save_mode = save_mode
-        W.show_mode = show_mode
+            p = {
+                "id": vehicle_id,
+                "orig": orig,
+                "dest": dest,
+                "departure_time": departure_time,
+                "color": color,
+                "attribute": attribute,
+                "log_home_start": log_home_start,
+                "mergeable": mergeable,
+                "cursor": 0,
+                "created": np.zeros(len(dest), dtype=bool),
+                "entry": -1,
+            }
+            s.pending.append(p)
+            s.pending_start.append(vehicle_id)
+        p["order"] = np.argsort(p["departure_time"], kind="stable")
+        p["departure_time_sorted"] = p["departure_time"][p["order"]]
+        next_departure = int(p["departure_time_sorted"][0]) #次に出発するタイムステップ
+        if p["entry"] < 0 or next_departure != p["next"]:
+            p["next"] = next_departure
+            s.push_pending(p)
+
+        s.pending_size += len(dest)
+        for d, n in zip(*np.unique(dest, return_counts=True)):
+            s.pending_dest_count[int(d)] = s.pending_dest_count.get(int(d), 0) + int(n)
+
+    def restore_pending(s, vehicle_id, orig, dest, departure_time, color, created, attribute, log_home_start, mergeable, cursor):
+        """
+        Add a batch of pending vehicles with its progress, as saved by `World.save_checkpoint()`. The arguments are the items of an element of `pending`.
+        """
+        p = {
+            "id": vehicle_id,
+            "orig": orig,
+            "dest": dest,
+            "departure_time": departure_time,
+            "color": color,
+            "attribute": attribute,
+            "log_home_start": log_home_start,
+            "mergeable": mergeable,
+            "cursor": cursor,
+            "created": created,
+            "entry": -1,
+        }
+        p["order"] = np.argsort(departure_time, kind="stable")
+        p["departure_time_sorted"] = departure_time[p["order"]]
+        s.pending.append(p)
+        s.pending_start.append(vehicle_id)
+        if cursor < len(dest):
+            p["next"] = int(p["departure_time_sorted"][cursor])
+            s.push_pending(p)
+        else:
+            s.pending_exhausted += 1
+        remain = dest[~created]
+        s.pending_size += len(remain)
+        for d, n in zip(*np.unique(remain, return_counts=True)):
+            s.pending_dest_count[int(d)] = s.pending_dest_count.get(int(d), 0) + int(n)
 
+    def push_pending(s, p):
+        """
+        Register a pending batch to the heap with its current `p["next"]`, invalidating its previous registration.
+        """
+        s.pending_entry_count += 1
+        p["entry"] = s.pending_entry_count
+        heapq.heappush(s.pending_heap, (p["next"], p["entry"], p))
 
-    def addNode(W, *args, **kwargs):
+    def create_pending(s, p, i, t):
         """
-        add a node to world
+        Create a pending vehicle.
 
         Parameters
         ----------
-        name : str
-            The name of the node.
-        x : float
-            The x-coordinate of the node (for visualization purposes).
-        y : float
+        p : dict
+            The element of `pending` to which the vehicle belongs.
+        i : int
+            The index of the vehicle in `p`.
+        t : int
+            The current timestep. The route choice updates before this timestep are reflected to the vehicle.
+
+        Returns
+        -------
+        Vehicle
+            The created vehicle, which is added to the schedule as usual.
+        """
+        W = s.W
+        departure_time = int(p["departure_time"][i])
+        veh = Vehicle(W, W.NODES[p["orig"][i]], W.NODES[p["dest"][i]], departure_time, departure_time_is_time_step=1, attribute=p["attribute"], color=tuple(p["color"][i].tolist()), vehicle_id=p["id"]+i)
+        veh.log_home_start = p["log_home_start"]
+        #未出発の車両は経路選択の更新を受けているはずなので，それを反映
+        if W.finalized and t > 0 and (t-1)//W.DELTAT_ROUTE*W.DELTAT_ROUTE >= p["log_home_start"]:
+            veh.route_pref_update(weight=W.DUO_UPDATE_WEIGHT)
+        p["created"][i] = True
+        s.pending_size -= 1
+        d = int(p["dest"][i])
+        s.pending_dest_count[d] -= 1
+        if s.pending_dest_count[d] == 0:
+            del s.pending_dest_count[d]
+        return veh
+
+    def create_pending_by_id(s, vehicle_id):
+        """
+        Create the pending vehicle with the given id.
+        """
+        k = bisect.bisect_right(s.pending_start, vehicle_id)-1
+        if k >= 0:
+            p = s.pending[k]
+            i = vehicle_id-p["id"]
+            if i < len(p["created"]) and not p["created"][i]:
+                return s.create_pending(p, i, s.W.T if s.W.finalized else 0)
+        raise KeyError(vehicle_id)
+
+    def create_all_pending(s, t):
+        """
+        Create all pending vehicles. `t` is the current timestep (see `create_pending()`).
+        """
+        for p in s.pending:
+            for i in np.nonzero(~p["created"])[0].tolist():
+                s.create_pending(p, i, t)
+        s.pending = []
+        s.pending_start = []
+        s.pending_exhausted = 0
+        s.pending_heap = []
+
+    def pending_destinations(s):
+        """
+        Returns the ids of the destination nodes of the pending vehicles.
+        """
+        return set(s.pending_dest_count.keys())
+
+    def departure_time_max(s):
+        """
+        Returns the latest departure timestep of the scheduled vehicles, or 0 if there is none.
+        """
+        tmax = 0
+        for veh in s.vehicles():
+            if veh.departure_time > tmax:
+                tmax = veh.departure_time
+        for p in s.pending:
+            if len(p["departure_time_sorted"]) and p["departure_time_sorted"][-1] > tmax:
+                tmax = int(p["departure_time_sorted"][-1])
+        return tmax
+
+    def pop_due(s, t):
+        """
+        Remove the vehicles whose departure time has come from the schedule.
+
+        Parameters
+        ----------
+        t : int
+            The current timestep.
+
+        Returns
+        -------
+        list
+            The vehicles due at or before timestep `t` in the order of their creation (i.e., their ids).
+        """
+        #未生成の車両で出発時刻が来たものをここで生成する．バケットに入るので以下でまとめて取り出す
+        created = 0
+        due = []
+        while len(s.pending_heap) and s.pending_heap[0][0] <= t:
+            next_departure, entry, p = heapq.heappop(s.pending_heap)
+            if entry == p["entry"]:
+                due.append(p)
+        if len(due) > 1:
+            due.sort(key=lambda p: p["id"])
+        for p in due:
+            end = int(np.searchsorted(p["departure_time_sorted"], t, side="right"))
+            for i in p["order"][p["cursor"]:end].tolist():
+                if not p["created"][i]:
+                    s.create_pending(p, i, t)
+                    created += 1
+            p["cursor"] = end
+            if end < len(p["order"]):
+                p["next"] = int(p["departure_time_sorted"][end])
+                s.push_pending(p)
+            else:
+                s.pending_exhausted += 1
+        if s.pending_exhausted > len(s.pending)//2:
+            s.pending = [p for p in s.pending if p["cursor"] < len(p["order"])]
+            s.pending_start = [p["id"] for p in s.pending]
+            s.pending_exhausted = 0
+
+        vehs = []
+        n_buckets = 0
+        while len(s.timesteps) and s.timesteps[0] <= t:
+            vehs.extend(s.buckets.pop(heapq.heappop(s.timesteps)))
+            n_buckets += 1
+        if n_buckets > 1 or created:
+            vehs.sort(key=lambda veh: veh.id)
+        return vehs
+
+    def vehicles(s):
+        """
+        Returns all scheduled vehicles that have been created.
+        """
+        return [veh for b in s.buckets.values() for veh in b]
+
+
+class LazyVehicleDict(Mapping):
+    """
+    Dict of vehicles {name: Vehicle} in the order of their ids, used as `World.VEHICLES` with the lazy vehicle creation.
+    It also contains the pending vehicles (see `DepartureScheduler`), which are named by their ids and created when they are accessed.
+    """
+
+    def __init__(s, W):
+        s.W = W
+        #idを添字とする車両のリスト．未生成の車両はNone
+        s.slots = []
+        #名前からidへ
+        s.index = {}
+
+    def __len__(s):
+        return len(s.slots)
+
+    def _id(s, name):
+        if name in s.index:
+            return s.index[name]
+        if type(name) is str and name.isdigit():
+            i = int(name)
+            if i < len(s.slots) and s.slots[i] is None and str(i) == name:
+                return i
+        return None
+
+    def __contains__(s, name):
+        return s._id(name) != None
+
+    def __getitem__(s, name):
+        i = s._id(name)
+        if i == None:
+            raise KeyError(name)
+        if s.slots[i] is None:
+            s.W.DEPARTURE_SCHEDULER.create_pending_by_id(i)
+        return s.slots[i]
+
+    def __setitem__(s, name, veh):
+        if veh.id == len(s.slots):
+            s.slots.append(veh)
+        else:
+            s.slots[veh.id] = veh
+        s.index[name] = veh.id
+
+    def __iter__(s):
+        for i in range(len(s.slots)):
+            if s.slots[i] is None:
+                s.W.DEPARTURE_SCHEDULER.create_pending_by_id(i)
+            yield s.slots[i].name
+
+    def reserve(s, n):
+        """
+        Reserve the ids and names of `n` pending vehicles.
+
+        Returns
+        -------
+        int
+            The first id.
+        """
+        start = len(s.slots)
+        if n < len(s.index):
+            names = [str(i) for i in range(start, start+n) if str(i) in s.index]
+        else:
+            names = [name for name in s.index if name.isdigit() and start <= int(name) < start+n and str(int(name)) == name]
+        if len(names):
+            raise ValueError(f"Vehicle name {names[0]} already used by another vehicle. Please specify a unique name.")
+        s.slots.extend([None]*n)
+        return start
+
+    def created(s):
+        """
+        Returns the list of the vehicles that have been created, in the order of their ids.
+        """
+        return [veh for veh in s.slots if veh is not None]
+
+
+#車両の状態の番号．ログとチェックポイントで使う
+VEHICLE_STATES = ["home", "wait", "run", "end", "abort"]
+VEHICLE_STATE_CODES = {state:i for i,state in enumerate(VEHICLE_STATES)}
+
+class VehicleLogStore:
+    """
+    Columnar store of the travel logs of all vehicles.
+    """
+
+    #列と型．vehは車両id，tはタイムステップ，stateはVEHICLE_STATESの番号，linkはリンクid（リンク外は-1）
+    COLUMNS = {"veh": np.int32, "t": np.int32, "state": np.uint8, "link": np.int32, "x": np.float32, "s": np.float32, "v": np.float32, "lane": np.int8}
+    STATES = VEHICLE_STATES
+    STATE_CODES = VEHICLE_STATE_CODES
+
+    def __init__(s, W, chunk_size=65536, sink=None, tolerance=None):
+        """
+        Create vehicle log store.
+
+        Parameters
+        ----------
+        W : object
+            The world to which this belongs.
+        chunk_size : int, optional
+            The number of rows by which the arrays grow, default is 65536.
+        sink : str, optional
+            The directory under which the rows are moved by `spill()`. Default is None (all rows are kept in memory).
+        tolerance : float, optional
+            The tolerance of the trajectory compression. Default is None (no compression).
+
+        Notes
+        -----
+        Each log record is a row of typed NumPy columns: vehicle id, timestep, state code, link id, position, spacing, speed, and lane.
+        Rows are first appended to a small buffer and written to the arrays in bulk when the buffer is full or the logs are read. The arrays grow in chunks.
+        If `sink` is given, `spill()` moves the rows in memory to a shard on the disk (one .npy file per column), so that the memory usage is bounded. The shards are read lazily as memory-mapped arrays, and are treated as if they were in memory. The shards are written to a new subdirectory of `sink` (`sink_dir`) unique to this store, so that stores sharing a sink (e.g., several Worlds) do not overwrite each other's shards. Files are never removed by the store.
+        If `tolerance` is given, the rows are compressed by `append()`: only the breakpoints of the trajectory of each vehicle are stored, and the other rows are restored by linear interpolation between the breakpoints when they are read. See `append()` for details. The latest row of each vehicle may be pending (not stored yet). The reads by row numbers (`column()`, `take()`, etc.) return the stored rows only, whereas `vehicle_column()` and `expand_all()` also return the pending rows without storing them. `flush()` stores them as breakpoints.
+        `Vehicle.log_t`, `log_state`, etc. are lazy views of the rows of each vehicle.
+        """
+        s.W = W
+        s.chunk_size = chunk_size
+        s.size = 0
+        s.columns = {key: np.zeros(0, dtype=dtype) for key,dtype in s.COLUMNS.items()}
+        s.buffer = []
+        #ディスクに書き出したシャード．[(行数, {列名: ファイル名})]
+        s.sink = sink
+        #このストア専用のsink内のディレクトリ．最初のspill時に作る
+        s.sink_dir = None
+        s.shards = []
+        s.shards_mapped = {}
+        s.size_spilled = 0
+        #車両別の行番号の索引．index_size行時点のもの
+        s.index_size = -1
+        s.index_order = None
+        s.index_offsets = None
+        #索引以降に追加された行の車両別の行番号．{車両id: [行番号の配列]}．index_tail_size行時点のもの
+        s.index_tail = {}
+        s.index_tail_size = 0
+        #直前に参照された車両のログのリスト
+        s.view_cache_key = None
+        s.view_cache = {}
+        #圧縮用．車両別に[最後のブレークポイント, 保留中の行, 位置・車頭距離・速度の傾きの下限と上限]
+        s.tolerance = tolerance
+        s.traces = {}
+
+    def __len__(s):
+        """
+        The number of stored rows. If compressed, it is the number of breakpoints.
+        """
+        return s.size_spilled + s.size + len(s.buffer)
+
+    def append(s, row):
+        """
+        Append a row.
+
+        Parameters
+        ----------
+        row : tuple
+            The values in the order of `COLUMNS`.
+
+        Notes
+        -----
+        If `tolerance` is given, a row of a vehicle is held as pending until the next row of the vehicle comes. The pending row is dropped if the line from the last breakpoint of the vehicle to the new row passes within `tolerance` from all rows dropped since the breakpoint, in terms of position, spacing, and speed. Otherwise, the pending row is stored as a new breakpoint.
+        A change of the state, link, or lane is always a breakpoint, as is the end of the trip. Thus, the rows are restored exactly on free-flow segments, and with errors of at most `tolerance` (in m or m/s) elsewhere.
+        """
+        if s.tolerance == None:
+            s.buffer.append(row)
+        else:
+            s.append_compressed(row)
+        if len(s.buffer) >= s.chunk_size:
+            s.write_buffer()
+
+    def append_compressed(s, row):
+        """
+        Append a row with compression. See `append()`.
+        """
+        trace = s.traces.get(row[0])
+        if trace == None:
+            s.buffer.append(row)
+            s.traces[row[0]] = [row, None, -math.inf, math.inf, -math.inf, math.inf, -math.inf, math.inf]
+            return
+        anchor, pending = trace[0], trace[1]
+        if row[2] >= VEHICLE_STATE_CODES["end"]:
+            #トリップ終了．以降の行は無い
+            if pending != None:
+                s.buffer.append(pending)
+            s.buffer.append(row)
+            del s.traces[row[0]]
+            return
+        if pending != None and row[2] == pending[2] == anchor[2] and row[3] == pending[3] == anchor[3] and row[7] == pending[7] == anchor[7]:
+            #保留中の行を捨てたとき，新しい行への傾きが捨てた全行の許容範囲に収まるか
+            dt_pending = pending[1]-anchor[1]
+            dt = row[1]-anchor[1]
+            if 0 < dt_pending < dt:
+                tol = s.tolerance
+                x0, s0, v0 = anchor[4], anchor[5], anchor[6]
+                lo_x, hi_x, lo_s, hi_s, lo_v, hi_v = trace[2:]
+                lo, hi = (pending[4]-tol-x0)/dt_pending, (pending[4]+tol-x0)/dt_pending
+                if lo > lo_x: lo_x = lo
+                if hi < hi_x: hi_x = hi
+                lo, hi = (pending[5]-tol-s0)/dt_pending, (pending[5]+tol-s0)/dt_pending
+                if lo > lo_s: lo_s = lo
+                if hi < hi_s: hi_s = hi
+                lo, hi = (pending[6]-tol-v0)/dt_pending, (pending[6]+tol-v0)/dt_pending
+                if lo > lo_v: lo_v = lo
+                if hi < hi_v: hi_v = hi
+                if lo_x <= (row[4]-x0)/dt <= hi_x and lo_s <= (row[5]-s0)/dt <= hi_s and lo_v <= (row[6]-v0)/dt <= hi_v:
+                    trace[1:] = row, lo_x, hi_x, lo_s, hi_s, lo_v, hi_v
+                    return
+        if pending != None:
+            #保留中の行をブレークポイントとする
+            s.buffer.append(pending)
+            trace[0] = pending
+        trace[1:] = row, -math.inf, math.inf, -math.inf, math.inf, -math.inf, math.inf
+
+    def commit(s):
+        """
+        Store all pending rows of the compression as breakpoints.
+        """
+        for trace in s.traces.values():
+            if trace[1] != None:
+                s.buffer.append(trace[1])
+                trace[0:8] = trace[1], None, -math.inf, math.inf, -math.inf, math.inf, -math.inf, math.inf
+
+    def extend(s, n, values):
+        """
+        Append rows at once.
+
+        Parameters
+        ----------
+        n : int
+            The number of rows.
+        values : dict
+            The values (arrays of length `n` or scalars) of each column.
+        """
+        s.write_buffer()
+        s.reserve(n)
+        for key in s.COLUMNS:
+            s.columns[key][s.size:s.size+n] = values[key]
+        s.size += n
+
+    def reserve(s, n):
+        """
+        Grow the arrays in chunks so that `n` more rows can be written.
+        """
+        capacity = len(s.columns["veh"])
+        if s.size+n > capacity:
+            capacity = max(capacity*2, s.size+n)
+            capacity = -(-capacity//s.chunk_size)*s.chunk_size
+            for key,dtype in s.COLUMNS.items():
+                column = np.zeros(capacity, dtype=dtype)
+                column[:s.size] = s.columns[key][:s.size]
+                s.columns[key] = column
+
+    def flush(s):
+        """
+        Write the pending and buffered rows to the arrays. The pending rows of the compression become breakpoints.
+        """
+        s.commit()
+        s.write_buffer()
+
+    def write_buffer(s):
+        """
+        Write the buffered rows to the arrays.
+        """
+        n = len(s.buffer)
+        if n == 0:
+            return
+        s.reserve(n)
+        for key,values in zip(s.COLUMNS, zip(*s.buffer)):
+            s.columns[key][s.size:s.size+n] = values
+        s.size += n
+        s.buffer = []
+
+    def spill(s):
+        """
+        Move the rows in memory to a new shard in the sink directory. The arrays are reused for the following rows.
+        """
+        s.write_buffer()
+        if s.sink == None or s.size == 0:
+            return
+        if s.sink_dir == None:
+            os.makedirs(s.sink, exist_ok=True)
+            s.sink_dir = tempfile.mkdtemp(dir=s.sink, prefix="vehicle_log_")
+        fnames = {}
+        for key in s.COLUMNS:
+            fnames[key] = os.path.join(s.sink_dir, f"vehicle_log_{len(s.shards):06d}_{key}.npy")
+            np.save(fnames[key], s.columns[key][:s.size])
+        s.shards.append((s.size, fnames))
+        s.size_spilled += s.size
+        s.size = 0
+
+    def load_to_memory(s):
+        """
+        Read all shards back to memory and stop spilling.
+        """
+        if len(s.shards):
+            columns = {key: s.column(key) for key in s.COLUMNS}
+            s.size = s.size_spilled + s.size
+            s.columns = columns
+            s.shards = []
+            s.shards_mapped = {}
+            s.size_spilled = 0
+        s.sink = None
+
+    def shard_column(s, i, key):
+        """
+        Returns a column of a shard as a memory-mapped array.
+        """
+        if (i, key) not in s.shards_mapped:
+            s.shards_mapped[i, key] = np.load(s.shards[i][1][key], mmap_mode="r")
+        return s.shards_mapped[i, key]
+
+    def iter_chunks(s):
+        """
+        Iterate over the rows chunk by chunk (each shard and then the rows in memory) without loading all rows at once.
+
+        Yields
+        ------
+        dict
+            The columns of the chunk. The columns of a shard are memory-mapped.
+        """
+        s.write_buffer()
+        for i in range(len(s.shards)):
+            yield {key: s.shard_column(i, key) for key in s.COLUMNS}
+        if s.size > 0:
+            yield {key: s.columns[key][:s.size] for key in s.COLUMNS}
+
+    def column(s, key):
+        """
+        Returns a column of all rows.
+
+        Parameters
+        ----------
+        key : str
+            The name of the column in `COLUMNS`.
+
+        Returns
+        -------
+        numpy.ndarray
+            The column. If there are no shards, it is a view of the array in memory.
+        """
+        s.write_buffer()
+        if len(s.shards) == 0:
+            return s.columns[key][:s.size]
+        return np.concatenate([s.shard_column(i, key) for i in range(len(s.shards))]+[s.columns[key][:s.size]])
+
+    def take(s, key, rows):
+        """
+        Returns the values of a column at the given rows. Only the required parts of the shards are read.
+
+        Parameters
+        ----------
+        key : str
+            The name of the column in `COLUMNS`.
+        rows : numpy.ndarray
+            The row numbers.
+
+        Returns
+        -------
+        numpy.ndarray
+            The values.
+        """
+        s.write_buffer()
+        if len(s.shards) == 0:
+            return s.columns[key][rows]
+        values = np.empty(len(rows), dtype=s.COLUMNS[key])
+        start = 0
+        for i in range(len(s.shards)+1):
+            size = s.shards[i][0] if i < len(s.shards) else s.size
+            mask = (start <= rows) & (rows < start+size)
+            if mask.any():
+                source = s.shard_column(i, key) if i < len(s.shards) else s.columns[key]
+                values[mask] = source[rows[mask]-start]
+            start += size
+        return values
+
+    def vehicle_order(s):
+        """
+        Returns the row numbers of all logs sorted by vehicle id, keeping the order of recording for each vehicle.
+
+        Returns
+        -------
+        numpy.ndarray
+            The row numbers.
+        """
+        s.write_buffer()
+        if s.index_size != len(s):
+            vehs = s.column("veh")
+            s.index_order = np.argsort(vehs, kind="stable")
+            s.index_offsets = np.zeros(len(s.W.VEHICLES)+1, dtype=int)
+            s.index_offsets[1:] = np.cumsum(np.bincount(vehs, minlength=len(s.W.VEHICLES)))
+            s.index_size = len(s)
+            s.index_tail = {}
+            s.index_tail_size = s.index_size
+        return s.index_order
+
+    def update_index_tail(s):
+        """
+        Add the rows recorded after the last update to the per-vehicle index of the tail, without sorting all rows again.
+        """
+        start, end = s.index_tail_size, len(s)
+        if start == end:
+            return
+        vehs = s.take("veh", np.arange(start, end))
+        order = np.argsort(vehs, kind="stable")
+        vehs = vehs[order]
+        rows = order+start
+        bounds = np.concatenate([[0], np.nonzero(vehs[1:] != vehs[:-1])[0]+1, [len(vehs)]]).tolist()
+        for veh_id, i, j in zip(vehs[bounds[:-1]].tolist(), bounds[:-1], bounds[1:]):
+            if veh_id in s.index_tail:
+                s.index_tail[veh_id].append(rows[i:j])
+            else:
+                s.index_tail[veh_id] = [rows[i:j]]
+        s.index_tail_size = end
+
+    def vehicle_rows(s, veh_id):
+        """
+        Returns the row numbers of the logs of a vehicle in the order of recording.
+
+        Parameters
+        ----------
+        veh_id : int
+            The id of the vehicle.
+
+        Returns
+        -------
+        numpy.ndarray
+            The row numbers.
+
+        Notes
+        -----
+        The rows recorded after the last `vehicle_order()` are indexed incrementally, since the rows of each vehicle are appended in time order. The whole index is rebuilt only when the tail becomes larger than the indexed rows, so that the reads during the simulation do not sort all rows every time.
+        """
+        s.write_buffer()
+        if s.index_size < 0 or len(s)-s.index_size > max(s.index_size, s.chunk_size):
+            s.vehicle_order()
+        else:
+            s.update_index_tail()
+        if veh_id+1 < len(s.index_offsets):
+            rows = s.index_order[s.index_offsets[veh_id]:s.index_offsets[veh_id+1]]
+        else:
+            rows = s.index_order[:0]
+        tail = s.index_tail.get(veh_id)
+        if tail == None:
+            return rows
+        if len(tail) > 1:
+            tail[:] = [np.concatenate(tail)]
+        return np.concatenate([rows, tail[0]])
+
+    def expand(s, rows):
+        """
+        Returns the columns of the given rows. If compressed, the rows dropped between the breakpoints are restored by linear interpolation.
+
+        Parameters
+        ----------
+        rows : numpy.ndarray
+            The row numbers sorted by vehicle and then by time, e.g., `vehicle_order()` or `vehicle_rows()`.
+
+        Returns
+        -------
+        dict
+            The columns.
+        """
+        return s.interpolate({key: s.take(key, rows) for key in s.COLUMNS})
+
+    def expand_all(s):
+        """
+        Returns the columns of all rows sorted by vehicle and then by time, as `expand(vehicle_order())`, with the pending rows of the compression. The pending rows are not stored.
+
+        Returns
+        -------
+        dict
+            The columns.
+        """
+        order = s.vehicle_order()
+        columns = {key: s.take(key, order) for key in s.COLUMNS}
+        pending = sorted(trace[1] for trace in s.traces.values() if trace[1] != None)
+        if len(pending):
+            #保留中の行は各車両の最後の行．車両の行の末尾に挿入する
+            positions = s.index_offsets[np.array([row[0] for row in pending])+1]
+            for values, (key, dtype) in zip(zip(*pending), s.COLUMNS.items()):
+                columns[key] = np.insert(columns[key], positions, np.array(values, dtype=dtype))
+        return s.interpolate(columns)
+
+    def interpolate(s, columns):
+        """
+        Restore the rows dropped between the breakpoints by linear interpolation, if compressed.
+
+        Parameters
+        ----------
+        columns : dict
+            The columns of the rows sorted by vehicle and then by time.
+
+        Returns
+        -------
+        dict
+            The columns.
+        """
+        n = len(columns["veh"])
+        if s.tolerance == None or n == 0:
+            return columns
+
+        #ブレークポイント間に記録間隔ごとの行を補う
+        interval = s.W.vehicle_logging_timestep_interval
+        t = columns["t"].astype(np.int64)
+        gaps = np.ones(n, dtype=np.int64)
+        same = columns["veh"][1:] == columns["veh"][:-1]
+        gaps[:-1][same] = np.maximum(-(-(t[1:]-t[:-1])[same]//interval), 1)
+        i = np.repeat(np.arange(n), gaps)
+        k = np.arange(len(i)) - np.repeat(np.cumsum(gaps)-gaps, gaps)
+        j = np.minimum(i+1, n-1)
+        dt = t[j]-t[i]
+        ratio = np.divide(k*interval, dt, out=np.zeros(len(i)), where=k > 0)
+
+        expanded = {key: columns[key][i] for key in ["veh", "state", "link", "lane"]}
+        expanded["t"] = (t[i]+k*interval).astype(s.COLUMNS["t"])
+        for key in ["x", "s", "v"]:
+            values = columns[key].astype(float)
+            expanded[key] = (values[i]+(values[j]-values[i])*ratio).astype(s.COLUMNS[key])
+        return expanded
+
+    def vehicle_column(s, veh, key):
+        """
+        Returns the log of a vehicle as a list, which is `Vehicle.log_*`. If compressed, the log is restored by `interpolate()` including the pending row of the vehicle, which is not stored by this. The lists of the last referred vehicle are cached.
+
+        Parameters
+        ----------
+        veh : Vehicle
+            The vehicle.
+        key : str
+            The name of the column. "t" is converted to seconds, "state" to strings, and "link" to Link objects (-1 if not in a link).
+
+        Returns
+        -------
+        list
+            The log.
+
+        Notes
+        -----
+        The "home" logs of a vehicle that has not departed yet are recorded here until the current timestep, since they are recorded only at the departure and the end of the simulation otherwise.
+        """
+        if veh.state == "home" and s.W.finalized:
+            veh.record_log_home(s.W.T)
+        s.write_buffer()
+        trace = s.traces.get(veh.id)
+        pending = trace[1] if trace != None else None
+        if s.view_cache_key != (veh.id, len(s), pending):
+            s.view_cache_key = (veh.id, len(s), pending)
+            s.view_cache = {}
+        if key not in s.view_cache:
+            if "columns" not in s.view_cache:
+                rows = s.vehicle_rows(veh.id)
+                columns = {k: s.take(k, rows) for k in s.COLUMNS}
+                if pending != None:
+                    #保留中の行は保存せずに末尾に加える
+                    for value, (k, dtype) in zip(pending, s.COLUMNS.items()):
+                        columns[k] = np.append(columns[k], np.array(value, dtype=dtype))
+                s.view_cache["columns"] = s.interpolate(columns)
+            values = s.view_cache["columns"][key]
+            if key == "t":
+                values = (values.astype(np.int64)*s.W.DELTAT).tolist()
+            elif key == "state":
+                values = [VEHICLE_STATES[c] for c in values.tolist()]
+            elif key == "link":
+                values = [s.W.LINKS[i] if i >= 0 else -1 for i in values.tolist()]
+            else:
+                values = values.tolist()
+            s.view_cache[key] = values
+        return s.view_cache[key]
+
+
+class RoutePreference:
+    """
+    Dict-like view of the link preferences for a destination, i.e., a row of `RouteChoice.route_pref_mat`. `route_pref[link]` reads and writes the element of the link in the matrix.
+    """
+
+    def __init__(s, W, row):
+        """
+        Create a view.
+
+        Parameters
+        ----------
+        W : World
+            The world to which this belongs.
+        row : numpy.ndarray
+            The row of the preference matrix. Must be a view so that the updates are shared.
+        """
+        s.W = W
+        s.row = row
+
+    def __getitem__(s, link):
+        return s.row[link.id]
+
+    def __setitem__(s, link, value):
+        s.row[link.id] = value
+
+    def __iter__(s):
+        return iter(s.W.LINKS)
+
+    def __len__(s):
+        return len(s.W.LINKS)
+
+    def __contains__(s, link):
+        return isinstance(link, Link) and link.W == s.W
+
+    def __repr__(s):
+        return f"<RoutePreference {dict(s.items())}>"
+
+    def get(s, link, default=None):
+        if link in s:
+            return s.row[link.id]
+        return default
+
+    def keys(s):
+        return list(s.W.LINKS)
+
+    def values(s):
+        return s.row.tolist()
+
+    def items(s):
+        return list(zip(s.W.LINKS, s.row.tolist()))
+
+
+class RouteChoice:
+    """
+    Class for computing shortest path for all vehicles.
+    """
+
+    def __init__(s, W):
+        """
+        Create route choice computation object.
+
+        Parameters
+        ----------
+        W : object
+            The world to which this belongs.
+        """
+        s.W = W
+        #リンク旅行時間行列．dijkstraでは疎行列を都度作るので不要
+        s.adj_mat_time = None
+        if s.W.route_search_method == "floyd_warshall":
+            s.adj_mat_time = np.zeros([len(s.W.NODES), len(s.W.NODES)])
+        #ij間最短距離とiからjに行くために次に進むべきノード．列は目的地ノードjのdest_index[j]列目
+        #floyd_warshallでは全ノード．dijkstraでは探索した目的地の列のみ持ち，列の無い目的地は-1
+        if s.W.route_search_method == "dijkstra":
+            s.dest_index = -np.ones(len(s.W.NODES), dtype=int)
+            s.dist = np.zeros([len(s.W.NODES), 0])
+            s.next = -np.ones([len(s.W.NODES), 0], dtype=int)
+        else:
+            s.dest_index = np.arange(len(s.W.NODES))
+            s.dist = np.zeros([len(s.W.NODES), len(s.W.NODES)])
+            s.next = np.zeros([len(s.W.NODES), len(s.W.NODES)])
+        #iからjに行くために来たノード．floyd_warshallのみ
+        s.pred = None
+        if s.W.route_search_method == "floyd_warshall":
+            s.pred = np.zeros([len(s.W.NODES), len(s.W.NODES)])
+
+        #dijkstraの差分探索用．前回探索時のノード対ごとのリンク旅行時間，木が最新の旅行時間に対して正しい目的地
+        s.tts_ref = None
+        s.searched = np.zeros(len(s.W.NODES), dtype=bool)
+        #dijkstraで直前の探索に使ったノード対とリンク旅行時間．新しい目的地をその場で探索する用
+        s.ijs = None
+        s.tts_last = None
+        s.route_search_log = []
+
+        #homogeneous DUO用．kに行くための最短経路的上にあれば1．行が目的地ノード，列がリンクのid
+        s.route_pref_mat = np.zeros([len(s.W.NODES), len(s.W.LINKS)])
+        s.route_pref = {k.id: RoutePreference(s.W, s.route_pref_mat[k.id]) for k in s.W.NODES}
+
+        #リンクの始点・終点ノードのid
+        s.link_start_ids = np.array([l.start_node.id for l in s.W.LINKS], dtype=int)
+        s.link_end_ids = np.array([l.end_node.id for l in s.W.LINKS], dtype=int)
+
+    def route_search_all(s, infty=np.inf, noise=0):
+        """
+        Compute the current shortest path based on instantanious travel time.
+
+        Parameters
+        ----------
+        infty : float
+            value representing infinity.
+        noise : float
+            very small noise to slightly randomize route choice. useful to eliminate strange results at an initial stage of simulation where many routes has identical travel time.
+        """
+        if s.W.route_search_method == "dijkstra":
+            s.route_search_all_dijkstra(noise=noise)
+            return
+
+        s.adj_mat_time = np.zeros([len(s.W.NODES), len(s.W.NODES)])
+        adj_mat_link_count = np.zeros([len(s.W.NODES), len(s.W.NODES)])
+
+        for link in s.W.LINKS:
+            i = link.start_node.id
+            j = link.end_node.id
+            if s.W.ADJ_MAT[i,j]:
+                new_link_tt = link.traveltime_instant[-1]*random.uniform(1, 1+noise) + link.route_choice_penalty
+                n = adj_mat_link_count[i,j]
+                s.adj_mat_time[i,j] = s.adj_mat_time[i,j]*n/(n+1) + new_link_tt/(n+1) # if there are multiple links between the same nodes, average the travel time
+                # s.adj_mat_time[i,j] = new_link_tt #if there is only one link between the nodes, this line is fine, but for generality we use the above line
+                adj_mat_link_count[i,j] += 1
+                if link.capacity_in == 0: #if the inflow is profibited, travel time is assumed to be infinite
+                    s.adj_mat_time[i,j] = np.inf
+            else:
+                s.adj_mat_time[i,j] = np.inf
+
+        s.dist, s.pred = floyd_warshall(s.adj_mat_time, return_predecessors=True)
+
+        n_vertices = s.pred.shape[0]
+        s.next = -np.ones((n_vertices, n_vertices), dtype=int)
+        for i in range(n_vertices):
+            for j in range(n_vertices):
+                # iからjへの最短経路を逆にたどる．．． -> todo: 起終点を逆にした最短経路探索にすればよい
+                if i != j:
+                    prev = j
+                    while s.pred[i, prev] != i and s.pred[i, prev] != -9999:
+                        prev = s.pred[i, prev]
+                    s.next[i, j] = prev
+
+    def dest_columns(s, dests):
+        """
+        Get the columns of `s.next` and `s.dist` for the destinations, adding new columns for the destinations that do not have them yet.
+
+        Parameters
+        ----------
+        dests : numpy.ndarray
+            The ids of the destination nodes.
+
+        Returns
+        -------
+        numpy.ndarray
+            The column indices.
+        """
+        new = np.unique(dests[s.dest_index[dests] < 0])
+        if len(new):
+            n_cols = s.next.shape[1]
+            s.dest_index[new] = np.arange(n_cols, n_cols+len(new))
+            s.next = np.concatenate([s.next, -np.ones([len(s.W.NODES), len(new)], dtype=int)], axis=1)
+            s.dist = np.concatenate([s.dist, np.full([len(s.W.NODES), len(new)], np.inf)], axis=1)
+        return s.dest_index[dests]
+
+    def route_search_dijkstra_dests(s, graph_reverse, dests):
+        """
+        Run reverse Dijkstra's algorithm from the destinations and store the results to the columns of `s.next` and `s.dist` for them.
+
+        Parameters
+        ----------
+        graph_reverse : scipy.sparse.csr_matrix
+            The reversed graph of link travel times.
+        dests : numpy.ndarray
+            The ids of the destination nodes.
+        """
+        dist, pred = dijkstra(graph_reverse, directed=True, indices=dests, return_predecessors=True)
+        #逆向きグラフの先行ノードが元のグラフでの次ノード
+        next_nodes = pred.T.astype(int)
+        next_nodes[next_nodes == -9999] = np.broadcast_to(dests, next_nodes.shape)[next_nodes == -9999] #到達不能な場合は目的地そのもの（floyd_warshall版と同じ）
+        next_nodes[dests, np.arange(len(dests))] = -1
+        cols = s.dest_columns(dests)
+        s.next[:, cols] = next_nodes
+        s.dist[:, cols] = dist.T
+
+    def reverse_graph(s, tts):
+        """
+        Build the reversed graph of the link travel times `tts` of the node pairs `s.ijs` for `route_search_dijkstra_dests`.
+        """
+        n_vertices = len(s.W.NODES)
+        valid = np.isfinite(tts) & (tts > 0) #floyd_warshallの密行列と同様に0とinfは辺なし
+        #逆向きグラフ上で目的地から探索すると，先行ノードが元のグラフでの次ノードになる
+        return csr_matrix((tts[valid], (s.ijs[valid,1], s.ijs[valid,0])), shape=(n_vertices, n_vertices))
+
+    def search_destination(s, k):
+        """
+        Search the shortest path tree to a destination now if it is not up to date, e.g., for a vehicle with a new destination added during the simulation. Used when `World.route_search_method` is "dijkstra".
+
+        Parameters
+        ----------
+        k : int
+            The id of the destination node.
+
+        Notes
+        -----
+        The link costs of the last route search are used, and the route preference of the destination is updated as `homogeneous_DUO_update()` does. Nothing is done before the first route search.
+        """
+        if s.W.route_search_method != "dijkstra" or s.searched[k] or s.tts_last is None:
+            return
+        dests = np.array([k])
+        s.route_search_dijkstra_dests(s.reverse_graph(s.tts_last), dests)
+        s.searched[k] = True
+        s.homogeneous_DUO_update(dests)
+
+    def route_search_destinations(s):
+        """
+        Get the ids of the destination nodes for which the shortest paths should be updated, i.e., the destinations of the living vehicles. All nodes if there are taxis, as their future destinations are unknown.
+
+        Returns
+        -------
+        list of int
+            The sorted node ids.
+        """
+        dests = set()
+        for veh in s.W.VEHICLES_LIVING.values():
+            if veh.mode == "taxi":
+                return list(range(len(s.W.NODES)))
+            if veh.dest != None:
+                dests.add(veh.dest.id)
+        dests |= s.W.DEPARTURE_SCHEDULER.pending_destinations()
+        return sorted(dests)
+
+    def route_search_all_dijkstra(s, noise=0):
+        """
+        Compute the current shortest path based on instantanious travel time by reverse Dijkstra's algorithm from each destination. Used when `World.route_search_method` is "dijkstra".
+
+        Parameters
+        ----------
+        noise : float
+            very small noise to slightly randomize route choice.
+
+        Notes
+        -----
+        The link costs are the same as `route_search_all`. `s.next` and `s.dist` are updated only for the destinations given by `route_search_destinations`, and `s.searched` marks them. The columns of the other destinations are out of date until they are searched again, for example by `search_destination()` when a vehicle heading to them appears.
+
+        If `World.route_search_tolerance` is positive, the search is incremental. A link cost is taken into account only when it has changed by more than the tolerance ratio from the cost used last time, and only the shortest path trees that may be affected by such changed links are recomputed: the trees that contain a changed link and the trees that a changed link could shortcut. The other trees are reused as they are still exact shortest path trees for the current costs. The numbers of recomputed and reused trees are recorded in `s.route_search_log` as [time, recomputed, reused].
+        """
+        #ノード対ごとのリンク旅行時間．並行リンクは平均
+        link_tt = {}
+        link_count = {}
+        for link in s.W.LINKS:
+            ij = (link.start_node.id, link.end_node.id)
+            new_link_tt = link.traveltime_instant[-1]*random.uniform(1, 1+noise) + link.route_choice_penalty
+            n = link_count.get(ij, 0)
+            link_tt[ij] = link_tt.get(ij, 0)*n/(n+1) + new_link_tt/(n+1)
+            link_count[ij] = n+1
+            if link.capacity_in == 0: #if the inflow is profibited, travel time is assumed to be infinite
+                link_tt[ij] = np.inf
+
+        dests = s.route_search_destinations()
+        if len(dests) == 0:
+            return
+
+        ijs = np.array(list(link_tt.keys()), dtype=int).reshape(-1, 2)
+        tts = np.array(list(link_tt.values()), dtype=float)
+        dests = np.array(dests)
+        dests_search = dests
+
+        if s.W.route_search_tolerance > 0:
+            if s.tts_ref is None:
+                s.searched[:] = False
+            else:
+                #許容値を超えて変化したリンクだけ反映する
+                with np.errstate(invalid="ignore"):
+                    changed = (np.isinf(tts) != np.isinf(s.tts_ref)) | (np.abs(tts-s.tts_ref) > s.W.route_search_tolerance*s.tts_ref)
+                tts_changed = tts[changed]
+                tts = s.tts_ref.copy()
+                tts[changed] = tts_changed
+                if changed.any():
+                    #変化したリンクが木に含まれるか，近道になりうる目的地の木は再計算
+                    i, j = ijs[changed,0], ijs[changed,1]
+                    cols = s.dest_columns(dests)
+                    on_tree = s.next[np.ix_(i, cols)] == j[:,np.newaxis]
+                    shortcut = tts_changed[:,np.newaxis] + s.dist[np.ix_(j, cols)] < s.dist[np.ix_(i, cols)]
+                    affected = np.any(on_tree | shortcut, axis=0)
+                    #今回探索しない目的地の木は確認していないので無効化
+                    searched = s.searched[dests] & ~affected
+                    s.searched[:] = False
+                    s.searched[dests] = searched
+            dests_search = dests[~s.searched[dests]]
+            s.tts_ref = tts
+        else:
+            #探索しない目的地の列は古いので無効化
+            s.searched[:] = False
+        s.ijs = ijs
+        s.tts_last = tts
+
+        s.route_search_log.append([s.W.T*s.W.DELTAT, len(dests_search), len(dests)-len(dests_search)])
+        if len(dests_search) == 0:
+            return
+
+        s.route_search_dijkstra_dests(s.reverse_graph(tts), dests_search)
+        s.searched[dests_search] = True
+
+    def homogeneous_DUO_update(s, dests=None):
+        """
+        Update link preference of all homogeneous travelers based on DUO principle.
+
+        Parameters
+        ----------
+        dests : numpy.ndarray, optional
+            The ids of the destination nodes to be updated. Default is all destinations whose shortest paths are up to date (all nodes for "floyd_warshall", `s.searched` for "dijkstra").
+        """
+        if dests is None:
+            if s.W.route_search_method == "dijkstra":
+                dests = np.nonzero(s.searched)[0]
+            else:
+                dests = np.arange(len(s.W.NODES))
+        #目的地kへの最短経路上にあるリンクlならon_route[k,l]=1
+        on_route = (s.next[np.ix_(s.link_start_ids, s.dest_index[dests])] == s.link_end_ids[:,np.newaxis]).T
+        route_pref_mat = s.route_pref_mat[dests]
+        weight = np.full(len(dests), s.W.DUO_UPDATE_WEIGHT, dtype=float)
+        weight[route_pref_mat.sum(axis=1) == 0] = 1 #最初にpreferenceが空なら確定的に初期化
+        weight = weight[:,np.newaxis]
+        s.route_pref_mat[dests] = (1-weight)*route_pref_mat + weight*on_route #RoutePreferenceが参照しているので上書き
+
+
+#チェックポイントに保存するリンクのスカラー属性（Noneはnan）
+LINK_CHECKPOINT_ATTRIBUTES = ["u", "kappa", "tau", "w", "capacity", "delta", "delta_per_lane", "q_star", "k_star", "merge_priority", "route_choice_penalty", "capacity_in", "capacity_out", "capacity_in_remain", "capacity_out_remain", "_vehicles_speed_sum", "_speed", "_density", "_flow", "_num_vehicles", "_num_vehicles_queue"]
+
+
+class World:
+    """
+    World (i.e., simulation environment). A World object is consistently referred to as `W` in this code.
+    """
+
+    def __init__(W, name="", deltan=5, reaction_time=1, duo_update_time=600, duo_update_weight=0.5, duo_noise=0.01, eular_dt=120, eular_dx=100, random_seed=None, print_mode=1, save_mode=1, show_mode=0, route_choice_principle="homogeneous_DUO", show_progress=1, show_progress_deltat=600, tmax=None, vehicle_logging_timestep_interval=1, verify_link_state=0, route_search_method="floyd_warshall", route_search_tolerance=0, vehicle_log_sink=None, vehicle_log_sink_timestep_interval=1000, vehicle_log_tolerance=None, edie_state_online=0, lazy_vehicle_creation=0):
+        """
+        Create a World.
+
+        Parameters
+        ----------
+        name : str, optional
+            The name of the world, default is an empty string.
+        deltan : int, optional
+            The platoon size, default is 5 vehicles.
+        reaction_time : float, optional
+            The reaction time, default is 1 second. This is also related to simulation time step width.
+        duo_update_time : float, optional
+            The time interval for route choice update, default is 600 seconds.
+        duo_update_weight : float, optional
+            The update weight for route choice, default is 0.5.
+        duo_noise : float, optional
+            The noise in route choice, default is 0.01.
+        eular_dt : float, optional
+            The time aggregation size for eularian traffic state computation, default is 120.
+        random_seed : int or None, optional
+            The random seed, default is None.
+        print_mode : int, optional
+            The print mode, whether print the simulation progress or not. Default is 1 (enabled).
+        save_mode : int, optional
+            The save mode,. whether save the simulation results or not.  Default is 1 (enabled).
+        show_mode : int, optional
+            The show mode, whether show the matplotlib visualization results or not. Default is 0 (disabled).
+        route_choice_principle : str, optional
+            The route choice principle, default is "homogeneous_DUO".
+        show_progress : int, optional
+            Whether show network progress, default is 1 (enabled).
+        show_progress_deltat : float, optional
+            The time interval for showing network progress, default is 600 seconds.
+        tmax : float or None, optional
+            The simulation duration, default is None (automatically determined).
+        vehicle_logging_timestep_interval : int, optional
+            The interval for logging vehicle data, default is 1. Logging is off if set to -1.
+            Setting large intervel (2 or more) or turn off the logging makes the simulation significantly faster in large-scale scenarios without loosing simulation internal accuracy, but outputed vehicle trajecotry and other related data will become inaccurate.
+        verify_link_state : int, optional
+            Whether to cross-check the running speed aggregates of links (used by `Link.speed` and `Link.num_vehicles_queue`) against brute-force recomputation on every timestep, default is 0 (disabled). For debugging; it is slow.
+        route_search_method : str, optional
+            The shortest path algorithm used for DUO route choice, default is "floyd_warshall".
+            If "dijkstra", reverse Dijkstra's algorithm on a sparse graph is run from the destinations of living vehicles only (from all destinations if there are taxis). It is much faster in large networks. Equal-cost paths may be broken differently from "floyd_warshall".
+        route_search_tolerance : float, optional
+            Relative tolerance of link travel time changes for incremental route search, default is 0 (all shortest paths are recomputed on every route update). Only for `route_search_method="dijkstra"`.
+            If positive, link travel time changes smaller than this ratio are ignored and only the shortest path trees affected by the other changes are recomputed. The numbers of recomputed and reused trees are recorded in `W.ROUTECHOICE.route_search_log`.
+        vehicle_log_sink : str, optional
+            The directory to which the vehicle logs are written during the simulation, default is None (the logs are kept in memory).
+            If specified, the logs in memory are moved to .npy files (shards) in this directory every `vehicle_log_sink_timestep_interval` timesteps, so that the memory usage of long large-scale simulations is bounded. The shards are read lazily by `Vehicle.log_*` and the analyzer. Each World writes to its own new subdirectory, and the files are not removed automatically.
+        vehicle_log_sink_timestep_interval : int, optional
+            The interval of writing the vehicle logs to `vehicle_log_sink` in timesteps, default is 1000.
+        vehicle_log_tolerance : float, optional
+            The tolerance of the vehicle log compression, default is None (no compression).
+            If specified, only the breakpoints of the vehicle trajectories (departure, link entry and exit, and changes of the position, spacing, or speed trends beyond this tolerance in m or m/s) are stored, and the other logs are restored by linear interpolation when they are read. The restored logs are exact on free-flow segments and within this tolerance elsewhere. It reduces the memory of the logs significantly in uncongested networks.
+        edie_state_online : int, optional
+            Whether to accumulate the Edie's traffic states of links (`Link.tn_mat` and `dn_mat`) during the simulation from the movement of each platoon, default is 0 (disabled; they are computed from the vehicle trajectories after the simulation).
+            If enabled, `Analyzer.compute_edie_state()` only divides the accumulated values, so it is fast and can be called during the simulation (e.g., for control) and without vehicle logs (`vehicle_logging_timestep_interval=-1`). The results are approximately equal to the trajectory-based ones; they differ slightly around the link ends, where the trajectory-based method extrapolates the trajectories.
+        lazy_vehicle_creation : int, optional
+            Whether to create the vehicles generated by the demand functions (`adddemand`, `adddemand_bulk`, etc.) only when they depart, default is 0 (disabled; the vehicles are created immediately).
+            If enabled, the demand is stored as compact arrays (origin, destination, departure time, and color) until the departure time, so that the memory usage of scenarios with many trips is much smaller. `W.VEHICLES` becomes a `LazyVehicleDict`, which creates the vehicles when they are accessed. The results are identical to the disabled case. Only for `route_choice_principle="homogeneous_DUO"`.
+
+        Notes
+        -----
+        A World object must be defined firstly to initiate simulation.
+        """
+
+        ## パラメータ設定
+        random.seed(random_seed)
+        np.random.seed(random_seed)
+        W.random_seed = random_seed
+
+        W.TMAX = tmax   #シミュレーション時間（s）
+
+        W.DELTAN = deltan         #車群サイズ（veh）
+        W.REACTION_TIME = reaction_time         #反応時間（s）
+
+        W.DUO_UPDATE_TIME = duo_update_time     #経路選択時間間隔（s）
+        W.DUO_UPDATE_WEIGHT = duo_update_weight    #経路選択の更新重み
+        W.DUO_NOISE = duo_noise    #経路選択時のノイズ（完全に対称なネットワークで極端な経路選択になるのを防ぐ）
+        W.EULAR_DT = eular_dt     #Eular型データのデフォルト時間離散化幅
+
+        W.DELTAT = W.REACTION_TIME*W.DELTAN
+        W.DELTAT_ROUTE = int(W.DUO_UPDATE_TIME/W.DELTAT)
+
+        ## データ格納先定義
+        if lazy_vehicle_creation:
+            W.VEHICLES = LazyVehicleDict(W)   #home, wait, run, end，未生成
+        else:
+            W.VEHICLES = OrderedDict()        #home, wait, run, end
+        W.VEHICLES_LIVING = OrderedDict()     #home, wait, run
+        W.VEHICLES_RUNNING = OrderedDict()    #run
+        W.VEHICLES_ACTIVE = OrderedDict()     #wait, run
+        W.NODES = []                          #id順．Node.idはこのリストの添字
+        W.LINKS = []                          #id順．Link.idはこのリストの添字
+        W.NODES_NAME_DICT = {}                #名前から検索する用
+        W.LINKS_NAME_DICT = {}
+        W.NODE_KDTREE = None                  #ノード座標のKD木．get_node_kdtree()で作る
+
+        W.DEPARTURE_SCHEDULER = DepartureScheduler(W)
+        W.VEHICLE_LOGS = VehicleLogStore(W, sink=vehicle_log_sink, tolerance=vehicle_log_tolerance)
+
+        W.vehicle_logging_timestep_interval = vehicle_logging_timestep_interval
+        W.vehicle_log_sink = vehicle_log_sink
+        W.vehicle_log_sink_timestep_interval = vehicle_log_sink_timestep_interval
+        W.vehicle_log_tolerance = vehicle_log_tolerance
+        W.edie_state_online = edie_state_online
+        W.lazy_vehicle_creation = lazy_vehicle_creation
+
+        W.verify_link_state = verify_link_state
+
+        W.route_choice_principle = route_choice_principle
+        if route_search_method not in ["floyd_warshall", "dijkstra"]:
+            raise ValueError(f"unknown route_search_method '{route_search_method}'")
+        W.route_search_method = route_search_method
+        if route_search_tolerance > 0 and route_search_method != "dijkstra":
+            raise ValueError("route_search_tolerance requires route_search_method='dijkstra'")
+        W.route_search_tolerance = route_search_tolerance
+
+        ## リアルタイム経過表示
+        W.show_progress = show_progress
+        W.show_progress_deltat_timestep = int(show_progress_deltat/W.DELTAT)
+
+        ## システム設定
+        W.name = name
+
+        W.finalized = 0
+        W.world_start_time = time.time()
+
+        W.print_mode = print_mode
+        if print_mode:
+            W.print = print
+        else:
+            def noprint(*args, **kwargs):
+                pass
+            W.print = noprint
+        W.save_mode = save_mode
+        W.show_mode = show_mode
+
+
+    def addNode(W, *args, **kwargs):
+        """
+        add a node to world
+
+        Parameters
+        ----------
+        name : str
+            The name of the node.
+        x : float
+            The x-coordinate of the node (for visualization purposes).
+        y : float
             The y-coordinate of the node (for visualization purposes).
         signal : list of int, optional
             A list representing the signal at the node. Default is [0], representing no signal.
@@ -1488,6 +2944,8 @@ class World:
             Additional (meta) attributes defined by users.
         auto_rename : bool, optional
             Whether to automatically rename the vehicle if the name is already used. Default is False.
+        color : tuple, optional
+            The RGB color of the vehicle for visualization, default is random.
 
         Returns
         -------
@@ -1525,12 +2983,19 @@ class World:
         if volume > 0:
             flow = volume/(t_end-t_start)
 
+        lazy = W.lazy_vehicle_creation and W.route_choice_principle == "homogeneous_DUO"
+        steps = []
         f = 0
         for t in range(int(t_start/W.DELTAT), int(t_end/W.DELTAT)):
             f += flow*W.DELTAT
             while f >= W.DELTAN:
-                W.addVehicle(orig, dest, t, departure_time_is_time_step=1, attribute=attribute)
+                if lazy:
+                    steps.append(t)
+                else:
+                    W.addVehicle(orig, dest, t, departure_time_is_time_step=1, attribute=attribute)
                 f -= W.DELTAN
+        if lazy and len(steps):
+            W.add_pending_vehicles(np.full(len(steps), W.get_node(orig).id), np.full(len(steps), W.get_node(dest).id), steps, attribute)
 
     def adddemand_point2point(W, x_orig, y_orig, x_dest, y_dest, t_start, t_end, flow=-1, volume=-1, attribute=None):
         """
@@ -1538,28 +3003,37 @@ class World:
 
         Parameters
         ----------
-        x_orig : float
+        x_orig : float | array-like of float
             The x-coordinate of the origin.
-        y_orig : float
+        y_orig : float | array-like of float
             The y-coordinate of the origin.
-        x_dest : float
+        x_dest : float | array-like of float
             The x-coordinate of the destination.
-        y_dest : float
+        y_dest : float | array-like of float
             The y-coordinate of the destination.
-        t_start : float
+        t_start : float | array-like of float
             The start time for the demand in seconds.
-        t_end : float
+        t_end : float | array-like of float
             The end time for the demand in seconds.
-        flow : float, optional
+        flow : float | array-like of float, optional
             The flow rate from the origin to the destination in vehicles per second.
-        volume: float, optional
+        volume: float | array-like of float, optional
             The demand volume from the origin to the destination. If volume is specified, the flow is ignored.
         attribute : any, optinonal
             Additional (meta) attributes defined by users.
+
+        Notes
+        -----
+        If the coordinates are arrays, each element is a demand; the origins and destinations are snapped to the nearest nodes at once by `get_nearest_nodes()` and the demands are added by `adddemand_bulk()`.
         """
-        orig = W.get_nearest_node(x_orig, y_orig)
-        dest = W.get_nearest_node(x_dest, y_dest)
-        W.adddemand(orig, dest, t_start, t_end, flow, volume, attribute)
+        if np.ndim(x_orig) == np.ndim(y_orig) == np.ndim(x_dest) == np.ndim(y_dest) == 0:
+            orig = W.get_nearest_node(x_orig, y_orig)
+            dest = W.get_nearest_node(x_dest, y_dest)
+            W.adddemand(orig, dest, t_start, t_end, flow, volume, attribute)
+        else:
+            orig = W.get_nearest_nodes(x_orig, y_orig)
+            dest = W.get_nearest_nodes(x_dest, y_dest)
+            W.adddemand_bulk(orig, dest, t_start, t_end, flow, volume, attribute)
 
     def adddemand_area2area(W, x_orig, y_orig,  radious_orig, x_dest, y_dest, radious_dest, t_start, t_end, flow=-1, volume=-1, attribute=None):
         """
@@ -1612,9 +3086,149 @@ class World:
             flow = flow/(len(origs)*len(dests))
         if volume != -1:
             volume = volume/(len(origs)*len(dests))
-        for o in origs:
-            for d in dests:
-                W.adddemand(o, d, t_start, t_end, flow, volume, attribute)
+        W.adddemand_bulk([o for o in origs for d in dests], [d for o in origs for d in dests], t_start, t_end, flow, volume, attribute)
+
+    def adddemand_bulk(W, orig, dest, t_start, t_end, flow=-1, volume=-1, attribute=None):
+        """
+        Generate vehicles by specifying many time-dependent origin-destination demands at once.
+
+        Parameters
+        ----------
+        orig : list of str | list of Node
+            The names or objects of the origin nodes of the demands. A single str or Node is used for all demands.
+        dest : list of str | list of Node
+            The names or objects of the destination nodes of the demands. A single str or Node is used for all demands.
+        t_start : array-like of float | float
+            The start times of the demands in seconds.
+        t_end : array-like of float | float
+            The end times of the demands in seconds.
+        flow : array-like of float | float, optional
+            The flow rates of the demands in vehicles per second.
+        volume: array-like of float | float, optional
+            The demand volumes. If the volume of a demand is positive, its flow is ignored.
+        attribute : any, optinonal
+            Additional (meta) attributes defined by users. It is shared by all the generated vehicles.
+
+        Notes
+        -----
+        The result is the same as calling `adddemand` for each demand in order, but the departure times of all platoons are computed at once by `platoon_departures`.
+        If `World.lazy_vehicle_creation` is enabled, the vehicles are not created here but registered to the departure scheduler as arrays.
+        """
+        if type(orig) in [str, Node]:
+            orig = [orig]
+        if type(dest) in [str, Node]:
+            dest = [dest]
+        orig_index, dest_index, t_start, t_end, flow, volume = np.broadcast_arrays(np.arange(len(orig)), np.arange(len(dest)), np.asarray(t_start, dtype=float), np.asarray(t_end, dtype=float), np.asarray(flow, dtype=float), np.asarray(volume, dtype=float))
+
+        with np.errstate(divide="ignore", invalid="ignore"):
+            flow = np.where(volume > 0, volume/(t_end-t_start), flow)
+        step_start = (t_start/W.DELTAT).astype(int)
+        n_steps = (t_end/W.DELTAT).astype(int) - step_start
+        rows, steps = platoon_departures(flow*W.DELTAT, n_steps, W.DELTAN)
+
+        nodes = {}
+        def node(n):
+            if n not in nodes:
+                nodes[n] = W.get_node(n)
+            return nodes[n]
+
+        if W.lazy_vehicle_creation and W.route_choice_principle == "homogeneous_DUO":
+            if len(rows) == 0:
+                return
+            orig_ids = np.zeros(len(orig), dtype=int)
+            for k in np.unique(orig_index[rows]).tolist():
+                orig_ids[k] = node(orig[k]).id
+            dest_ids = np.zeros(len(dest), dtype=int)
+            for k in np.unique(dest_index[rows]).tolist():
+                dest_ids[k] = node(dest[k]).id
+            orig_ids = orig_ids[orig_index[rows]]
+            dest_ids = dest_ids[dest_index[rows]]
+            W.add_pending_vehicles(orig_ids, dest_ids, step_start[rows]+steps, attribute)
+            return
+
+        for i, t in zip(rows.tolist(), (step_start[rows]+steps).tolist()):
+            Vehicle(W, node(orig[orig_index[i]]), node(dest[dest_index[i]]), t, departure_time_is_time_step=1, attribute=attribute)
+
+    def add_pending_vehicles(W, orig_ids, dest_ids, departure_steps, attribute=None):
+        """
+        Register vehicles to the departure scheduler without creating them (see `World.lazy_vehicle_creation`). Their ids and colors are the same as those of the vehicles created in the same order.
+
+        Parameters
+        ----------
+        orig_ids : array-like of int
+            The ids of the origin nodes.
+        dest_ids : array-like of int
+            The ids of the destination nodes.
+        departure_steps : array-like of int
+            The departure timesteps.
+        attribute : any, optinonal
+            The attribute shared by the vehicles.
+        """
+        n = len(dest_ids)
+        #色の乱数は車両を作る場合と同じ順に引く
+        color = np.array([random.random() for i in range(3*n)]).reshape(-1, 3)
+        vehicle_id = W.VEHICLES.reserve(n)
+        W.DEPARTURE_SCHEDULER.add_pending(vehicle_id, orig_ids, dest_ids, departure_steps, color, attribute)
+
+    def adddemand_od_tensor(W, od, t_slices, origs=None, dests=None, unit="flow", attribute=None):
+        """
+        Generate vehicles by specifying a time-sliced origin-destination matrix.
+
+        Parameters
+        ----------
+        od : array-like of float
+            The demand with shape (number of time slices, number of origins, number of destinations). `od[i,o,d]` is the demand from `origs[o]` to `dests[d]` during the i-th time slice. A 2-dimensional array is treated as a single time slice.
+        t_slices : array-like of float
+            The boundaries of the time slices in seconds. Its length is the number of time slices plus 1.
+        origs : list of str | list of Node, optional
+            The origin nodes. Default is all nodes in the World.
+        dests : list of str | list of Node, optional
+            The destination nodes. Default is `origs`.
+        unit : str, optional
+            "flow" if `od` is the flow rate in vehicles per second, "volume" if `od` is the number of vehicles in each time slice. Default is "flow".
+        attribute : any, optinonal
+            Additional (meta) attributes defined by users. It is shared by all the generated vehicles.
+
+        Notes
+        -----
+        The result is the same as calling `adddemand` for each time slice, origin, and destination in this order.
+        """
+        od = np.asarray(od, dtype=float)
+        if od.ndim == 2:
+            od = od[np.newaxis]
+        t_slices = np.asarray(t_slices, dtype=float)
+        if origs is None:
+            origs = W.NODES
+        if dests is None:
+            dests = origs
+        if od.shape != (len(t_slices)-1, len(origs), len(dests)):
+            raise ValueError(f"shape of od {od.shape} does not match the time slices and nodes {(len(t_slices)-1, len(origs), len(dests))}")
+        if unit not in ["flow", "volume"]:
+            raise ValueError(f"unknown unit '{unit}'. It must be 'flow' or 'volume'")
+
+        i, o, d = np.nonzero(od > 0)
+        if unit == "flow":
+            flow, volume = od[i, o, d], -1
+        else:
+            flow, volume = -1, od[i, o, d]
+        W.adddemand_bulk([origs[k] for k in o.tolist()], [dests[k] for k in d.tolist()], t_slices[i], t_slices[i+1], flow, volume, attribute)
+
+    def adddemand_from_dataframe(W, df, attribute=None):
+        """
+        Generate vehicles by specifying time-dependent origin-destination demands as a pandas.DataFrame.
+
+        Parameters
+        ----------
+        df : pandas.DataFrame
+            The demands. Columns "orig", "dest", "t_start", "t_end", and "flow" and/or "volume" are used in the same way as the arguments of `adddemand`.
+        attribute : any, optinonal
+            Additional (meta) attributes defined by users. It is shared by all the generated vehicles.
+        """
+        if "flow" not in df.columns and "volume" not in df.columns:
+            raise ValueError("df must have 'flow' or 'volume' column")
+        flow = df["flow"].to_numpy(dtype=float) if "flow" in df.columns else -1
+        volume = df["volume"].to_numpy(dtype=float) if "volume" in df.columns else -1
+        W.adddemand_bulk(df["orig"].tolist(), df["dest"].tolist(), df["t_start"].to_numpy(dtype=float), df["t_end"].to_numpy(dtype=float), flow, volume, attribute)
     
     def finalize_scenario(W, tmax=None):
         """
@@ -1631,10 +3245,7 @@ class World:
         """
         if W.TMAX == None:
             if tmax == None:
-                tmax = 0
-                for veh in W.VEHICLES.values():
-                    if veh.departure_time*W.DELTAT > tmax:
-                        tmax = veh.departure_time*W.DELTAT
+                tmax = W.DEPARTURE_SCHEDULER.departure_time_max()*W.DELTAT
                 W.TMAX = (tmax//1800+2)*1800
             else:
                 W.TMAX = tmax    #s
@@ -1754,8 +3365,9 @@ class World:
             for veh in W.VEHICLES_RUNNING.values():
                 veh.carfollow()
 
-            for name in list(W.VEHICLES_LIVING.keys()):
-                W.VEHICLES_LIVING[name].update()
+            W.activate_departing_vehicles()
+            for veh in list(W.VEHICLES_ACTIVE.values()):
+                veh.update()
 
             if W.T % W.DELTAT_ROUTE == 0:
                 W.ROUTECHOICE.route_search_all(noise=W.DUO_NOISE)
@@ -1765,9 +3377,20 @@ class World:
 
             W.TIME = W.T*W.DELTAT
 
+            if W.VEHICLE_LOGS.sink != None and W.T%W.vehicle_log_sink_timestep_interval == W.vehicle_log_sink_timestep_interval-1:
+                W.VEHICLE_LOGS.spill()
+
             if W.print_mode and W.show_progress and W.T%W.show_progress_deltat_timestep == 0 and W.T > 0:
                 W.analyzer.show_simulation_progress()
 
+        if W.T == W.TSIZE-1:
+            #出発しなかった未生成の車両も最後には生成する
+            W.DEPARTURE_SCHEDULER.create_all_pending(W.T+1)
+            #出発しなかった車両の"home"のログ．途中で止めた場合は参照時に記録する
+            for veh in W.DEPARTURE_SCHEDULER.vehicles():
+                veh.record_log_home(W.T+1)
+            W.VEHICLE_LOGS.commit()
+
         if W.T == W.TSIZE-1:
             if W.print_mode and W.show_progress:
                 W.analyzer.show_simulation_progress()
@@ -1777,6 +3400,38 @@ class World:
         W.T += 1
         return 0 #まだ終わってない
 
+    def activate_departing_vehicles(W):
+        """
+        Move the vehicles whose departure time has come from the departure scheduler to `VEHICLES_ACTIVE`. Their "home" logs are recorded here.
+
+        Notes
+        -----
+        `VEHICLES_ACTIVE` is kept in the order of vehicle creation, so that vehicles are updated in the same order as `VEHICLES_LIVING`.
+        The departing vehicles are merged into it from the end: only the active vehicles with larger ids than the departing ones are moved.
+        """
+        vehs = W.DEPARTURE_SCHEDULER.pop_due(W.T)
+        if len(vehs) == 0:
+            return
+        for veh in vehs:
+            veh.record_log_home(W.T)
+
+        #出発する車両より後ろのidの車両を末尾から集める
+        tail = []
+        for veh in reversed(W.VEHICLES_ACTIVE.values()):
+            if veh.id < vehs[0].id:
+                break
+            tail.append(veh)
+        if len(tail) == 0:
+            for veh in vehs:
+                W.VEHICLES_ACTIVE[veh.name] = veh
+        else:
+            tail.reverse()
+            for veh in heapq.merge(tail, vehs, key=lambda veh: veh.id):
+                if veh.name in W.VEHICLES_ACTIVE:
+                    W.VEHICLES_ACTIVE.move_to_end(veh.name)
+                else:
+                    W.VEHICLES_ACTIVE[veh.name] = veh
+
     def check_simulation_ongoing(W):
         """
         Check whether the simulation is has not reached its final time.
@@ -1815,16 +3470,13 @@ class World:
             return None
         
         if type(node) is Node:
-            if node in W.NODES:
+            if node.id < len(W.NODES) and W.NODES[node.id] is node:
                 return node
-            else:
-                for n in W.NODES:
-                    if n.name == node.name:
-                        return n
+            elif node.name in W.NODES_NAME_DICT:
+                return W.NODES_NAME_DICT[node.name]
         elif type(node) is str:
-            for n in W.NODES:
-                if n.name == node:
-                    return n
+            if node in W.NODES_NAME_DICT:
+                return W.NODES_NAME_DICT[node]
         raise Exception(f"'{node}' is not Node in this World")
 
     def get_link(W, link):
@@ -1845,18 +3497,28 @@ class World:
             return None
         
         if type(link) is Link:
-            if link in W.LINKS:
+            if link.id < len(W.LINKS) and W.LINKS[link.id] is link:
                 return link
-            else:
-                for l in W.LINKS:
-                    if l.name == link.name:
-                        return l
+            elif link.name in W.LINKS_NAME_DICT:
+                return W.LINKS_NAME_DICT[link.name]
         elif type(link) is str:
-            for l in W.LINKS:
-                if l.name == link:
-                    return l
+            if link in W.LINKS_NAME_DICT:
+                return W.LINKS_NAME_DICT[link]
         raise Exception(f"'{link}' is not Link in this World")
 
+    def get_node_kdtree(W):
+        """
+        Get the KD-tree of the coordinates of the nodes.
+
+        Returns
+        -------
+        scipy.spatial.cKDTree
+            The KD-tree. The index of each point is the id of the node. It is built at the first call and rebuilt after nodes are added.
+        """
+        if W.NODE_KDTREE is None:
+            W.NODE_KDTREE = cKDTree(np.array([[node.x, node.y] for node in W.NODES], dtype=float).reshape(-1, 2))
+        return W.NODE_KDTREE
+
     def get_nearest_node(W, x, y):
         """
         Get the nearest node to the given coordinates.
@@ -1871,16 +3533,61 @@ class World:
         Returns
         -------
         object
-            The nearest Node object.
+            The nearest Node object. None if there are no nodes.
+
+        Notes
+        -----
+        The nearest node is returned however far it is. Older versions returned None if no node was within a distance of 1e5.
+        """
+        if len(W.NODES) == 0:
+            return None
+        return W.NODES[W.get_nearest_nodes(x, y, return_ids=True)[0]]
+
+    def get_nearest_nodes(W, x, y, return_ids=False):
+        """
+        Get the nearest nodes to many coordinates at once.
+
+        Parameters
+        ----------
+        x : array-like of float
+            The x-coordinates.
+        y : array-like of float
+            The y-coordinates.
+        return_ids : bool, optional
+            Whether to return the ids of the nodes instead of the Node objects, default is False.
+
+        Returns
+        -------
+        list of Node | numpy.ndarray
+            The nearest Node objects (or their ids) for the coordinates.
+
+        Notes
+        -----
+        The KD-tree of `get_node_kdtree()` is used. If several nodes are equally near, the one with the smallest id is chosen. The nearest node is returned however far it is.
         """
-        min_dist = 1e10
-        nearest_node = None
-        for node in W.NODES:
-            dist = (node.x-x)**2 + (node.y-y)**2
-            if dist < min_dist:
-                min_dist = dist
-                nearest_node = node
-        return nearest_node
+        x, y = np.broadcast_arrays(np.asarray(x, dtype=float).ravel(), np.asarray(y, dtype=float).ravel())
+        if len(W.NODES) == 0:
+            raise ValueError("no nodes in this World")
+        points = np.column_stack([x, y])
+        tree = W.get_node_kdtree()
+        ids = np.zeros(len(points), dtype=int)
+        remain = np.arange(len(points))
+        k = 2
+        while len(remain):
+            #k近傍の候補から厳密な距離が最小のものを選び，等距離なら最小id．k番目まで等距離の点はkを倍にして再検索
+            k = min(k, len(W.NODES))
+            _, cand = tree.query(points[remain], k=k)
+            cand = cand.reshape(len(remain), k)
+            d2 = (tree.data[cand, 0]-x[remain, None])**2 + (tree.data[cand, 1]-y[remain, None])**2
+            d2min = d2.min(axis=1)
+            ids[remain] = np.where(d2 == d2min[:, None], cand, len(W.NODES)).min(axis=1)
+            if k == len(W.NODES):
+                break
+            remain = remain[d2[:, -1] <= d2min*(1+1e-9)+1e-12]
+            k *= 2
+        if return_ids:
+            return ids
+        return [W.NODES[i] for i in ids.tolist()]
 
     def get_nodes_in_area(W, x, y, r):
         """
@@ -1899,11 +3606,41 @@ class World:
         list
             A list of Node objects in the area.
         """
-        nodes = []
-        for node in W.NODES:
-            if (node.x-x)**2 + (node.y-y)**2 < r**2:
-                nodes.append(node)
-        return nodes
+        return W.get_nodes_in_areas(x, y, r)[0]
+
+    def get_nodes_in_areas(W, x, y, r, return_ids=False):
+        """
+        Get the nodes in many circular areas at once.
+
+        Parameters
+        ----------
+        x : array-like of float
+            The x-coordinates of the centers.
+        y : array-like of float
+            The y-coordinates of the centers.
+        r : array-like of float | float
+            The radii of the areas.
+        return_ids : bool, optional
+            Whether to return the ids of the nodes instead of the Node objects, default is False.
+
+        Returns
+        -------
+        list of list of Node | list of numpy.ndarray
+            The Node objects (or their ids) in each area, in the order of id. A node is in the area if its distance from the center is less than the radius.
+        """
+        x, y, r = np.broadcast_arrays(np.asarray(x, dtype=float).ravel(), np.asarray(y, dtype=float).ravel(), np.asarray(r, dtype=float).ravel())
+        tree = W.get_node_kdtree()
+        #KD木で少し広めに候補を取り，境界上のノードを厳密に判定する
+        candidates = tree.query_ball_point(np.column_stack([x, y]), np.abs(r)*(1+1e-9)+1e-12, return_sorted=True)
+        result = []
+        for i in range(len(x)):
+            c = np.array(candidates[i], dtype=int)
+            ids = c[(tree.data[c, 0]-x[i])**2 + (tree.data[c, 1]-y[i])**2 < r[i]**2]
+            if return_ids:
+                result.append(ids)
+            else:
+                result.append([W.NODES[j] for j in ids.tolist()])
+        return result
 
     def load_scenario_from_csv(W, fname_node, fname_link, fname_demand, tmax=None):
         """
@@ -1936,11 +3673,9 @@ class World:
         fname : str
             The file name of the CSV file containing node data.
         """
-
-        with open(fname) as f:
-            for r in csv.reader(f):
-                if r[1] != "x":
-                    W.addNode(r[0], float(r[1]), float(r[2]))
+        df = read_scenario_csv(fname, 1, "x")
+        for name, x, y in zip(df[0].tolist(), df[1].astype(float).tolist(), df[2].astype(float).tolist()):
+            W.addNode(name, x, y)
 
     def generate_Links_from_csv(W, fname):
         """
@@ -1951,11 +3686,10 @@ class World:
         fname : str
             The file name of the CSV file containing link data.
         """
-
-        with open(fname) as f:
-            for r in csv.reader(f):
-                if r[3] != "length":
-                    W.addLink(r[0], r[1], r[2], length=float(r[3]), free_flow_speed=float(r[4]), jam_density=float(r[5]), merge_priority=float(r[6]))
+        df = read_scenario_csv(fname, 3, "length")
+        values = df[[3, 4, 5, 6]].astype(float).to_numpy().tolist()
+        for name, start, end, (length, u, kappa, merge_priority) in zip(df[0].tolist(), df[1].tolist(), df[2].tolist(), values):
+            W.addLink(name, start, end, length=length, free_flow_speed=u, jam_density=kappa, merge_priority=merge_priority)
 
     def generate_demand_from_csv(W, fname):
         """
@@ -1964,15 +3698,183 @@ class World:
         Parameters
         ----------
         fname : str
-            The file name of the CSV file containing demand data.
+            The file name of the CSV file containing demand data. The columns are origin, destination, start time, end time, flow, and optionally volume. If the volume is not a number, the flow is used.
+        """
+        df = read_scenario_csv(fname, 2, "start_t")
+        if 5 in df.columns:
+            volume = pd.to_numeric(df[5], errors="coerce").fillna(-1).to_numpy(dtype=float)
+        else:
+            volume = -1
+        W.adddemand_bulk(df[0].tolist(), df[1].tolist(), df[2].to_numpy(dtype=float), df[3].to_numpy(dtype=float), df[4].to_numpy(dtype=float), volume)
+
+    def save_scenario(W, fname, compress=0):
+        """
+        Save the scenario (nodes, links, and vehicles) to a binary file, so that it can be loaded quickly by `load_scenario()`.
+
+        Parameters
+        ----------
+        fname : str
+            The file name. It is a NumPy .npz file.
+        compress : bool, optional
+            Whether to compress the file, default is 0.
+
+        Notes
+        -----
+        The file consists of the arrays of the attributes of nodes, links, and vehicles, and a small JSON header with the format version and the global parameters.
+        The vehicles are saved with their origins, destinations, departure times, colors, modes, and preferred/avoided links. Vehicles that are not created yet by `lazy_vehicle_creation` are saved without creating them. User-defined `attribute` of links and vehicles cannot be stored in the file and is dropped with a warning. The progress of the simulation is not saved; use `save_checkpoint()` for it.
+        """
+        d = {}
+        header = {
+            "format": "uxsim_scenario",
+            "version": 1,
+            "name": W.name,
+            "DELTAT": W.DELTAT,
+            "DELTAN": W.DELTAN,
+            "TMAX": W.TMAX,
+        }
+        d["header"] = np.array(json.dumps(header))
+
+        def nan_if_none(v):
+            return np.nan if v == None else v
+
+        #ノード
+        d["node_name"] = np.array([n.name for n in W.NODES], dtype=str)
+        d["node_x"] = np.array([n.x for n in W.NODES], dtype=float)
+        d["node_y"] = np.array([n.y for n in W.NODES], dtype=float)
+        d["node_signal"], d["node_signal_offsets"] = ragged_to_flat([n.signal for n in W.NODES], dtype=float)
+        d["node_signal_offset"] = np.array([n.signal_offset for n in W.NODES], dtype=float)
+        d["node_flow_capacity"] = np.array([nan_if_none(n.flow_capacity) for n in W.NODES], dtype=float)
+        d["node_lanes"] = np.array([np.nan if n.flag_lanes_automatically_determined else nan_if_none(n.lanes) for n in W.NODES], dtype=float)
+
+        #リンク
+        d["link_name"] = np.array([l.name for l in W.LINKS], dtype=str)
+        d["link_start_node"] = np.array([l.start_node.id for l in W.LINKS], dtype=int)
+        d["link_end_node"] = np.array([l.end_node.id for l in W.LINKS], dtype=int)
+        for key in ["length", "u", "kappa", "merge_priority", "capacity_out", "eular_dx"]:
+            d["link_"+key] = np.array([getattr(l, key) for l in W.LINKS], dtype=float)
+        d["link_lanes"] = np.array([l.lanes for l in W.LINKS], dtype=int)
+        d["link_capacity_in"] = np.array([np.nan if l.capacity_in == 10e10 else l.capacity_in for l in W.LINKS], dtype=float)
+        d["link_signal_group"], d["link_signal_group_offsets"] = ragged_to_flat([l.signal_group for l in W.LINKS], dtype=int)
+
+        #車両．未生成の車両はスケジューラの配列から直接保存する
+        if W.lazy_vehicle_creation:
+            slots = W.VEHICLES.slots
+        else:
+            slots = list(W.VEHICLES.values())
+        num = len(slots)
+        created = [i for i in range(num) if slots[i] is not None]
+        vehs = [slots[i] for i in created]
+        name = np.array([str(i) for i in range(num)], dtype=object)
+        orig = np.zeros(num, dtype=int)
+        dest = np.zeros(num, dtype=int)
+        departure_time = np.zeros(num, dtype=int)
+        color = np.zeros([num, 3])
+        name[created] = [veh.name for veh in vehs]
+        orig[created] = [veh.orig.id for veh in vehs]
+        dest[created] = [-1 if veh.dest == None else veh.dest.id for veh in vehs]
+        departure_time[created] = [veh.departure_time for veh in vehs]
+        if len(vehs):
+            color[created] = [veh.color for veh in vehs]
+        for p in W.DEPARTURE_SCHEDULER.pending:
+            ids = p["id"] + np.nonzero(~p["created"])[0]
+            orig[ids] = p["orig"][ids-p["id"]]
+            dest[ids] = p["dest"][ids-p["id"]]
+            departure_time[ids] = p["departure_time"][ids-p["id"]]
+            color[ids] = p["color"][ids-p["id"]]
+        d["vehicle_name"] = name.astype(str)
+        d["vehicle_orig"] = orig
+        d["vehicle_dest"] = dest
+        d["vehicle_departure_time"] = departure_time
+        d["vehicle_color"] = color
+        #既定値と異なる設定は生成済みの車両にしかない
+        d["vehicle_created"] = np.array(created, dtype=int)
+        d["vehicle_mode"] = np.array([veh.mode for veh in vehs], dtype=str)
+        d["vehicle_route_choice_principle"] = np.array([veh.route_choice_principle for veh in vehs], dtype=str)
+        d["vehicle_trip_abort"] = np.array([veh.trip_abort for veh in vehs], dtype=int)
+        d["vehicle_links_prefer"], d["vehicle_links_prefer_offsets"] = ragged_to_flat([[l.id for l in veh.links_prefer] for veh in vehs], dtype=int)
+        d["vehicle_links_avoid"], d["vehicle_links_avoid_offsets"] = ragged_to_flat([[l.id for l in veh.links_avoid] for veh in vehs], dtype=int)
+
+        #attributeは任意のオブジェクトなので保存できない
+        num_link_attr = sum(1 for l in W.LINKS if l.attribute is not None)
+        num_veh_attr = sum(1 for veh in vehs if veh.attribute is not None) + sum(int((~p["created"]).sum()) for p in W.DEPARTURE_SCHEDULER.pending if p["attribute"] is not None)
+        if num_link_attr or num_veh_attr:
+            warnings.warn(f"save_scenario: `attribute` of {num_link_attr} links and {num_veh_attr} vehicles is not saved.", UserWarning)
+
+        if compress:
+            np.savez_compressed(fname, **d)
+        else:
+            np.savez(fname, **d)
+
+    def load_scenario(W, fname):
+        """
+        Load a scenario from a file saved by `save_scenario()`.
+
+        Parameters
+        ----------
+        fname : str
+            The file name.
+
+        Notes
+        -----
+        The nodes, links, and vehicles are added to this World, as `load_scenario_from_csv()` does. The platoon size and the timestep width of this World must be the same as the saved one.
+        If `lazy_vehicle_creation` is enabled, the vehicles with the default settings are registered to the departure scheduler without creating them.
+        If `tmax` is not specified for this World, that of the saved World is used.
         """
-        with open(fname) as f:
-            for r in csv.reader(f):
-                if r[2] != "start_t":
-                    try:
-                        W.adddemand(r[0], r[1], float(r[2]), float(r[3]), float(r[4]), float(r[5]))
-                    except:
-                        W.adddemand(r[0], r[1], float(r[2]), float(r[3]), float(r[4]))
+        with np.load(fname, allow_pickle=False) as npz:
+            d = {key: npz[key] for key in npz.files}
+        header = json.loads(d["header"].item())
+        if header.get("format") != "uxsim_scenario":
+            raise ValueError(f"load_scenario error: {fname} is not a scenario file saved by save_scenario")
+        if header["DELTAT"] != W.DELTAT or header["DELTAN"] != W.DELTAN:
+            raise ValueError(f"load_scenario error: DELTAT or DELTAN of the scenario ({header['DELTAT']}, {header['DELTAN']}) is different from this World ({W.DELTAT}, {W.DELTAN})")
+
+        def none_if_nan(v):
+            return None if np.isnan(v) else v
+
+        #ノード
+        nodes = []
+        signals = flat_to_ragged(d["node_signal"], d["node_signal_offsets"])
+        lanes = [none_if_nan(v) for v in d["node_lanes"].tolist()]
+        for i, (name, x, y, signal_offset, flow_capacity) in enumerate(zip(d["node_name"].tolist(), d["node_x"].tolist(), d["node_y"].tolist(), d["node_signal_offset"].tolist(), d["node_flow_capacity"].tolist())):
+            nodes.append(Node(W, name, x, y, signal=signals[i], signal_offset=signal_offset, flow_capacity=none_if_nan(flow_capacity), number_of_lanes=None if lanes[i] == None else int(lanes[i])))
+
+        #リンク
+        links = []
+        signal_groups = flat_to_ragged(d["link_signal_group"], d["link_signal_group_offsets"])
+        columns = [d["link_"+key].tolist() for key in ["name", "start_node", "end_node", "length", "u", "kappa", "lanes", "merge_priority", "capacity_out", "capacity_in", "eular_dx"]]
+        for i, (name, start, end, length, u, kappa, lanes, merge_priority, capacity_out, capacity_in, eular_dx) in enumerate(zip(*columns)):
+            links.append(Link(W, name, nodes[start], nodes[end], length, free_flow_speed=u, jam_density=kappa, number_of_lanes=lanes, merge_priority=merge_priority, signal_group=signal_groups[i], capacity_out=capacity_out, capacity_in=none_if_nan(capacity_in), eular_dx=eular_dx))
+
+        #車両
+        num = len(d["vehicle_name"])
+        created = d["vehicle_created"]
+        node_ids = np.array([n.id for n in nodes], dtype=int)
+        default = np.ones(num, dtype=bool)
+        default[created] = (d["vehicle_mode"] == "single_trip") & (d["vehicle_route_choice_principle"] == W.route_choice_principle) & (d["vehicle_trip_abort"] == 1) & (np.diff(d["vehicle_links_prefer_offsets"]) == 0) & (np.diff(d["vehicle_links_avoid_offsets"]) == 0) & (d["vehicle_dest"][created] >= 0)
+        settings = {}
+        prefer = flat_to_ragged(d["vehicle_links_prefer"], d["vehicle_links_prefer_offsets"])
+        avoid = flat_to_ragged(d["vehicle_links_avoid"], d["vehicle_links_avoid_offsets"])
+        for k, i in enumerate(created.tolist()):
+            if not default[i]:
+                settings[i] = dict(route_choice_principle=d["vehicle_route_choice_principle"][k].item(), mode=d["vehicle_mode"][k].item(), trip_abort=d["vehicle_trip_abort"][k].item(), links_prefer=[links[j] for j in prefer[k]], links_avoid=[links[j] for j in avoid[k]])
+        if W.lazy_vehicle_creation and W.route_choice_principle == "homogeneous_DUO":
+            #既定の設定で既定の名前の車両は生成せずに登録する
+            lazy = default & (d["vehicle_name"] == np.arange(len(W.VEHICLES), len(W.VEHICLES)+num).astype(str))
+        else:
+            lazy = np.zeros(num, dtype=bool)
+        bounds = np.concatenate([[0], np.nonzero(np.diff(lazy))[0]+1, [num]]).tolist()
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            if start == end:
+                continue
+            if lazy[start]:
+                vehicle_id = W.VEHICLES.reserve(end-start)
+                W.DEPARTURE_SCHEDULER.add_pending(vehicle_id, node_ids[d["vehicle_orig"][start:end]], node_ids[d["vehicle_dest"][start:end]], d["vehicle_departure_time"][start:end], d["vehicle_color"][start:end])
+                continue
+            for i, (name, orig, dest, departure_time, color) in enumerate(zip(d["vehicle_name"][start:end].tolist(), d["vehicle_orig"][start:end].tolist(), d["vehicle_dest"][start:end].tolist(), d["vehicle_departure_time"][start:end].tolist(), d["vehicle_color"][start:end].tolist()), start):
+                Vehicle(W, nodes[orig], None if dest < 0 else nodes[dest], departure_time, name=name, departure_time_is_time_step=1, color=tuple(color), **settings.get(i, {}))
+
+        if W.TMAX == None and header["TMAX"] != None:
+            W.TMAX = header["TMAX"]
 
     def on_time(W, time):
         """
@@ -2048,6 +3950,485 @@ class World:
         """
         return pickle.loads(pickle.dumps(W))
 
+    def save_checkpoint(W, fname, compress=0):
+        """
+        Save the current dynamic state of the simulation to a file as NumPy arrays (.npz).
+
+        Parameters
+        ----------
+        fname : str
+            The file name. ".npz" is appended if it does not end with it.
+        compress : int, optional
+            Whether to compress the file, default is 0 (disabled, faster).
+
+        Notes
+        -----
+        Only the dynamic state is saved as arrays: the states, positions, and logs of vehicles, vehicle queues of links and nodes, cumulative counts and travel times of links, signal phases, route choice tables, the simulation clock, and the states of `random` and `numpy.random`.
+        It is much smaller and faster than pickling the whole World by `copy()`. The static network and functions such as `Vehicle.node_event` are not saved.
+        The checkpoint can be saved between `exec_simulation()` calls (e.g., after `exec_simulation(until_t=...)`), and restored by `load_checkpoint()` to a World with the same network, typically created by the same script.
+        With `lazy_vehicle_creation`, the vehicles that are not created yet are saved as the arrays of the departure scheduler without creating them.
+        With `vehicle_log_tolerance`, the pending rows of the log compression are stored as breakpoints before saving.
+        """
+        if W.finalized == 0:
+            raise Exception("save_checkpoint error: the scenario is not finalized yet. Run exec_simulation() first.")
+
+        #未生成の車両は作らず，下でスケジューラの配列を保存する．車両idは復元後の添字
+        if W.lazy_vehicle_creation:
+            vehs = W.VEHICLES.created()
+            veh_ids = [veh.id for veh in vehs]
+        else:
+            vehs = list(W.VEHICLES.values())
+            veh_ids = list(range(len(vehs)))
+        index = {veh:i for i,veh in enumerate(vehs)}
+        def vix(veh):
+            return index[veh] if veh != None else -1
+        def lix(link):
+            return link.id if link != None else -1
+        def nix(node):
+            return node.id if node != None else -1
+        def nan_if_none(value):
+            return value if value != None else np.nan
+
+        d = {}
+
+        #World
+        d["T"] = W.T
+        d["TIME"] = W.TIME
+        d["TMAX"] = W.TMAX
+        d["DELTAT"] = W.DELTAT
+        d["DELTAN"] = W.DELTAN
+        d["route_search_method"] = W.route_search_method
+        d["vehicle_log_tolerance"] = np.nan if W.vehicle_log_tolerance == None else W.vehicle_log_tolerance
+        d["average_speed"] = W.analyzer.average_speed
+        d["average_speed_count"] = W.analyzer.average_speed_count
+
+        #車両
+        route_pref_rows = {id(pref):k for k,pref in W.ROUTECHOICE.route_pref.items()}
+        route_pref_kind = []
+        route_pref_row = []
+        route_pref_dicts = []
+        for veh in vehs:
+            if veh.route_pref is None:
+                route_pref_kind.append(0)
+                route_pref_row.append(-1)
+            elif id(veh.route_pref) in route_pref_rows:
+                route_pref_kind.append(1)
+                route_pref_row.append(route_pref_rows[id(veh.route_pref)])
+            else:
+                route_pref_kind.append(2)
+                route_pref_row.append(len(route_pref_dicts))
+                route_pref_dicts.append(veh.route_pref)
+
+        d["num_vehicles"] = len(W.VEHICLES)
+        d["veh_id"] = np.array(veh_ids, dtype=int)
+        d["veh_name"] = np.array([veh.name for veh in vehs], dtype=str)
+        d["veh_orig"] = np.array([nix(veh.orig) for veh in vehs], dtype=int)
+        d["veh_dest"] = np.array([nix(veh.dest) for veh in vehs], dtype=int)
+        d["veh_departure_time"] = np.array([veh.departure_time for veh in vehs])
+        d["veh_arrival_time"] = np.array([veh.arrival_time for veh in vehs])
+        d["veh_travel_time"] = np.array([veh.travel_time for veh in vehs])
+        d["veh_link_arrival_time"] = np.array([veh.link_arrival_time for veh in vehs])
+        d["veh_state"] = np.array([VEHICLE_STATES.index(veh.state) for veh in vehs], dtype=int)
+        d["veh_link"] = np.array([lix(veh.link) for veh in vehs], dtype=int)
+        d["veh_x"] = np.array([veh.x for veh in vehs], dtype=float)
+        d["veh_x_next"] = np.array([veh.x_next for veh in vehs], dtype=float)
+        d["veh_x_old"] = np.array([veh.x_old for veh in vehs], dtype=float)
+        d["veh_v"] = np.array([veh.v for veh in vehs], dtype=float)
+        d["veh_move_remain"] = np.array([veh.move_remain for veh in vehs], dtype=float)
+        d["veh_lane"] = np.array([veh.lane for veh in vehs], dtype=int)
+        d["veh_leader"] = np.array([vix(veh.leader) for veh in vehs], dtype=int)
+        d["veh_follower"] = np.array([vix(veh.follower) for veh in vehs], dtype=int)
+        d["veh_route_next_link"] = np.array([lix(getattr(veh, "route_next_link", None)) for veh in vehs], dtype=int)
+        d["veh_flag_waiting_for_trip_end"] = np.array([veh.flag_waiting_for_trip_end for veh in vehs], dtype=int)
+        d["veh_flag_trip_aborted"] = np.array([veh.flag_trip_aborted for veh in vehs], dtype=int)
+        d["veh_trip_abort"] = np.array([veh.trip_abort for veh in vehs], dtype=int)
+        d["veh_mode"] = np.array([veh.mode for veh in vehs], dtype=str)
+        d["veh_route_choice_principle"] = np.array([veh.route_choice_principle for veh in vehs], dtype=str)
+        d["veh_color"] = np.array([veh.color for veh in vehs], dtype=float).reshape(-1, 3)
+        d["veh_log_home_start"] = np.array([veh.log_home_start for veh in vehs], dtype=int)
+        d["veh_route_pref_kind"] = np.array(route_pref_kind, dtype=int)
+        d["veh_route_pref_row"] = np.array(route_pref_row, dtype=int)
+        d["veh_route_pref_links"], d["veh_route_pref_offsets"] = ragged_to_flat([[l.id if type(l) is Link else W.get_link(l).id for l in pref.keys()] for pref in route_pref_dicts], dtype=int)
+        d["veh_route_pref_values"], _ = ragged_to_flat([list(pref.values()) for pref in route_pref_dicts], dtype=float)
+        d["veh_dest_list"], d["veh_dest_list_offsets"] = ragged_to_flat([[nix(n) for n in veh.dest_list] for veh in vehs], dtype=int)
+        d["veh_links_prefer"], d["veh_links_prefer_offsets"] = ragged_to_flat([[l.id for l in veh.links_prefer] for veh in vehs], dtype=int)
+        d["veh_links_avoid"], d["veh_links_avoid_offsets"] = ragged_to_flat([[l.id for l in veh.links_avoid] for veh in vehs], dtype=int)
+
+        #車両ログ．列はそのまま保存し，車両idのみ復元後のidに直す．圧縮の保留中の行はブレークポイントにする
+        W.VEHICLE_LOGS.flush()
+        veh_index = np.zeros(max([veh.id for veh in vehs], default=-1)+1, dtype=np.int32)
+        veh_index[[veh.id for veh in vehs]] = veh_ids
+        for key in VehicleLogStore.COLUMNS:
+            d["log_"+key] = W.VEHICLE_LOGS.column(key)
+        d["log_veh"] = veh_index[d["log_veh"]]
+        #log_t_linkのリンクはid，"home"は-1，"end"は-2
+        d["veh_log_t_link_t"], d["veh_log_t_link_offsets"] = ragged_to_flat([[tl[0] for tl in veh.log_t_link] for veh in vehs])
+        d["veh_log_t_link_link"], _ = ragged_to_flat([[{"home":-1, "end":-2}[tl[1]] if type(tl[1]) is str else tl[1].id for tl in veh.log_t_link] for veh in vehs], dtype=int)
+
+        #車両の集合
+        d["vehicles_living"] = np.array([index[veh] for veh in W.VEHICLES_LIVING.values()], dtype=int)
+        d["vehicles_running"] = np.array([index[veh] for veh in W.VEHICLES_RUNNING.values()], dtype=int)
+        d["vehicles_active"] = np.array([index[veh] for veh in W.VEHICLES_ACTIVE.values()], dtype=int)
+        d["vehicles_scheduled"] = np.array([index[veh] for veh in W.DEPARTURE_SCHEDULER.vehicles()], dtype=int)
+
+        #未生成の車両．全車両が生成済みのpendingは不要
+        pending = [p for p in W.DEPARTURE_SCHEDULER.pending if not p["created"].all()]
+        d["pending_id"] = np.array([p["id"] for p in pending], dtype=int)
+        d["pending_log_home_start"] = np.array([p["log_home_start"] for p in pending], dtype=int)
+        d["pending_mergeable"] = np.array([p["mergeable"] for p in pending], dtype=bool)
+        d["pending_cursor"] = np.array([p["cursor"] for p in pending], dtype=int)
+        d["pending_offsets"] = np.concatenate([[0], np.cumsum([len(p["dest"]) for p in pending], dtype=int)])
+        for key, empty in [("orig", np.zeros(0, dtype=np.int32)), ("dest", np.zeros(0, dtype=np.int32)), ("departure_time", np.zeros(0, dtype=np.int64)), ("created", np.zeros(0, dtype=bool)), ("color", np.zeros([0, 3]))]:
+            d["pending_"+key] = np.concatenate([p[key] for p in pending]) if len(pending) else empty
+
+        #ノード
+        d["node_name"] = np.array([n.name for n in W.NODES], dtype=str)
+        d["node_signal"], d["node_signal_offsets"] = ragged_to_flat([n.signal for n in W.NODES], dtype=float)
+        d["node_signal_phase"] = np.array([n.signal_phase for n in W.NODES], dtype=int)
+        d["node_signal_t"] = np.array([n.signal_t for n in W.NODES], dtype=float)
+        d["node_signal_log"], d["node_signal_log_offsets"] = ragged_to_flat([n.signal_log for n in W.NODES], dtype=int)
+        d["node_flow_capacity"] = np.array([nan_if_none(n.flow_capacity) for n in W.NODES], dtype=float)
+        d["node_flow_capacity_remain"] = np.array([n.flow_capacity_remain for n in W.NODES], dtype=float)
+        d["node_generation_queue"], d["node_generation_queue_offsets"] = ragged_to_flat([[index[veh] for veh in n.generation_queue] for n in W.NODES], dtype=int)
+        d["node_incoming_vehicles"], d["node_incoming_vehicles_offsets"] = ragged_to_flat([[index[veh] for veh in n.incoming_vehicles] for n in W.NODES], dtype=int)
+
+        #リンク
+        d["link_name"] = np.array([l.name for l in W.LINKS], dtype=str)
+        d["link_vehicles"], d["link_vehicles_offsets"] = ragged_to_flat([[index[veh] for veh in l.vehicles] for l in W.LINKS], dtype=int)
+        for key in LINK_CHECKPOINT_ATTRIBUTES:
+            d["link_"+key] = np.array([nan_if_none(getattr(l, key)) for l in W.LINKS], dtype=float)
+        d["link_vehicles_slow_count"] = np.array([l._vehicles_slow_count for l in W.LINKS], dtype=int)
+        d["link_tsize_recorded"] = np.array([l._tsize_recorded for l in W.LINKS], dtype=int)
+        d["link_cum_arrival"] = np.array([l._cum_arrival for l in W.LINKS]).reshape(len(W.LINKS), -1)
+        d["link_cum_departure"] = np.array([l._cum_departure for l in W.LINKS]).reshape(len(W.LINKS), -1)
+        d["link_traveltime_instant"] = np.array([l._traveltime_instant for l in W.LINKS], dtype=float).reshape(len(W.LINKS), -1)
+        d["link_traveltime_actual"] = np.array([l._traveltime_actual for l in W.LINKS], dtype=float).reshape(len(W.LINKS), -1)
+        d["link_traveltime_actual_records_t"], d["link_traveltime_actual_records_offsets"] = ragged_to_flat([[r[0] for r in l._traveltime_actual_records] for l in W.LINKS], dtype=int)
+        d["link_traveltime_actual_records_tt"], _ = ragged_to_flat([[r[1] for r in l._traveltime_actual_records] for l in W.LINKS], dtype=float)
+        d["link_traveltime_actual_records_applied"] = np.array([l._traveltime_actual_records_applied for l in W.LINKS], dtype=int)
+        if W.edie_state_online:
+            d["link_tn_mat"], d["link_edie_offsets"] = ragged_to_flat([l.tn_mat.ravel() for l in W.LINKS], dtype=float)
+            d["link_dn_mat"], _ = ragged_to_flat([l.dn_mat.ravel() for l in W.LINKS], dtype=float)
+
+        #経路選択
+        d["rc_next"] = W.ROUTECHOICE.next
+        d["rc_dist"] = W.ROUTECHOICE.dist
+        d["rc_route_pref_mat"] = W.ROUTECHOICE.route_pref_mat
+        d["rc_searched"] = W.ROUTECHOICE.searched
+        d["rc_dest_index"] = W.ROUTECHOICE.dest_index
+        d["rc_route_search_log"] = np.array(W.ROUTECHOICE.route_search_log, dtype=float).reshape(-1, 3)
+        for key in ["adj_mat_time", "pred", "tts_ref", "ijs", "tts_last"]:
+            if getattr(W.ROUTECHOICE, key) is not None:
+                d["rc_"+key] = getattr(W.ROUTECHOICE, key)
+
+        #乱数の状態
+        random_state = random.getstate()
+        d["random_version"] = random_state[0]
+        d["random_state"] = np.array(random_state[1], dtype=np.uint32)
+        d["random_gauss_next"] = nan_if_none(random_state[2])
+        np_random_state = np.random.get_state()
+        d["np_random_keys"] = np_random_state[1]
+        d["np_random_pos"] = np_random_state[2]
+        d["np_random_has_gauss"] = np_random_state[3]
+        d["np_random_cached_gaussian"] = np_random_state[4]
+
+        if compress:
+            np.savez_compressed(fname, **d)
+        else:
+            np.savez(fname, **d)
+
+    def load_checkpoint(W, fname):
+        """
+        Restore the dynamic state of the simulation from a file saved by `save_checkpoint()`.
+
+        Parameters
+        ----------
+        fname : str
+            The file name.
+
+        Notes
+        -----
+        This World must have the same nodes and links as the saved one, typically it is created by the same script. If it is not finalized yet, it is finalized here.
+        Vehicles are matched by their names. Vehicles that are in the checkpoint but not in this World (e.g., added during the simulation) are created, and vehicles that are not in the checkpoint are removed. User-defined attributes and `node_event` of the existing vehicles are kept.
+        With `lazy_vehicle_creation`, the vehicles that were not created yet are restored without creating them, and they take the attributes of the vehicles with the same ids in this World.
+        After loading, `exec_simulation()` continues the simulation from the saved time, and the results are identical to those of the original run.
+        """
+        with np.load(fname, allow_pickle=False) as npz:
+            d = {key: npz[key] for key in npz.files}
+
+        if d["node_name"].tolist() != [n.name for n in W.NODES] or d["link_name"].tolist() != [l.name for l in W.LINKS]:
+            raise ValueError("load_checkpoint error: the nodes or links of the checkpoint are different from this World")
+        if d["DELTAT"].item() != W.DELTAT or d["DELTAN"].item() != W.DELTAN:
+            raise ValueError(f"load_checkpoint error: DELTAT or DELTAN of the checkpoint ({d['DELTAT'].item()}, {d['DELTAN'].item()}) is different from this World ({W.DELTAT}, {W.DELTAN})")
+        if d["route_search_method"].item() != W.route_search_method:
+            raise ValueError(f"load_checkpoint error: route_search_method of the checkpoint ('{d['route_search_method'].item()}') is different from this World ('{W.route_search_method}')")
+        if W.edie_state_online and "link_tn_mat" not in d:
+            raise ValueError("load_checkpoint error: edie_state_online is enabled in this World but the checkpoint does not have the accumulated Edie's states")
+        if (W.vehicle_log_tolerance == None) != np.isnan(d["vehicle_log_tolerance"].item()):
+            raise ValueError("load_checkpoint error: vehicle_log_tolerance of the checkpoint is different from this World (compressed and uncompressed logs cannot be mixed)")
+        if W.finalized == 0:
+            if W.TMAX == None:
+                W.TMAX = d["TMAX"].item()
+            if W.TMAX == d["TMAX"].item():
+                W.finalize_scenario()
+        if W.TMAX != d["TMAX"].item():
+            raise ValueError(f"load_checkpoint error: TMAX of the checkpoint ({d['TMAX'].item()}) is different from this World ({W.TMAX})")
+
+        #車両．名前で対応付け，無ければ作る
+        names = d["veh_name"].tolist()
+        orig = d["veh_orig"].tolist()
+        dest = d["veh_dest"].tolist()
+        departure_time = d["veh_departure_time"].tolist()
+        mode = d["veh_mode"].tolist()
+        route_choice_principle = d["veh_route_choice_principle"].tolist()
+        trip_abort = d["veh_trip_abort"].tolist()
+        veh_ids = d["veh_id"].tolist()
+        if len(d["pending_id"]) and not W.lazy_vehicle_creation:
+            raise ValueError("load_checkpoint error: the checkpoint has vehicles that are not created yet. Enable lazy_vehicle_creation of this World.")
+        vehs = []
+        if W.lazy_vehicle_creation:
+            #既存の未生成の車両は作らない．保存時のidの位置に置き直す
+            vehicles_old = W.VEHICLES
+            scheduler_old = W.DEPARTURE_SCHEDULER
+            def pending_attribute(vehicle_id):
+                #attributeは保存されないので，このWorldの同じidの未生成の車両のものを使う
+                j = bisect.bisect_right(scheduler_old.pending_start, vehicle_id)-1
+                if j >= 0 and vehicle_id < scheduler_old.pending_start[j]+len(scheduler_old.pending[j]["dest"]):
+                    return scheduler_old.pending[j]["attribute"]
+                return None
+            W.VEHICLES = LazyVehicleDict(W)
+            W.VEHICLES.slots = [None]*d["num_vehicles"].item()
+            for i,name in enumerate(names):
+                j = vehicles_old._id(name)
+                if j != None and vehicles_old.slots[j] is not None:
+                    vehs.append(vehicles_old.slots[j])
+                    W.VEHICLES.slots[veh_ids[i]] = vehs[-1]
+                else:
+                    vehs.append(Vehicle(W, W.NODES[orig[i]], W.NODES[dest[i]] if dest[i] >= 0 else None, departure_time[i], name=name, route_choice_principle=route_choice_principle[i], mode=mode[i], trip_abort=trip_abort[i], departure_time_is_time_step=1, attribute=pending_attribute(veh_ids[i]) if j != None else None, vehicle_id=veh_ids[i]))
+            W.VEHICLES.index = {veh.name:veh_ids[i] for i,veh in enumerate(vehs)}
+        else:
+            for i,name in enumerate(names):
+                if name in W.VEHICLES:
+                    vehs.append(W.VEHICLES[name])
+                else:
+                    vehs.append(Vehicle(W, W.NODES[orig[i]], W.NODES[dest[i]] if dest[i] >= 0 else None, departure_time[i], name=name, route_choice_principle=route_choice_principle[i], mode=mode[i], trip_abort=trip_abort[i], departure_time_is_time_step=1))
+            W.VEHICLES = OrderedDict((veh.name, veh) for veh in vehs)
+
+        def veh_or_none(i):
+            return vehs[i] if i >= 0 else None
+        def link_or_none(i):
+            return W.LINKS[i] if i >= 0 else None
+        def node_or_none(i):
+            return W.NODES[i] if i >= 0 else None
+        def none_if_nan(value):
+            return value if not math.isnan(value) else None
+
+        columns = {key[4:]: d[key].tolist() for key in d if key.startswith("veh_") and key[4:] in [
+            "arrival_time", "travel_time", "link_arrival_time", "state", "link", "x", "x_next", "x_old", "v", "move_remain", "lane", "leader", "follower", "route_next_link", "flag_waiting_for_trip_end", "flag_trip_aborted", "color", "log_home_start", "route_pref_kind", "route_pref_row"]}
+        route_pref_links = flat_to_ragged(d["veh_route_pref_links"], d["veh_route_pref_offsets"])
+        route_pref_values = flat_to_ragged(d["veh_route_pref_values"], d["veh_route_pref_offsets"])
+        dest_list = flat_to_ragged(d["veh_dest_list"], d["veh_dest_list_offsets"])
+        links_prefer = flat_to_ragged(d["veh_links_prefer"], d["veh_links_prefer_offsets"])
+        links_avoid = flat_to_ragged(d["veh_links_avoid"], d["veh_links_avoid_offsets"])
+        log_t_link_t = flat_to_ragged(d["veh_log_t_link_t"], d["veh_log_t_link_offsets"])
+        log_t_link_link = flat_to_ragged(d["veh_log_t_link_link"], d["veh_log_t_link_offsets"])
+        log_t_link_codes = {-1:"home", -2:"end"}
+
+        for i,veh in enumerate(vehs):
+            veh.id = veh_ids[i]
+            veh.orig = W.NODES[orig[i]]
+            veh.dest = node_or_none(dest[i])
+            veh.departure_time = departure_time[i]
+            veh.arrival_time = columns["arrival_time"][i]
+            veh.travel_time = columns["travel_time"][i]
+            veh.link_arrival_time = columns["link_arrival_time"][i]
+            veh.state = VEHICLE_STATES[columns["state"][i]]
+            veh.link = link_or_none(columns["link"][i])
+            veh.x = columns["x"][i]
+            veh.x_next = columns["x_next"][i]
+            veh.x_old = columns["x_old"][i]
+            veh.v = columns["v"][i]
+            veh.move_remain = columns["move_remain"][i]
+            veh.lane = columns["lane"][i]
+            veh.leader = veh_or_none(columns["leader"][i])
+            veh.follower = veh_or_none(columns["follower"][i])
+            veh.route_next_link = link_or_none(columns["route_next_link"][i])
+            veh.flag_waiting_for_trip_end = columns["flag_waiting_for_trip_end"][i]
+            veh.flag_trip_aborted = columns["flag_trip_aborted"][i]
+            veh.trip_abort = trip_abort[i]
+            veh.mode = mode[i]
+            veh.route_choice_principle = route_choice_principle[i]
+            veh.color = tuple(columns["color"][i])
+            veh.log_home_start = columns["log_home_start"][i]
+            if columns["route_pref_kind"][i] == 0:
+                veh.route_pref = None
+            elif columns["route_pref_kind"][i] == 1:
+                veh.route_pref = W.ROUTECHOICE.route_pref[columns["route_pref_row"][i]]
+            else:
+                j = columns["route_pref_row"][i]
+                veh.route_pref = {W.LINKS[l]:v for l,v in zip(route_pref_links[j], route_pref_values[j])}
+            veh.dest_list = [W.NODES[n] for n in dest_list[i]]
+            veh.links_prefer = [W.LINKS[l] for l in links_prefer[i]]
+            veh.links_avoid = [W.LINKS[l] for l in links_avoid[i]]
+            veh.log_t_link = [[t, log_t_link_codes[l] if l < 0 else W.LINKS[l]] for t,l in zip(log_t_link_t[i], log_t_link_link[i])]
+
+        W.VEHICLES_LIVING = OrderedDict((vehs[i].name, vehs[i]) for i in d["vehicles_living"].tolist())
+        W.VEHICLES_RUNNING = OrderedDict((vehs[i].name, vehs[i]) for i in d["vehicles_running"].tolist())
+        W.VEHICLES_ACTIVE = OrderedDict((vehs[i].name, vehs[i]) for i in d["vehicles_active"].tolist())
+        W.DEPARTURE_SCHEDULER = DepartureScheduler(W)
+        for i in d["vehicles_scheduled"].tolist():
+            W.DEPARTURE_SCHEDULER.add(vehs[i])
+        offsets = d["pending_offsets"].tolist()
+        for k,vehicle_id in enumerate(d["pending_id"].tolist()):
+            a, b = offsets[k], offsets[k+1]
+            W.DEPARTURE_SCHEDULER.restore_pending(vehicle_id, d["pending_orig"][a:b], d["pending_dest"][a:b], d["pending_departure_time"][a:b], d["pending_color"][a:b], d["pending_created"][a:b].copy(), pending_attribute(vehicle_id), d["pending_log_home_start"][k].item(), d["pending_mergeable"][k].item(), d["pending_cursor"][k].item())
+        W.VEHICLE_LOGS = VehicleLogStore(W, sink=W.vehicle_log_sink, tolerance=W.vehicle_log_tolerance)
+        W.VEHICLE_LOGS.extend(len(d["log_veh"]), {key: d["log_"+key] for key in VehicleLogStore.COLUMNS})
+
+        #ノード
+        signal = flat_to_ragged(d["node_signal"], d["node_signal_offsets"])
+        signal_log = flat_to_ragged(d["node_signal_log"], d["node_signal_log_offsets"])
+        generation_queue = flat_to_ragged(d["node_generation_queue"], d["node_generation_queue_offsets"])
+        incoming_vehicles = flat_to_ragged(d["node_incoming_vehicles"], d["node_incoming_vehicles_offsets"])
+        for i,n in enumerate(W.NODES):
+            n.signal = [int(g) if g.is_integer() else g for g in signal[i]]
+            n.signal_phase = d["node_signal_phase"][i].item()
+            n.signal_t = d["node_signal_t"][i].item()
+            n.signal_log = signal_log[i]
+            n.flow_capacity = none_if_nan(d["node_flow_capacity"][i].item())
+            n.flow_capacity_remain = d["node_flow_capacity_remain"][i].item()
+            n.generation_queue = deque(vehs[j] for j in generation_queue[i])
+            n.incoming_vehicles = [vehs[j] for j in incoming_vehicles[i]]
+
+        #リンク
+        link_vehicles = flat_to_ragged(d["link_vehicles"], d["link_vehicles_offsets"])
+        records_t = flat_to_ragged(d["link_traveltime_actual_records_t"], d["link_traveltime_actual_records_offsets"])
+        records_tt = flat_to_ragged(d["link_traveltime_actual_records_tt"], d["link_traveltime_actual_records_offsets"])
+        for i,l in enumerate(W.LINKS):
+            l.vehicles = deque(vehs[j] for j in link_vehicles[i])
+            for key in LINK_CHECKPOINT_ATTRIBUTES:
+                setattr(l, key, d["link_"+key][i].item())
+            l.capacity_in = none_if_nan(l.capacity_in)
+            l.capacity_out = none_if_nan(l.capacity_out)
+            l._vehicles_slow_count = d["link_vehicles_slow_count"][i].item()
+            l._tsize_recorded = d["link_tsize_recorded"][i].item()
+            l._cum_arrival = d["link_cum_arrival"][i].copy()
+            l._cum_departure = d["link_cum_departure"][i].copy()
+            l._traveltime_instant = d["link_traveltime_instant"][i].copy()
+            l._traveltime_actual = d["link_traveltime_actual"][i].copy()
+            l._traveltime_actual_records = list(zip(records_t[i], records_tt[i]))
+            l._traveltime_actual_records_applied = d["link_traveltime_actual_records_applied"][i].item()
+        if W.edie_state_online:
+            offsets = d["link_edie_offsets"]
+            for i,l in enumerate(W.LINKS):
+                l.tn_mat = d["link_tn_mat"][offsets[i]:offsets[i+1]].reshape(l.tn_mat.shape).copy()
+                l.dn_mat = d["link_dn_mat"][offsets[i]:offsets[i+1]].reshape(l.dn_mat.shape).copy()
+
+        #経路選択
+        W.ROUTECHOICE.next = d["rc_next"].copy()
+        W.ROUTECHOICE.dist = d["rc_dist"].copy()
+        W.ROUTECHOICE.route_pref_mat[:] = d["rc_route_pref_mat"] #route_prefの各行はこの行列のビューなので上書きする
+        W.ROUTECHOICE.searched = d["rc_searched"].copy()
+        W.ROUTECHOICE.dest_index = d["rc_dest_index"].copy()
+        W.ROUTECHOICE.route_search_log = [[int(t) if t.is_integer() else t, int(n1), int(n2)] for t,n1,n2 in d["rc_route_search_log"].tolist()]
+        for key in ["adj_mat_time", "pred", "tts_ref", "ijs", "tts_last"]:
+            setattr(W.ROUTECHOICE, key, d["rc_"+key].copy() if "rc_"+key in d else None)
+
+        #World
+        W.T = d["T"].item()
+        W.TIME = d["TIME"].item()
+        W.analyzer.average_speed = d["average_speed"].item()
+        W.analyzer.average_speed_count = d["average_speed_count"].item()
+        W.analyzer.flag_edie_state_computed = 0
+        W.analyzer.flag_trajectory_computed = 0
+        W.analyzer.flag_pandas_convert = 0
+        W.analyzer.flag_od_analysis = 0
+
+        #乱数の状態．車両の生成などで乱数を使うので最後に戻す
+        random.setstate((d["random_version"].item(), tuple(d["random_state"].tolist()), none_if_nan(d["random_gauss_next"].item())))
+        np.random.set_state(("MT19937", d["np_random_keys"], d["np_random_pos"].item(), d["np_random_has_gauss"].item(), d["np_random_cached_gaussian"].item()))
+
+    def fork(W, n=1):
+        """
+        Create branches of this World that continue from the current state independently, e.g., for evaluating alternative control actions.
+
+        Parameters
+        ----------
+        n : int, optional
+            The number of branches, default is 1.
+
+        Returns
+        -------
+        list of World
+            The branches.
+
+        Notes
+        -----
+        Unlike `copy()`, the World is not serialized. The nodes, links, vehicles, etc. are cloned and their references are remapped to the clones, so that only the mutable dynamic state (vehicle states and logs, queues, cumulative counts, route choice tables, etc.) is duplicated.
+        Immutable values and the static network arrays (`ADJ_MAT`, etc.) are shared with the original World. It also works for large networks where `copy()` exceeds the recursion limit.
+        Functions in `Vehicle.node_event` are shared, so closures still refer to the objects of the original World.
+        The states of `random` and `numpy.random` are global. To run the branches with the same random numbers, save them by `random.getstate()` and `np.random.get_state()` and restore them before each branch.
+        To run the branches in parallel, use `uxsim.Ensemble.run_branches()`.
+        """
+        return [W.fork_one() for i in range(n)]
+
+    def fork_one(W):
+        """
+        Create a branch of this World. See `fork()`.
+
+        Returns
+        -------
+        World
+            The branch.
+        """
+        #共有する不変の配列
+        memo = {}
+        if W.finalized:
+            for arr in [W.ADJ_MAT, W.ROUTECHOICE.link_start_ids, W.ROUTECHOICE.link_end_ids]:
+                memo[id(arr)] = arr
+
+        #まず全オブジェクトの空のクローンを作り，参照の付け替え先とする
+        if W.lazy_vehicle_creation:
+            vehs = W.VEHICLES.created()
+        else:
+            vehs = list(W.VEHICLES.values())
+        objs = [W] + W.NODES + W.LINKS + vehs + [W.DEPARTURE_SCHEDULER]
+        if W.finalized:
+            objs += [W.ROUTECHOICE, W.analyzer]
+        clones = []
+        for obj in objs:
+            clone = object.__new__(type(obj))
+            memo[id(obj)] = clone
+            clones.append(clone)
+        if W.finalized:
+            #route_prefの各行はroute_pref_matのビューなので，複製した行列のビューとして作り直す
+            route_pref_mat = W.ROUTECHOICE.route_pref_mat.copy()
+            memo[id(W.ROUTECHOICE.route_pref_mat)] = route_pref_mat
+            for k,pref in W.ROUTECHOICE.route_pref.items():
+                memo[id(pref)] = RoutePreference(memo[id(W)], route_pref_mat[k])
+
+        def remap_list(l):
+            return [memo.get(id(v), v) for v in l]
+
+        for obj, clone in zip(objs, clones):
+            d = {}
+            for key, value in obj.__dict__.items():
+                if type(obj) is Vehicle and key == "log_t_link":
+                    d[key] = [remap_list(tl) for tl in value]
+                elif type(obj) is Node and key == "signal_log":
+                    d[key] = value.copy()
+                elif type(obj) is Link and key == "_traveltime_actual_records":
+                    d[key] = value.copy()
+                else:
+                    d[key] = copy.deepcopy(value, memo)
+            clone.__dict__ = d
+
+        #ディスク上のログは共有できないので，分岐先ではメモリに読み込む
+        branch = memo[id(W)]
+        branch.VEHICLE_LOGS.load_to_memory()
+        branch.vehicle_log_sink = None
+        return branch
+
 
 class Route:
     """